@@ -1,30 +1,33 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, send_file
-from flask_sqlalchemy import SQLAlchemy
-from flask_mail import Mail, Message
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
-from datetime import datetime, timedelta
-import os
-import json
-import stripe
+# Grocery Website Application Factory
+#
+# create_app() builds the app: configuration, extensions, logging and one
+# blueprint per feature module. Nothing is set up at import time, so
+# importing this module is cheap and each worker or CLI command builds
+# exactly one app.
+#
+# Usage:
+#   flask --app app run
+#   gunicorn "app:create_app()"
+
 import logging
-from logging.handlers import RotatingFileHandler
+import os
 import secrets
-import uuid
-from functools import wraps
-import smtplib
-from email.mime.text import MimeText
-from email.mime.multipart import MimeMultipart
+from importlib import import_module
+from logging.handlers import RotatingFileHandler
+
+from flask import Flask
 
-app = Flask(__name__)
+from extensions import db, limiter
+from replicas import init_replicas
+from sqlite_profile import configure_sqlite
 
 # Configuration
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or secrets.token_hex(16)
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///grocery_store.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Comma-separated read replicas for @read_only views (see replicas.py)
+    SQLALCHEMY_REPLICA_URIS = [url.strip() for url in (os.environ.get('DATABASE_REPLICA_URLS') or '').split(',') if url.strip()]
     
     # Email Configuration
     MAIL_SERVER = os.environ.get('MAIL_SERVER') or 'smtp.gmail.com'
@@ -37,29 +40,94 @@ class Config:
     # Stripe Configuration
     STRIPE_PUBLISHABLE_KEY = os.environ.get('STRIPE_PUBLISHABLE_KEY')
     STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
+    STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE')  # e.g. a local fake Stripe server
+    STRIPE_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('STRIPE_CONNECT_TIMEOUT_SECONDS') or 2)
+    STRIPE_TIMEOUT_SECONDS = float(os.environ.get('STRIPE_TIMEOUT_SECONDS') or 8)
+    STRIPE_MAX_NETWORK_RETRIES = int(os.environ.get('STRIPE_MAX_NETWORK_RETRIES') or 1)  # safe with idempotency keys
+    STRIPE_BREAKER_FAILURES = int(os.environ.get('STRIPE_BREAKER_FAILURES') or 5)
+    STRIPE_BREAKER_RESET_SECONDS = float(os.environ.get('STRIPE_BREAKER_RESET_SECONDS') or 30)
     
     # File Upload Configuration
     UPLOAD_FOLDER = 'static/uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
-
-app.config.from_object(Config)
-
-# Initialize extensions
-db = SQLAlchemy(app)
-mail = Mail(app)
-limiter = Limiter(
-    app,
-    key_func=get_remote_address,
-    default_limits=["200 per day", "50 per hour"]
+    IMAGE_URL_PREFIX = os.environ.get('IMAGE_URL_PREFIX') or '/static/uploads'  # where UPLOAD_FOLDER is served
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS') or 2)  # resize processes; 0 renders in the request
+    
+    # In-memory catalog snapshot for product browsing (see catalog_snapshot.py)
+    CATALOG_REFRESH_SECONDS = float(os.environ.get('CATALOG_REFRESH_SECONDS') or 5)
+    SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE') or 1000)  # cached queries per worker
+    SEARCH_CACHE_MAX_IDS = int(os.environ.get('SEARCH_CACHE_MAX_IDS') or 1000000)
+    
+    # Point of sale barcode index (see pos.py)
+    POS_INDEX_REFRESH_SECONDS = float(os.environ.get('POS_INDEX_REFRESH_SECONDS') or 5)
+    
+    # Inventory Log Archival
+    INVENTORY_LOG_RETENTION_DAYS = int(os.environ.get('INVENTORY_LOG_RETENTION_DAYS') or 90)
+    INVENTORY_ARCHIVE_FOLDER = os.environ.get('INVENTORY_ARCHIVE_FOLDER') or 'archive/inventory_log'
+    
+    # Delivery Route Batching
+    DISPATCH_DISTANCE_MATRIX = os.environ.get('DISPATCH_DISTANCE_MATRIX') or 'data/postal_distances.csv'
+    DISPATCH_DEPOT_POSTAL_CODE = os.environ.get('DISPATCH_DEPOT_POSTAL_CODE') or 'DEPOT'
+    
+    # SQLite Production Profile (file-based SQLite only, see sqlite_profile.py)
+    SQLITE_PRODUCTION_PROFILE = os.environ.get('SQLITE_PRODUCTION_PROFILE', 'true').lower() in ['true', 'on', '1']
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS') or 5000)
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB') or 65536)
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 256 * 1024 * 1024)
+    SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE') or 10)
+    SQLITE_POOL_OVERFLOW = int(os.environ.get('SQLITE_POOL_OVERFLOW') or 10)
+
+# Feature modules, each exposing a blueprint named bp
+BLUEPRINT_MODULES = (
+    'routes',
+    'search_and_analytics',
+    'buy_again',
+    'catalog_import',
+    'coupons',
+    'delivery_slots',
+    'dispatch',
+    'exports',
+    'image_uploads',
+    'inventory_archive',
+    'inventory_expiry',
+    'low_stock',
+    'order_lifecycle',
+    'payments',
+    'pos',
+    'recommendations',
+    'reorder',
+    'replicas',
+    'search_synonyms',
 )
 
-# Set up Stripe
-if app.config['STRIPE_SECRET_KEY']:
-    stripe.api_key = app.config['STRIPE_SECRET_KEY']
+def create_app(config_object=Config):
+    """Create and configure the Flask application"""
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    
+    # Initialize extensions; mail and Stripe are set up on first use (see extensions.py)
+    configure_sqlite(app)
+    db.init_app(app)
+    init_replicas(app)
+    limiter.init_app(app)
+    
+    configure_logging(app)
+    
+    for name in BLUEPRINT_MODULES:
+        app.register_blueprint(import_module(name).bp)
+    
+    # Tills look barcodes up in memory, so load them before the first scan
+    import_module('pos').init_barcode_index(app)
+    # Resize workers are spawned here rather than forked from a request thread
+    import_module('image_uploads').init_image_pool(app)
+    
+    return app
 
-# Set up logging
-if not app.debug:
+def configure_logging(app):
+    """Rotating file log outside debug mode"""
+    if app.debug:
+        return
     if not os.path.exists('logs'):
         os.mkdir('logs')
     file_handler = RotatingFileHandler('logs/grocery_app.log', maxBytes=10240, backupCount=10)
@@ -70,267 +138,3 @@ if not app.debug:
     app.logger.addHandler(file_handler)
     app.logger.setLevel(logging.INFO)
     app.logger.info('Grocery app startup')
-
-# Enhanced Database Models
-class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(120), nullable=False)
-    first_name = db.Column(db.String(50))
-    last_name = db.Column(db.String(50))
-    phone = db.Column(db.String(20))
-    address = db.Column(db.Text)
-    city = db.Column(db.String(50))
-    postal_code = db.Column(db.String(10))
-    is_admin = db.Column(db.Boolean, default=False)
-    is_active = db.Column(db.Boolean, default=True)
-    email_verified = db.Column(db.Boolean, default=False)
-    verification_token = db.Column(db.String(100))
-    reset_token = db.Column(db.String(100))
-    reset_token_expires = db.Column(db.DateTime)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    last_login = db.Column(db.DateTime)
-    
-    # Relationships
-    orders = db.relationship('Order', backref='user', lazy=True)
-    cart_items = db.relationship('CartItem', backref='user', lazy=True)
-    reviews = db.relationship('Review', backref='user', lazy=True)
-    wishlist_items = db.relationship('WishlistItem', backref='user', lazy=True)
-
-class Category(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    description = db.Column(db.Text)
-    image_url = db.Column(db.String(200))
-    is_active = db.Column(db.Boolean, default=True)
-    sort_order = db.Column(db.Integer, default=0)
-    
-    # Relationships
-    products = db.relationship('Product', backref='category', lazy=True)
-
-class Product(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    description = db.Column(db.Text)
-    price = db.Column(db.Float, nullable=False)
-    original_price = db.Column(db.Float)  # For discounts
-    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
-    image_url = db.Column(db.String(200))
-    stock_quantity = db.Column(db.Integer, default=0)
-    min_stock_level = db.Column(db.Integer, default=10)
-    is_available = db.Column(db.Boolean, default=True)
-    is_featured = db.Column(db.Boolean, default=False)
-    weight = db.Column(db.Float)  # in kg
-    unit = db.Column(db.String(20))  # piece, kg, liter, etc.
-    barcode = db.Column(db.String(50))
-    brand = db.Column(db.String(100))
-    expiry_date = db.Column(db.Date)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    
-    # Relationships
-    cart_items = db.relationship('CartItem', backref='product', lazy=True)
-    order_items = db.relationship('OrderItem', backref='product', lazy=True)
-    reviews = db.relationship('Review', backref='product', lazy=True)
-    wishlist_items = db.relationship('WishlistItem', backref='product', lazy=True)
-    
-    @property
-    def average_rating(self):
-        reviews = Review.query.filter_by(product_id=self.id).all()
-        if reviews:
-            return sum(review.rating for review in reviews) / len(reviews)
-        return 0
-    
-    @property
-    def review_count(self):
-        return Review.query.filter_by(product_id=self.id).count()
-
-class CartItem(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
-    quantity = db.Column(db.Integer, nullable=False)
-    added_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class Order(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    order_number = db.Column(db.String(20), unique=True, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    total_amount = db.Column(db.Float, nullable=False)
-    tax_amount = db.Column(db.Float, default=0)
-    delivery_fee = db.Column(db.Float, default=0)
-    discount_amount = db.Column(db.Float, default=0)
-    status = db.Column(db.String(50), default='pending')  # pending, confirmed, processing, shipped, delivered, cancelled
-    payment_status = db.Column(db.String(50), default='pending')  # pending, paid, failed, refunded
-    payment_method = db.Column(db.String(50))
-    stripe_payment_intent_id = db.Column(db.String(100))
-    delivery_address = db.Column(db.Text)
-    delivery_date = db.Column(db.DateTime)
-    delivery_time_slot = db.Column(db.String(50))
-    special_instructions = db.Column(db.Text)
-    tracking_number = db.Column(db.String(100))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    
-    # Relationships
-    order_items = db.relationship('OrderItem', backref='order', lazy=True)
-    
-    def __init__(self, **kwargs):
-        super(Order, self).__init__(**kwargs)
-        if not self.order_number:
-            self.order_number = self.generate_order_number()
-    
-    def generate_order_number(self):
-        return f"ORD{datetime.now().strftime('%Y%m%d')}{secrets.token_hex(4).upper()}"
-
-class OrderItem(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
-    quantity = db.Column(db.Integer, nullable=False)
-    price = db.Column(db.Float, nullable=False)
-    total = db.Column(db.Float, nullable=False)
-
-class Review(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
-    rating = db.Column(db.Integer, nullable=False)  # 1-5 stars
-    title = db.Column(db.String(200))
-    comment = db.Column(db.Text)
-    is_verified_purchase = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class WishlistItem(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
-    added_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class Coupon(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    code = db.Column(db.String(50), unique=True, nullable=False)
-    description = db.Column(db.String(200))
-    discount_type = db.Column(db.String(20))  # percentage, fixed
-    discount_value = db.Column(db.Float, nullable=False)
-    min_order_amount = db.Column(db.Float, default=0)
-    max_discount_amount = db.Column(db.Float)
-    usage_limit = db.Column(db.Integer)
-    used_count = db.Column(db.Integer, default=0)
-    is_active = db.Column(db.Boolean, default=True)
-    valid_from = db.Column(db.DateTime, default=datetime.utcnow)
-    valid_until = db.Column(db.DateTime)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class Newsletter(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    is_active = db.Column(db.Boolean, default=True)
-    subscribed_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class ContactMessage(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    email = db.Column(db.String(120), nullable=False)
-    subject = db.Column(db.String(200))
-    message = db.Column(db.Text, nullable=False)
-    is_read = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class InventoryLog(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
-    change_type = db.Column(db.String(50))  # restock, sale, adjustment, expired
-    quantity_change = db.Column(db.Integer, nullable=False)
-    previous_quantity = db.Column(db.Integer, nullable=False)
-    new_quantity = db.Column(db.Integer, nullable=False)
-    reason = db.Column(db.String(200))
-    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-# Utility Functions
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
-
-def login_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            return jsonify({'error': 'Authentication required'}), 401
-        return f(*args, **kwargs)
-    return decorated_function
-
-def admin_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session or not session.get('is_admin'):
-            return jsonify({'error': 'Admin access required'}), 403
-        return f(*args, **kwargs)
-    return decorated_function
-
-def send_email(to_email, subject, template, **kwargs):
-    """Send email using Flask-Mail or SMTP"""
-    try:
-        if app.config['MAIL_USERNAME']:
-            msg = Message(
-                subject=subject,
-                recipients=[to_email],
-                html=render_template(f'emails/{template}', **kwargs),
-                sender=app.config['MAIL_DEFAULT_SENDER']
-            )
-            mail.send(msg)
-        else:
-            # Fallback SMTP
-            print(f"Email would be sent to {to_email}: {subject}")
-        return True
-    except Exception as e:
-        app.logger.error(f"Failed to send email: {str(e)}")
-        return False
-
-def update_inventory(product_id, quantity_change, change_type, reason=None, user_id=None):
-    """Update product inventory and log the change"""
-    product = Product.query.get(product_id)
-    if product:
-        previous_quantity = product.stock_quantity
-        product.stock_quantity += quantity_change
-        
-        # Log the inventory change
-        log = InventoryLog(
-            product_id=product_id,
-            change_type=change_type,
-            quantity_change=quantity_change,
-            previous_quantity=previous_quantity,
-            new_quantity=product.stock_quantity,
-            reason=reason,
-            created_by=user_id
-        )
-        db.session.add(log)
-        
-        # Check for low stock alert
-        if product.stock_quantity <= product.min_stock_level:
-            # Send low stock alert to admin
-            send_email(
-                'admin@grocery.com',
-                'Low Stock Alert',
-                'low_stock_alert.html',
-                product=product
-            )
-        
-        db.session.commit()
-        return True
-    return False
-
-print("Enhanced Flask application with all features loaded!")
-print("Features included:")
-print("- User authentication and profiles")
-print("- Product management with inventory tracking")
-print("- Shopping cart and wishlist")
-print("- Order processing with payment integration")
-print("- Email notifications")
-print("- Search and filtering")
-print("- Reviews and ratings")
-print("- Coupon system")
-print("- Admin dashboard")
-print("- File upload handling")
-print("- Logging and monitoring")
\ No newline at end of file
@@ -0,0 +1,687 @@
+# Benchmark Suite for the Grocery Website
+#
+# Seeds a synthetic SQLite database and drives the catalog, search, cart,
+# checkout and analytics endpoints through the Flask test client.
+#
+# Usage:
+#   python benchmark.py --scale small --requests 200
+#   python benchmark.py --promotions
+#   python benchmark.py --import-time
+#   python benchmark.py --fuzzy
+#   python benchmark.py --concurrency --scale small --duration 10
+#   python benchmark.py --scale medium --save baseline.json
+#   python benchmark.py --scale medium --compare baseline.json
+
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Row counts per scale: products, users, reviews, orders
+SCALES = {
+    'tiny': {'products': 1000, 'users': 200, 'reviews': 2000, 'orders': 2000},
+    'small': {'products': 10000, 'users': 2000, 'reviews': 20000, 'orders': 20000},
+    'medium': {'products': 100000, 'users': 20000, 'reviews': 200000, 'orders': 200000},
+    'large': {'products': 1000000, 'users': 100000, 'reviews': 2000000, 'orders': 2000000},
+}
+
+CATEGORY_NAMES = [
+    'Fruits', 'Vegetables', 'Dairy', 'Bakery', 'Meat', 'Seafood', 'Frozen',
+    'Beverages', 'Snacks', 'Pantry', 'Household', 'Personal Care',
+]
+
+WORDS = [
+    'organic', 'fresh', 'milk', 'bread', 'eggs', 'banana', 'apple', 'cheese',
+    'chocolate', 'butter', 'yogurt', 'chicken', 'rice', 'pasta', 'tomato',
+    'coffee', 'tea', 'juice', 'water', 'cereal', 'honey', 'salmon', 'beef',
+    'spinach', 'potato', 'onion', 'garlic', 'lemon', 'orange', 'grape',
+]
+
+BRANDS = ['Acme', 'FarmFresh', 'GreenValley', 'Sunrise', 'Golden', 'Nature', 'Daily', 'Harvest']
+
+INSERT_BATCH = 5000
+IMPORT_BUDGET_SECONDS = 1.0  # cold import + create_app() for a freshly spawned worker
+FUZZY_BUDGET_US = 300  # typo correction per search query
+
+
+def configure_environment(db_path):
+    """Point the application at the benchmark database before it is imported"""
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+
+
+def load_application():
+    """Build the application with every feature blueprint registered"""
+    from app import Config, create_app
+    from extensions import db
+
+    class BenchmarkConfig(Config):
+        TESTING = True
+        RATELIMIT_ENABLED = False
+
+    return create_app(BenchmarkConfig), db
+
+
+def _batched(rows, size=INSERT_BATCH):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _bulk_insert(db, model, rows):
+    """Insert plain dict rows with executemany, bypassing the ORM unit of work"""
+    table = model.__table__
+    for batch in _batched(rows):
+        db.session.execute(table.insert(), batch)
+    db.session.commit()
+
+
+def seed_database(db, scale, seed=42):
+    """Populate the database with a deterministic synthetic data set"""
+    from models import User, Category, Product, Review, Order, OrderItem, Coupon
+
+    counts = SCALES[scale]
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+
+    db.drop_all()
+    db.create_all()
+
+    _bulk_insert(db, Category, (
+        {'id': i + 1, 'name': name, 'is_active': True, 'sort_order': i}
+        for i, name in enumerate(CATEGORY_NAMES)
+    ))
+
+    _bulk_insert(db, User, (
+        {
+            'id': i,
+            'username': f'user{i}',
+            'email': f'user{i}@example.com',
+            'password_hash': 'benchmark',
+            'first_name': 'Bench',
+            'last_name': f'User{i}',
+            'postal_code': f'{10000 + i % 500}',
+            'is_admin': i == 1,
+            'is_active': True,
+            'created_at': now - timedelta(days=rng.randint(0, 730)),
+        }
+        for i in range(1, counts['users'] + 1)
+    ))
+
+    def product_rows():
+        for i in range(1, counts['products'] + 1):
+            price = round(rng.uniform(0.5, 50), 2)
+            yield {
+                'id': i,
+                'name': f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {i}",
+                'description': ' '.join(rng.choice(WORDS) for _ in range(8)),
+                'price': price,
+                'original_price': price * 1.2 if i % 7 == 0 else None,
+                'category_id': rng.randint(1, len(CATEGORY_NAMES)),
+                'stock_quantity': rng.randint(0, 500),
+                'min_stock_level': 10,
+                'is_available': i % 50 != 0,
+                'is_featured': i % 100 == 0,
+                'unit': 'piece',
+                'barcode': f'{400000000000 + i:013d}',
+                'brand': rng.choice(BRANDS),
+                'expiry_date': (now + timedelta(days=rng.randint(1, 365))).date(),
+                'created_at': now - timedelta(days=rng.randint(0, 730)),
+                'updated_at': now,
+            }
+
+    _bulk_insert(db, Product, product_rows())
+
+    _bulk_insert(db, Review, (
+        {
+            'user_id': rng.randint(1, counts['users']),
+            'product_id': rng.randint(1, counts['products']),
+            'rating': rng.randint(1, 5),
+            'title': 'Benchmark review',
+            'comment': ' '.join(rng.choice(WORDS) for _ in range(12)),
+            'created_at': now - timedelta(days=rng.randint(0, 365)),
+        }
+        for _ in range(counts['reviews'])
+    ))
+
+    def order_rows():
+        for i in range(1, counts['orders'] + 1):
+            yield {
+                'id': i,
+                'order_number': f'BENCH{i:012d}',
+                'user_id': rng.randint(1, counts['users']),
+                'total_amount': round(rng.uniform(5, 300), 2),
+                'tax_amount': 0,
+                'delivery_fee': 0,
+                'discount_amount': 0,
+                'status': 'delivered',
+                'payment_status': 'paid' if i % 10 else 'pending',
+                'created_at': now - timedelta(days=rng.randint(0, 365)),
+                'updated_at': now,
+            }
+
+    _bulk_insert(db, Order, order_rows())
+
+    def order_item_rows():
+        for order_id in range(1, counts['orders'] + 1):
+            for _ in range(rng.randint(1, 6)):
+                price = round(rng.uniform(0.5, 50), 2)
+                quantity = rng.randint(1, 4)
+                yield {
+                    'order_id': order_id,
+                    'product_id': rng.randint(1, counts['products']),
+                    'quantity': quantity,
+                    'price': price,
+                    'total': price * quantity,
+                }
+
+    _bulk_insert(db, OrderItem, order_item_rows())
+
+    _bulk_insert(db, Coupon, [{
+        'code': 'BENCH10',
+        'description': 'Benchmark coupon',
+        'discount_type': 'percentage',
+        'discount_value': 10,
+        'min_order_amount': 0,
+        'is_active': True,
+        'used_count': 0,
+        'valid_from': now - timedelta(days=1),
+        'valid_until': now + timedelta(days=365),
+    }])
+
+    return counts
+
+
+class QueryCounter:
+    """Count SQL statements issued against an engine"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        from sqlalchemy import event
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+        return False
+
+
+def _login(client, user_id, is_admin=False):
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+        sess['username'] = f'user{user_id}'
+        sess['is_admin'] = is_admin
+
+
+def _fill_cart(db, user_id, product_count, rng, lines=8):
+    from models import CartItem
+    CartItem.query.filter_by(user_id=user_id).delete()
+    for product_id in rng.sample(range(1, product_count + 1), lines):
+        db.session.add(CartItem(user_id=user_id, product_id=product_id, quantity=rng.randint(1, 3)))
+    db.session.commit()
+
+
+def build_scenarios(db, counts, rng):
+    """Return (name, setup, request) triples for every benchmarked endpoint"""
+    product_count = counts['products']
+    shopper_id = 2
+
+    def no_setup(client):
+        pass
+
+    def shopper(client):
+        _login(client, shopper_id)
+
+    def shopper_with_cart(client):
+        _login(client, shopper_id)
+        _fill_cart(db, shopper_id, product_count, rng)
+
+    def admin(client):
+        _login(client, 1, is_admin=True)
+
+    return [
+        ('get_products', no_setup,
+         lambda c: c.get(f'/api/products?page={rng.randint(1, 50)}&sort_by=price')),
+        ('get_products_filtered', no_setup,
+         lambda c: c.get(f'/api/products?category_id={rng.randint(1, len(CATEGORY_NAMES))}'
+                         f'&min_price=5&max_price=20&in_stock_only=true')),
+        ('search_products', no_setup,
+         lambda c: c.get(f'/api/search?q={rng.choice(WORDS)}')),
+        ('search_suggestions', no_setup,
+         lambda c: c.get(f'/api/search/suggestions?q={rng.choice(WORDS)[:3]}')),
+        ('get_cart', shopper_with_cart,
+         lambda c: c.get('/api/cart')),
+        ('create_order', shopper_with_cart,
+         lambda c: c.post('/api/orders', json={
+             'delivery_address': '1 Benchmark Street',
+             'payment_method': 'card',
+             'coupon_code': 'BENCH10',
+         })),
+        ('analytics_dashboard', admin,
+         lambda c: c.get('/api/admin/analytics/dashboard?days=30')),
+    ]
+
+
+def bench_promotions(rule_counts=(10, 100, 1000, 5000), lines=100, iterations=200, seed=42):
+    """Measure cart pricing cost as the number of active promotions grows"""
+    from promotions import CompiledPromotions, Promotion
+
+    rng = random.Random(seed)
+    catalog = 100000
+    categories = len(CATEGORY_NAMES)
+    cart = [{
+        'product_id': rng.randint(1, catalog),
+        'category_id': rng.randint(1, categories),
+        'price': round(rng.uniform(0.5, 50), 2),
+        'quantity': rng.randint(1, 6),
+    } for _ in range(lines)]
+    cart_ids = [line['product_id'] for line in cart]
+
+    results = []
+    for count in rule_counts:
+        rules = []
+        for i in range(count):
+            kind = ('percent_off', 'bogo', 'bundle', 'tiered_spend')[i % 4]
+            # A tenth of product rules target products in the cart so some rules match
+            product_id = rng.choice(cart_ids) if i % 10 == 0 else rng.randint(1, catalog)
+            rule = Promotion(id=i + 1, name=f'promo {i}', promo_type=kind, is_active=True)
+            if kind == 'percent_off':
+                rule.percent = rng.choice([5, 10, 20])
+                if i % 3:
+                    rule.product_id = product_id
+                else:
+                    rule.category_id = rng.randint(1, categories)
+            elif kind == 'bogo':
+                rule.product_id, rule.buy_quantity, rule.get_quantity = product_id, 2, 1
+            elif kind == 'bundle':
+                rule.bundle_product_ids = json.dumps([product_id, rng.choice(cart_ids)])
+                rule.bundle_price = 5.0
+            else:
+                rule.tiers = json.dumps([{'min_spend': 50, 'discount': 5}, {'min_spend': 100, 'discount': 12}])
+            rules.append(rule)
+
+        start = time.perf_counter()
+        compiled = CompiledPromotions(rules)
+        compile_ms = (time.perf_counter() - start) * 1000
+
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            compiled.price(cart)
+            samples.append(time.perf_counter() - start)
+        results.append({
+            'name': f'price_cart_{count}_rules',
+            'rules': count,
+            'compile_ms': compile_ms,
+            'p50_us': _percentile(samples, 50) * 1e6,
+            'p99_us': _percentile(samples, 99) * 1e6,
+        })
+
+    print(f"{'rules':>8}{'compile ms':>12}{'p50 us':>10}{'p99 us':>10}   ({lines}-line cart)")
+    for r in results:
+        print(f"{r['rules']:>8}{r['compile_ms']:>12.2f}{r['p50_us']:>10.1f}{r['p99_us']:>10.1f}")
+    return results
+
+
+def _misspell(word, rng):
+    """word with one random insertion, deletion, substitution or transposition"""
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    i = rng.randrange(len(word))
+    edit = rng.choice(('insert', 'delete', 'substitute', 'transpose'))
+    if edit == 'insert':
+        return word[:i] + rng.choice(letters) + word[i:]
+    if edit == 'delete':
+        return word[:i] + word[i + 1:]
+    if edit == 'substitute':
+        return word[:i] + rng.choice(letters) + word[i + 1:]
+    i = min(i, len(word) - 2)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def bench_fuzzy(vocabulary_sizes=(1000, 10000, 50000, 100000), queries=2000, seed=42, budget_us=FUZZY_BUDGET_US):
+    """Typo correction build time and per-query latency as the vocabulary grows"""
+    from fuzzy_search import FuzzyDictionary
+
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    results = []
+    for size in vocabulary_sizes:
+        vocabulary = set(WORDS)
+        while len(vocabulary) < size:
+            vocabulary.add(''.join(rng.choice(letters) for _ in range(rng.randint(4, 12))))
+        vocabulary = sorted(vocabulary)
+
+        start = time.perf_counter()
+        dictionary = FuzzyDictionary()
+        for word in vocabulary:
+            dictionary.add_word(word, rng.randint(1, 100))
+        build_ms = (time.perf_counter() - start) * 1000
+        dictionary.is_known('warmup')
+
+        # Two-word queries with one misspelt word, like "bannana bread"
+        terms = [[_misspell(rng.choice(vocabulary), rng), rng.choice(vocabulary)] for _ in range(queries)]
+        samples = []
+        corrected = 0
+        for query in terms:
+            start = time.perf_counter()
+            result = dictionary.correct(query)
+            samples.append(time.perf_counter() - start)
+            corrected += result != query
+        results.append({
+            'name': f'fuzzy_{size}_words',
+            'words': size,
+            'build_ms': build_ms,
+            'index_keys': len(dictionary.index),
+            'p50_us': _percentile(samples, 50) * 1e6,
+            'p99_us': _percentile(samples, 99) * 1e6,
+            'corrected': corrected / queries,
+        })
+
+    print(f"{'words':>8}{'build ms':>10}{'index keys':>12}{'p50 us':>10}{'p99 us':>10}{'corrected':>11}"
+          f"   (budget {budget_us} us)")
+    for r in results:
+        flag = '' if r['p99_us'] <= budget_us else '  OVER BUDGET'
+        print(f"{r['words']:>8}{r['build_ms']:>10.0f}{r['index_keys']:>12}{r['p50_us']:>10.1f}"
+              f"{r['p99_us']:>10.1f}{r['corrected']:>11.1%}{flag}")
+    return results
+
+
+def bench_concurrency(db_path, scale='tiny', readers=8, writers=2, duration=5.0, seed=42):
+    """Catalog read latency while checkouts write, with the SQLite profile off and on"""
+    import sqlite3
+    import threading
+    from app import Config, create_app
+    from extensions import db
+
+    results = []
+    for profile in (False, True):
+        class ConcurrencyConfig(Config):
+            TESTING = True
+            RATELIMIT_ENABLED = False
+            SQLITE_PRODUCTION_PROFILE = profile
+
+        # journal_mode is stored in the file, so reset it for the baseline run
+        connection = sqlite3.connect(db_path)
+        try:
+            connection.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            connection.close()
+        app = create_app(ConcurrencyConfig)
+        with app.app_context():
+            counts = seed_database(db, scale, seed=seed)
+
+        reads, writes, errors = [], [], []
+        stop_at = time.perf_counter() + duration
+
+        def timed(samples, call):
+            start = time.perf_counter()
+            try:
+                response = call()
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+            except Exception as e:  # e.g. database is locked
+                errors.append(type(e).__name__)
+            samples.append(time.perf_counter() - start)
+
+        def reader(n):
+            rng = random.Random(seed + n)
+            client = app.test_client()
+            while time.perf_counter() < stop_at:
+                if rng.random() < 0.5:
+                    timed(reads, lambda: client.get(f'/api/products?page={rng.randint(1, 50)}'))
+                else:
+                    timed(reads, lambda: client.get(f"/api/products/{rng.randint(1, counts['products'])}"))
+
+        def writer(n):
+            rng = random.Random(seed + 1000 + n)
+            user_id = 2 + n
+            client = app.test_client()
+            _login(client, user_id)
+            while time.perf_counter() < stop_at:
+                with app.app_context():
+                    try:
+                        _fill_cart(db, user_id, counts['products'], rng)
+                    except Exception as e:
+                        db.session.rollback()
+                        errors.append(type(e).__name__)
+                        continue
+                timed(writes, lambda: client.post('/api/orders', json={
+                    'delivery_address': '1 Benchmark Street',
+                    'payment_method': 'card',
+                }))
+
+        threads = [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+        threads += [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with app.app_context():
+            db.engine.dispose()
+
+        results.append({
+            'profile': 'wal+pool' if profile else 'default',
+            'reads_per_second': len(reads) / duration,
+            'read_p50_ms': _percentile(reads, 50) * 1000 if reads else 0,
+            'read_p99_ms': _percentile(reads, 99) * 1000 if reads else 0,
+            'checkouts_per_second': len(writes) / duration,
+            'checkout_p50_ms': _percentile(writes, 50) * 1000 if writes else 0,
+            'errors': len(errors),
+        })
+
+    print(f"{'profile':<10}{'reads/s':>10}{'read p50':>10}{'read p99':>10}"
+          f"{'checkouts/s':>13}{'co p50':>10}{'errors':>8}   ({readers} readers, {writers} writers, {duration:.0f}s)")
+    for r in results:
+        print(f"{r['profile']:<10}{r['reads_per_second']:>10.1f}{r['read_p50_ms']:>10.2f}{r['read_p99_ms']:>10.2f}"
+              f"{r['checkouts_per_second']:>13.1f}{r['checkout_p50_ms']:>10.2f}{r['errors']:>8}")
+    return results
+
+
+def bench_import_time(runs=5, budget=IMPORT_BUDGET_SECONDS):
+    """Time `from app import create_app; create_app()` in fresh interpreters against the budget"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    boot = 'from app import create_app; create_app()'
+    timed = f'import time; start = time.perf_counter(); {boot}; print(time.perf_counter() - start)'
+
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', timed], cwd=here, capture_output=True, text=True, check=True)
+        samples.append(float(result.stdout.strip().splitlines()[-1]))
+
+    # Cumulative time of each top-level import, to show what a regression pulled in
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', boot], cwd=here, capture_output=True, text=True, check=True)
+    top_level = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if cumulative.strip().isdigit() and not name[1:].startswith(' '):
+            top_level.append((int(cumulative), name.strip()))
+
+    median = statistics.median(samples)
+    print(f"create_app() cold start: median {median * 1000:.0f} ms, max {max(samples) * 1000:.0f} ms "
+          f"over {runs} runs (budget {budget * 1000:.0f} ms)")
+    print(f"\n{'module':<32}{'cumulative ms':>14}")
+    for cumulative, name in sorted(top_level, reverse=True)[:10]:
+        print(f"{name:<32}{cumulative / 1000:>14.1f}")
+    return median <= budget
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_scenario(app, db, name, setup, request, iterations, warmup=5):
+    """Run one scenario and return its latency, throughput and query statistics"""
+    client = app.test_client()
+    latencies = []
+    queries = []
+    errors = 0
+
+    for i in range(warmup + iterations):
+        # setup runs outside the timed section (e.g. refilling the cart)
+        setup(client)
+        with QueryCounter(db.engine) as counter:
+            start = time.perf_counter()
+            response = request(client)
+            elapsed = time.perf_counter() - start
+        if i < warmup:
+            continue
+        if response.status_code >= 400:
+            errors += 1
+        latencies.append(elapsed)
+        queries.append(counter.count)
+
+    total = sum(latencies)
+    return {
+        'name': name,
+        'iterations': iterations,
+        'errors': errors,
+        'throughput_rps': iterations / total if total else 0,
+        'p50_ms': _percentile(latencies, 50) * 1000,
+        'p99_ms': _percentile(latencies, 99) * 1000,
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'queries_per_request': statistics.mean(queries),
+    }
+
+
+def compare_results(baseline, current, threshold=0.10):
+    """Compare two result sets and flag p50 regressions above the threshold"""
+    previous = {r['name']: r for r in baseline['results']}
+    report = []
+    for result in current['results']:
+        before = previous.get(result['name'])
+        if not before:
+            continue
+        change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] if before['p50_ms'] else 0
+        report.append({
+            'name': result['name'],
+            'p50_before_ms': before['p50_ms'],
+            'p50_after_ms': result['p50_ms'],
+            'p50_change': change,
+            'queries_before': before['queries_per_request'],
+            'queries_after': result['queries_per_request'],
+            'regression': change > threshold,
+        })
+    return report
+
+
+def print_results(results):
+    print(f"{'scenario':<24}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}{'queries':>10}{'errors':>8}")
+    for r in results:
+        print(f"{r['name']:<24}{r['throughput_rps']:>10.1f}{r['p50_ms']:>10.2f}"
+              f"{r['p99_ms']:>10.2f}{r['queries_per_request']:>10.1f}{r['errors']:>8}")
+
+
+def print_comparison(report):
+    print(f"\n{'scenario':<24}{'p50 before':>12}{'p50 after':>12}{'change':>10}{'queries':>14}")
+    for r in report:
+        flag = '  REGRESSION' if r['regression'] else ''
+        print(f"{r['name']:<24}{r['p50_before_ms']:>12.2f}{r['p50_after_ms']:>12.2f}"
+              f"{r['p50_change']:>+10.1%}{r['queries_before']:>7.1f}->{r['queries_after']:<6.1f}{flag}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the grocery store API')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per scenario')
+    parser.add_argument('--only', action='append', help='run only the named scenario(s)')
+    parser.add_argument('--db', help='reuse an existing benchmark database file')
+    parser.add_argument('--skip-seed', action='store_true', help='do not reseed an existing --db')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', help='write results as a JSON baseline')
+    parser.add_argument('--compare', help='compare against a saved JSON baseline')
+    parser.add_argument('--promotions', action='store_true',
+                        help='only run the cart pricing benchmark over growing promotion counts')
+    parser.add_argument('--concurrency', action='store_true',
+                        help='only measure catalog reads during concurrent checkouts, SQLite profile off vs on')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per --concurrency run')
+    parser.add_argument('--fuzzy', action='store_true',
+                        help='only run the typo correction benchmark over growing vocabularies')
+    parser.add_argument('--import-time', action='store_true',
+                        help=f'only check cold start time against the {IMPORT_BUDGET_SECONDS:.0f}s budget')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix='grocery-bench-'), 'bench.db')
+    configure_environment(db_path)
+
+    if args.promotions:
+        bench_promotions()
+        return 0
+
+    if args.fuzzy:
+        bench_fuzzy()
+        return 0
+
+    if args.import_time:
+        return 0 if bench_import_time() else 1
+
+    if args.concurrency:
+        bench_concurrency(db_path, args.scale, duration=args.duration, seed=args.seed)
+        return 0
+
+    app, db = load_application()
+
+    with app.app_context():
+        if args.skip_seed and args.db:
+            counts = SCALES[args.scale]
+        else:
+            start = time.perf_counter()
+            counts = seed_database(db, args.scale, seed=args.seed)
+            print(f"Seeded '{args.scale}' data set in {time.perf_counter() - start:.1f}s ({db_path})")
+
+        rng = random.Random(args.seed)
+        results = []
+        for name, setup, request in build_scenarios(db, counts, rng):
+            if args.only and name not in args.only:
+                continue
+            results.append(run_scenario(app, db, name, setup, request, args.requests))
+
+    print_results(results)
+    output = {
+        'scale': args.scale,
+        'requests': args.requests,
+        'created_at': datetime.utcnow().isoformat(),
+        'python': sys.version.split()[0],
+        'results': results,
+    }
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(output, f, indent=2)
+        print(f"\nBaseline written to {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        report = compare_results(baseline, output)
+        print_comparison(report)
+        if any(r['regression'] for r in report):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,218 @@
+# Personalized "Buy Again" Lists for the Grocery Website
+#
+# PurchaseProfile keeps one row per (user, product) with purchase frequency,
+# last purchase and quantities, updated incrementally whenever an order is
+# paid. The buy-again list is then a single indexed read instead of a scan
+# over the user's orders.
+#
+# Usage:
+#   flask rebuild-purchase-profiles   # backfill from existing paid orders
+
+from datetime import datetime
+
+import click
+from flask import Blueprint, request, jsonify, session
+from sqlalchemy import bindparam, case, func
+
+from extensions import db
+from models import Product, Order, OrderItem, CartItem
+from auth import login_required
+
+bp = Blueprint('buy_again', __name__, cli_group=None)
+
+
+class PurchaseProfile(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    times_bought = db.Column(db.Integer, default=0)
+    total_quantity = db.Column(db.Integer, default=0)
+    last_quantity = db.Column(db.Integer, default=0)
+    last_bought_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_purchase_profile_user_frequency', 'user_id', 'times_bought'),
+    )
+
+    @property
+    def typical_quantity(self):
+        return max(1, round(self.total_quantity / self.times_bought)) if self.times_bought else 1
+
+
+def record_purchase(user_id, items, bought_at=None):
+    """Fold one paid order's (product_id, quantity) lines into the user's profile"""
+    bought_at = bought_at or datetime.utcnow()
+    quantities = {}
+    for product_id, quantity in items:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    if not quantities:
+        return
+
+    existing = {row[0] for row in db.session.query(PurchaseProfile.product_id).filter(
+        PurchaseProfile.user_id == user_id,
+        PurchaseProfile.product_id.in_(list(quantities))
+    )}
+
+    table = PurchaseProfile.__table__
+    updates = [{
+        '_user_id': user_id,
+        '_product_id': product_id,
+        '_quantity': quantity,
+        '_bought_at': bought_at,
+    } for product_id, quantity in quantities.items() if product_id in existing]
+    inserts = [{
+        'user_id': user_id,
+        'product_id': product_id,
+        'times_bought': 1,
+        'total_quantity': quantity,
+        'last_quantity': quantity,
+        'last_bought_at': bought_at,
+    } for product_id, quantity in quantities.items() if product_id not in existing]
+
+    if updates:
+        db.session.execute(
+            table.update().where(
+                (table.c.user_id == bindparam('_user_id')) & (table.c.product_id == bindparam('_product_id'))
+            ).values(
+                times_bought=table.c.times_bought + 1,
+                total_quantity=table.c.total_quantity + bindparam('_quantity'),
+                last_quantity=bindparam('_quantity'),
+                last_bought_at=bindparam('_bought_at'),
+            ),
+            updates
+        )
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+
+
+def rebuild_purchase_profiles():
+    """Recompute every profile from paid orders with one INSERT ... SELECT"""
+    table = PurchaseProfile.__table__
+    source = db.select(
+        Order.user_id,
+        OrderItem.product_id,
+        func.count(func.distinct(Order.id)),
+        func.sum(OrderItem.quantity),
+        func.max(OrderItem.quantity),
+        func.max(Order.created_at)
+    ).select_from(OrderItem).join(Order, Order.id == OrderItem.order_id).filter(
+        Order.payment_status == 'paid'
+    ).group_by(Order.user_id, OrderItem.product_id)
+
+    db.session.execute(table.delete())
+    # last_quantity is approximated by the largest line quantity during a rebuild
+    db.session.execute(table.insert().from_select(
+        ['user_id', 'product_id', 'times_bought', 'total_quantity', 'last_quantity', 'last_bought_at'], source
+    ))
+    db.session.commit()
+    return db.session.query(func.count()).select_from(table).scalar()
+
+
+def buy_again_list(user_id, limit=20, product_ids=None):
+    """Most frequently bought available products, most recent first on ties"""
+    query = db.session.query(PurchaseProfile, Product).join(
+        Product, Product.id == PurchaseProfile.product_id
+    ).filter(
+        PurchaseProfile.user_id == user_id,
+        Product.is_available == True
+    )
+    if product_ids is not None:
+        query = query.filter(PurchaseProfile.product_id.in_(product_ids))
+    return query.order_by(
+        PurchaseProfile.times_bought.desc(), PurchaseProfile.last_bought_at.desc()
+    ).limit(limit).all()
+
+
+def _upsert(table):
+    # INSERT ... ON CONFLICT has the same API on SQLite and PostgreSQL
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def bulk_add_to_cart(user_id, quantities):
+    """Add {product_id: quantity} to the cart with one executemany upsert, capped at current stock"""
+    if not quantities:
+        return 0
+    table = CartItem.__table__
+    statement = _upsert(table)
+    combined = table.c.quantity + statement.excluded.quantity
+    stock = db.select(Product.stock_quantity).where(Product.id == table.c.product_id).scalar_subquery()
+    now = datetime.utcnow()
+    db.session.execute(
+        statement.on_conflict_do_update(
+            index_elements=['user_id', 'product_id'],
+            set_={'quantity': case((combined > stock, stock), else_=combined)}
+        ),
+        [{
+            'user_id': user_id,
+            'product_id': product_id,
+            'quantity': quantity,
+            'added_at': now,
+        } for product_id, quantity in quantities.items()]
+    )
+    db.session.commit()
+    return len(quantities)
+
+
+@bp.route('/api/me/buy-again')
+@login_required
+def get_buy_again():
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    return jsonify([{
+        'product_id': product.id,
+        'name': product.name,
+        'price': product.price,
+        'original_price': product.original_price,
+        'image_url': product.image_url,
+        'unit': product.unit,
+        'stock_quantity': product.stock_quantity,
+        'times_bought': profile.times_bought,
+        'typical_quantity': profile.typical_quantity,
+        'last_bought_at': profile.last_bought_at.isoformat() if profile.last_bought_at else None
+    } for profile, product in buy_again_list(session['user_id'], limit)])
+
+
+@bp.route('/api/me/buy-again/add-to-cart', methods=['POST'])
+@login_required
+def add_buy_again_to_cart():
+    data = request.get_json(silent=True) or {}
+    product_ids = data.get('product_ids')
+    limit = data.get('limit', 20)
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+        return jsonify({'error': 'limit must be a positive integer'}), 400
+    if product_ids is not None and (
+        not isinstance(product_ids, list)
+        or not all(isinstance(product_id, int) and not isinstance(product_id, bool) for product_id in product_ids)
+    ):
+        return jsonify({'error': 'product_ids must be a list of product ids'}), 400
+
+    # Requested products are filtered before the limit, so none fall outside the top N
+    items = buy_again_list(session['user_id'], min(limit, 100), product_ids or None)
+
+    # Typical quantity, capped at what is in stock; out of stock items are skipped
+    quantities = {}
+    skipped = []
+    for profile, product in items:
+        quantity = min(profile.typical_quantity, product.stock_quantity or 0)
+        if quantity > 0:
+            quantities[product.id] = quantity
+        else:
+            skipped.append(product.id)
+
+    added = bulk_add_to_cart(session['user_id'], quantities)
+    return jsonify({
+        'success': True,
+        'added': added,
+        'skipped_out_of_stock': skipped,
+        'message': f'{added} items added to cart'
+    })
+
+
+@bp.cli.command('rebuild-purchase-profiles')
+def rebuild_purchase_profiles_command():
+    """Backfill buy-again profiles from all paid orders"""
+    PurchaseProfile.__table__.create(db.engine, checkfirst=True)
+    click.echo(f'Rebuilt {rebuild_purchase_profiles()} purchase profiles')
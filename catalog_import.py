@@ -0,0 +1,322 @@
+# Bulk Catalog Import for the Grocery Website
+#
+# Streams supplier feeds (CSV or JSON lines) in chunks and upserts products by
+# barcode with executemany statements instead of one ORM object per row.
+# Product.barcode is unique; a chunk that loses an insert race to another
+# import is rolled back and run again, when those barcodes are updates.
+#
+# Usage:
+#   flask import-catalog feed.csv
+#   flask import-catalog feed.jsonl --format jsonl --chunk-size 10000
+
+import csv
+import json
+import time
+from datetime import datetime, date
+
+import click
+from flask import Blueprint
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import Product, Category, InventoryLog
+from low_stock import sync_low_stock
+from pos import barcode_index
+
+bp = Blueprint('catalog_import', __name__, cli_group=None)
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# Feed columns copied onto Product as-is after conversion
+PRODUCT_FIELDS = {
+    'name': str,
+    'description': str,
+    'price': float,
+    'original_price': float,
+    'image_url': str,
+    'stock_quantity': int,
+    'min_stock_level': int,
+    'weight': float,
+    'unit': str,
+    'brand': str,
+    'is_available': bool,
+    'is_featured': bool,
+}
+
+
+class RowError(ValueError):
+    """Raised when a feed row cannot be imported"""
+
+
+def read_csv(stream):
+    """Yield feed rows from a CSV file with a header line"""
+    for row in csv.DictReader(stream):
+        yield row
+
+
+def read_jsonl(stream):
+    """Yield feed rows from a JSON lines file; a line that is not valid JSON is yielded as its text"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield line
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+def _to_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ['true', '1', 'yes', 'y']
+
+
+def _to_date(value):
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value).strip()[:10], '%Y-%m-%d').date()
+
+
+def validate_row(raw):
+    """Convert a raw feed row into Product column values"""
+    if not isinstance(raw, dict):
+        raise RowError('row is not a JSON object')
+    barcode = str(raw.get('barcode') or '').strip()
+    if not barcode:
+        raise RowError('barcode is required')
+    if not str(raw.get('name') or '').strip():
+        raise RowError('name is required')
+    category = str(raw.get('category') or '').strip()
+    if not category:
+        raise RowError('category is required')
+
+    row = {'barcode': barcode}
+    for field, convert in PRODUCT_FIELDS.items():
+        value = raw.get(field)
+        if value is None or value == '':
+            continue
+        try:
+            row[field] = _to_bool(value) if convert is bool else convert(value)
+        except (TypeError, ValueError):
+            raise RowError(f'{field} is not a valid {convert.__name__}')
+
+    if 'price' not in row:
+        raise RowError('price is required')
+    if row['price'] < 0:
+        raise RowError('price must not be negative')
+    if row.get('stock_quantity', 0) < 0:
+        raise RowError('stock_quantity must not be negative')
+
+    if raw.get('expiry_date'):
+        try:
+            row['expiry_date'] = _to_date(raw['expiry_date'])
+        except ValueError:
+            raise RowError('expiry_date must be YYYY-MM-DD')
+
+    row['name'] = row['name'].strip()
+    return row, category
+
+
+class CategoryResolver:
+    """Map category names to ids, creating unknown categories on demand"""
+
+    def __init__(self):
+        self.ids = {
+            name.strip().lower(): category_id
+            for category_id, name in db.session.query(Category.id, Category.name)
+        }
+
+    def resolve(self, names):
+        missing = {}
+        for name in names:
+            key = name.strip().lower()
+            if key not in self.ids:
+                missing.setdefault(key, name.strip())
+        if missing:
+            db.session.execute(Category.__table__.insert(), [
+                {'name': name, 'is_active': True, 'sort_order': 0} for name in missing.values()
+            ])
+            for category_id, name in db.session.query(Category.id, Category.name).filter(
+                Category.name.in_(list(missing.values()))
+            ):
+                self.ids[name.strip().lower()] = category_id
+        return self.ids
+
+    def __getitem__(self, name):
+        return self.ids[name.strip().lower()]
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_chunk(chunk, categories, user_id=None):
+    """Upsert one chunk of validated rows and batch its inventory log entries"""
+    # Last occurrence of a barcode inside a chunk wins
+    by_barcode = {}
+    for row, category in chunk:
+        by_barcode[row['barcode']] = (dict(row), category)  # rows are reused if the chunk is retried
+
+    categories.resolve(category for _, category in by_barcode.values())
+
+    existing = {
+        barcode: (product_id, stock)
+        for product_id, barcode, stock in db.session.query(
+            Product.id, Product.barcode, Product.stock_quantity
+        ).filter(Product.barcode.in_(list(by_barcode)))
+    }
+
+    now = datetime.utcnow()
+    inserts = []
+    updates = []
+    logs = []
+
+    for barcode, (row, category) in by_barcode.items():
+        row['category_id'] = categories[category]
+        row['updated_at'] = now
+        if barcode in existing:
+            product_id, previous = existing[barcode]
+            update = dict(row, _id=product_id)
+            updates.append(update)
+            new_stock = row.get('stock_quantity')
+            if new_stock is not None and new_stock != (previous or 0):
+                logs.append({
+                    'product_id': product_id,
+                    'change_type': 'restock' if new_stock > (previous or 0) else 'adjustment',
+                    'quantity_change': new_stock - (previous or 0),
+                    'previous_quantity': previous or 0,
+                    'new_quantity': new_stock,
+                    'reason': 'Catalog import',
+                    'created_by': user_id,
+                    'created_at': now,
+                })
+        else:
+            row.setdefault('stock_quantity', 0)
+            row.setdefault('created_at', now)
+            inserts.append(row)
+
+    if updates:
+        # executemany needs identical keys in every parameter set, so group by key set
+        groups = {}
+        for update in updates:
+            groups.setdefault(tuple(sorted(update)), []).append(update)
+        table = Product.__table__
+        for keys, params in groups.items():
+            # bind names must not clash with column names in an UPDATE ... SET clause
+            values = {key: bindparam(f'new_{key}') for key in keys if key != '_id'}
+            db.session.execute(
+                table.update().where(table.c.id == bindparam('_id')).values(values),
+                [{(k if k == '_id' else f'new_{k}'): v for k, v in p.items()} for p in params]
+            )
+
+    if inserts:
+        groups = {}
+        for row in inserts:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        for params in groups.values():
+            db.session.execute(Product.__table__.insert(), params)
+
+        new_ids = dict(db.session.query(Product.barcode, Product.id).filter(
+            Product.barcode.in_([row['barcode'] for row in inserts])
+        ))
+        for row in inserts:
+            if row['stock_quantity']:
+                logs.append({
+                    'product_id': new_ids[row['barcode']],
+                    'change_type': 'restock',
+                    'quantity_change': row['stock_quantity'],
+                    'previous_quantity': 0,
+                    'new_quantity': row['stock_quantity'],
+                    'reason': 'Catalog import',
+                    'created_by': user_id,
+                    'created_at': now,
+                })
+
+    if logs:
+        db.session.execute(InventoryLog.__table__.insert(), logs)
+
+    sync_low_stock(
+        [product_id for product_id, _ in existing.values()]
+        + (list(new_ids.values()) if inserts else [])
+    )
+    db.session.commit()
+    # Core statements bypass the ORM events that keep this process's till index
+    # current; other workers pick the new prices up from updated_at (see pos.py)
+    barcode_index.refresh(barcodes=by_barcode)
+    return len(inserts), len(updates)
+
+
+def import_catalog(stream, fmt='csv', chunk_size=DEFAULT_CHUNK_SIZE, user_id=None, on_error=None):
+    """Import a supplier feed and return counts and throughput"""
+    reader = READERS[fmt]
+    categories = CategoryResolver()
+    stats = {'rows': 0, 'inserted': 0, 'updated': 0, 'rejected': 0}
+    start = time.perf_counter()
+
+    def valid_rows():
+        for line_number, raw in enumerate(reader(stream), start=1):
+            stats['rows'] += 1
+            try:
+                yield validate_row(raw)
+            except RowError as e:
+                stats['rejected'] += 1
+                if on_error:
+                    on_error(line_number, raw, str(e))
+
+    for chunk in _chunks(valid_rows(), chunk_size):
+        try:
+            inserted, updated = import_chunk(chunk, categories, user_id=user_id)
+        except IntegrityError:
+            # Another import inserted some of these barcodes first
+            db.session.rollback()
+            categories = CategoryResolver()  # categories created in the rolled back transaction are gone
+            inserted, updated = import_chunk(chunk, categories, user_id=user_id)
+        stats['inserted'] += inserted
+        stats['updated'] += updated
+
+    stats['seconds'] = time.perf_counter() - start
+    stats['rows_per_second'] = stats['rows'] / stats['seconds'] if stats['seconds'] else 0
+    return stats
+
+
+@bp.cli.command('import-catalog')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(sorted(READERS)), help='defaults to the file extension')
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True)
+@click.option('--errors', 'errors_path', type=click.Path(dir_okay=False), help='write rejected rows as JSON lines')
+def import_catalog_command(path, fmt, chunk_size, errors_path):
+    """Import products from a CSV or JSONL supplier feed"""
+    fmt = fmt or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    for index in Product.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+    errors_file = open(errors_path, 'w', encoding='utf-8') if errors_path else None
+
+    def on_error(line_number, raw, message):
+        if errors_file:
+            errors_file.write(json.dumps({'line': line_number, 'error': message, 'row': raw}) + '\n')
+
+    try:
+        with open(path, newline='', encoding='utf-8') as stream:
+            stats = import_catalog(stream, fmt=fmt, chunk_size=chunk_size, on_error=on_error)
+    finally:
+        if errors_file:
+            errors_file.close()
+
+    click.echo(
+        f"Imported {stats['rows']} rows in {stats['seconds']:.1f}s "
+        f"({stats['rows_per_second']:.0f} rows/s): {stats['inserted']} inserted, "
+        f"{stats['updated']} updated, {stats['rejected']} rejected"
+    )
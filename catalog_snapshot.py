@@ -0,0 +1,380 @@
+# In-Memory Catalog Snapshot for the Grocery Website
+#
+# Product browsing (/api/products) is answered from NumPy column arrays held
+# in each worker instead of SQL. Filters become boolean masks, and the name,
+# price and newest-first orders are precomputed permutations, so a filtered,
+# sorted page costs one pass over the masks.
+#
+# A background thread per worker pulls only the products whose updated_at
+# moved (plus products with new reviews) every CATALOG_REFRESH_SECONDS and
+# patches the arrays copy-on-write. Requests never wait on the database once
+# the first snapshot is loaded. Listings can lag writes by up to one refresh
+# interval. Deltas only ever add rows, so when the snapshot holds more rows
+# than the product table the ids are diffed and deleted products dropped; a
+# full reload every FULL_RELOAD_SECONDS starts over from the table.
+# CATALOG_REFRESH_SECONDS = 0 turns the background thread off (call
+# refresh() yourself), and stop() ends it.
+#
+# /api/search uses the same columns, so its facet counts (brand, category,
+# price histogram, stock, rating) are bincounts over the match set rather than
+# one GROUP BY per facet. Misspelt search terms are corrected against the
+# catalog vocabulary first (see fuzzy_search.py). Approved search synonyms
+# are loaded with every refresh (see search_synonyms.py).
+
+import copy
+import json
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import func
+
+from extensions import db
+from fuzzy_search import FuzzyDictionary
+from search_synonyms import approved_synonyms
+from models import Category, Product, Review
+
+FULL_RELOAD_SECONDS = 3600
+# Rows committed late with an older updated_at are caught by re-reading this window
+DELTA_OVERLAP = timedelta(seconds=30)
+MIN_DATETIME = np.iinfo(np.int64).min
+COLUMNS = ('ids', 'price', 'stock', 'category', 'brand', 'featured', 'available', 'created_at', 'rating', 'names', 'search_text')
+PRICE_BUCKETS = (0, 2, 5, 10, 20, 50)
+FACET_LIMIT = 20
+_versions = itertools.count(1)
+
+
+def _product_rows(*criteria):
+    """Product rows with their rating aggregates, as (id, ..., rating, review_count) tuples"""
+    rating = db.select(func.avg(Review.rating)).where(Review.product_id == Product.id).scalar_subquery()
+    review_count = db.select(func.count(Review.id)).where(Review.product_id == Product.id).scalar_subquery()
+    query = db.session.query(
+        Product.id, Product.name, Product.description, Product.price, Product.original_price,
+        Product.image_url, Product.stock_quantity, Product.unit, Product.brand, Product.category_id,
+        Product.is_featured, Product.is_available, Product.created_at,
+        rating.label('rating'), review_count.label('review_count'),
+        Product.thumbnail_url, Product.image_variants
+    )
+    return [tuple(row) for row in query.filter(*criteria)]
+
+
+def _category_names():
+    return dict(db.session.query(Category.id, Category.name))
+
+
+def _payload(row):
+    """The /api/products JSON for one product row"""
+    return {
+        'id': row[0],
+        'name': row[1],
+        'description': row[2],
+        'price': row[3],
+        'original_price': row[4],
+        'image_url': row[15] or row[5],  # listings show the thumbnail once image_uploads made one
+        'image_variants': json.loads(row[16]) if row[16] else None,
+        'stock_quantity': row[6],
+        'unit': row[7],
+        'brand': row[8],
+        'category_id': row[9],
+        'is_featured': row[10],
+        'average_rating': float(row[13]) if row[14] else 0,
+        'review_count': row[14]
+    }
+
+
+def _text(row):
+    """The name, description and brand the vocabulary is built from"""
+    return row[1], row[2], row[8]
+
+
+def _timestamp(value):
+    return int(value.timestamp() * 1000000) if value else MIN_DATETIME
+
+
+class Catalog:
+    """One immutable version of the catalog columns"""
+
+    def __init__(self, rows, category_names, synonyms):
+        self.version = next(_versions)
+        self.rows = rows
+        self.category_names = category_names
+        self.synonyms = synonyms
+        self.positions = {row[0]: i for i, row in enumerate(rows)}
+        self.payloads = [_payload(row) for row in rows]
+        self.brands = sorted({row[8] for row in rows if row[8]})
+        self.brand_index = {brand: code for code, brand in enumerate(self.brands)}
+        self.ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.price = np.array([row[3] for row in rows], dtype=np.float64)
+        self.stock = np.array([row[6] or 0 for row in rows], dtype=np.int64)
+        self.category = np.array([row[9] for row in rows], dtype=np.int64)
+        self.brand = np.array([self.brand_index.get(row[8], -1) for row in rows], dtype=np.int64)
+        self.featured = np.array([bool(row[10]) for row in rows], dtype=bool)
+        self.available = np.array([bool(row[11]) for row in rows], dtype=bool)
+        self.created_at = np.array([_timestamp(row[12]) for row in rows], dtype=np.int64)
+        self.rating = np.array([row[13] or 0 for row in rows], dtype=np.float32)
+        self.names = np.array([row[1] for row in rows], dtype=str)
+        self.search_text = np.array([self._search_text(row) for row in rows], dtype=str)
+        self.vocabulary = FuzzyDictionary.from_texts(text for row in rows for text in _text(row))
+        self._sort()
+
+    @staticmethod
+    def _search_text(row):
+        return '\n'.join(value or '' for value in (row[1], row[2], row[8])).lower()
+
+    def _sort(self):
+        name_order = np.argsort(self.names, kind='stable')
+        price_order = np.argsort(self.price, kind='stable')
+        newest_first = np.argsort(-self.created_at, kind='stable')
+        self.orders = {
+            ('name', 'asc'): name_order,
+            ('name', 'desc'): name_order[::-1],
+            ('price', 'asc'): price_order,
+            ('price', 'desc'): np.argsort(-self.price, kind='stable'),
+            ('created_at', 'asc'): newest_first,
+            ('created_at', 'desc'): newest_first,
+        }
+
+    def with_changes(self, changed, category_names, synonyms):
+        """A new version with changed rows replaced and new rows appended"""
+        changed = [row for row in changed
+                   if row[0] not in self.positions or self.rows[self.positions[row[0]]] != row]
+        if not changed:
+            if category_names == self.category_names and synonyms == self.synonyms:
+                return self
+            new = copy.copy(self)
+            new.version = next(_versions)
+            new.category_names = category_names
+            new.synonyms = synonyms
+            return new
+        new = object.__new__(Catalog)
+        new.version = next(_versions)
+        new.category_names = category_names
+        new.synonyms = synonyms
+        new.rows = list(self.rows)
+        new.positions = dict(self.positions)
+        new.payloads = list(self.payloads)
+        new.brands = list(self.brands)
+        new.brand_index = dict(self.brand_index)
+        # Word counts follow the text only, not stock or price updates. Requests
+        # may still be correcting terms against the old version, so words are
+        # changed in a copy.
+        old_rows = [self.rows[self.positions[row[0]]] if row[0] in self.positions else None for row in changed]
+        retexted = [(old, row) for old, row in zip(old_rows, changed) if old is None or _text(old) != _text(row)]
+        new.vocabulary = self.vocabulary.copy() if retexted else self.vocabulary
+        for old, row in retexted:
+            for text in _text(old) if old is not None else ():
+                new.vocabulary.remove_text(text)
+            for text in _text(row):
+                new.vocabulary.add_text(text)
+        updates = []
+        for row in changed:
+            if row[0] not in new.positions:
+                new.positions[row[0]] = len(new.rows)
+                new.rows.append(row)
+                new.payloads.append(None)
+            if row[8] and row[8] not in new.brand_index:
+                new.brand_index[row[8]] = len(new.brands)
+                new.brands.append(row[8])
+            updates.append(new.positions[row[0]])
+
+        size = len(new.rows)
+        for name in COLUMNS:
+            column = getattr(self, name)
+            if name in ('names', 'search_text'):
+                column = column.astype(object)  # fixed-width strings could truncate longer values
+            if size > len(column):
+                column = np.concatenate([column, np.zeros(size - len(column), dtype=column.dtype)])
+            else:
+                column = column.copy()
+            setattr(new, name, column)
+
+        for position, row in zip(updates, changed):
+            new.rows[position] = row
+            new.payloads[position] = _payload(row)
+            new.ids[position] = row[0]
+            new.price[position] = row[3]
+            new.stock[position] = row[6] or 0
+            new.category[position] = row[9]
+            new.brand[position] = new.brand_index.get(row[8], -1)
+            new.featured[position] = bool(row[10])
+            new.available[position] = bool(row[11])
+            new.created_at[position] = _timestamp(row[12])
+            new.rating[position] = row[13] or 0
+            new.names[position] = row[1]
+            new.search_text[position] = self._search_text(row)
+        new.names = new.names.astype(str)
+        new.search_text = new.search_text.astype(str)
+        new._sort()
+        return new
+
+    def without(self, product_ids):
+        """A new version with the given products dropped"""
+        removed = {self.positions[product_id] for product_id in product_ids if product_id in self.positions}
+        if not removed:
+            return self
+        keep = np.ones(len(self.rows), dtype=bool)
+        keep[list(removed)] = False
+        new = copy.copy(self)
+        new.version = next(_versions)
+        new.rows = [row for position, row in enumerate(self.rows) if keep[position]]
+        new.payloads = [payload for position, payload in enumerate(self.payloads) if keep[position]]
+        new.positions = {row[0]: position for position, row in enumerate(new.rows)}
+        for name in COLUMNS:
+            setattr(new, name, getattr(self, name)[keep])
+        new.vocabulary = self.vocabulary.copy()
+        for position in removed:
+            for text in _text(self.rows[position]):
+                new.vocabulary.remove_text(text)
+        new._sort()
+        return new
+
+    def match(self, terms=(), category_id=None, brand=None, min_price=None, max_price=None,
+              in_stock_only=False, featured_only=False, min_rating=None, sort_by='name', sort_order='asc'):
+        """Row positions of every available product matching the filters, in sort order.
+
+        Every term must appear in the name, description or brand (case-insensitive).
+        """
+        mask = self.available.copy()
+        if category_id:
+            mask &= self.category == category_id
+        if brand:
+            mask &= self.brand == self.brand_index.get(brand, -2)
+        if min_price is not None:
+            mask &= self.price >= min_price
+        if max_price is not None:
+            mask &= self.price <= max_price
+        if in_stock_only:
+            mask &= self.stock > 0
+        if featured_only:
+            mask &= self.featured
+        if min_rating is not None:
+            mask &= self.rating >= min_rating
+        for term in terms:
+            mask &= np.char.find(self.search_text, term.lower()) >= 0
+
+        order = self.orders.get((sort_by, 'desc' if sort_order == 'desc' else 'asc'))
+        return order[mask[order]] if order is not None else np.flatnonzero(mask)
+
+    def query(self, category_id=None, search='', min_price=None, max_price=None,
+              in_stock_only=False, featured_only=False, sort_by='name', sort_order='asc',
+              page=1, per_page=20):
+        """Return (payloads for the page, total matches)"""
+        matches = self.match(
+            [search] if search else (), category_id, None, min_price, max_price,
+            in_stock_only, featured_only, None, sort_by, sort_order
+        )
+        start = (page - 1) * per_page
+        return [self.payloads[i] for i in matches[start:start + per_page]], len(matches)
+
+    def facets(self, matches):
+        """Brand, category, price, stock and rating counts over a match set, one bincount each"""
+        brand_counts = np.bincount(self.brand[matches] + 1, minlength=len(self.brands) + 1)[1:]
+        top_brands = np.argsort(-brand_counts, kind='stable')[:FACET_LIMIT]
+        categories, category_counts = np.unique(self.category[matches], return_counts=True)
+        price_buckets = np.searchsorted(PRICE_BUCKETS, self.price[matches], side='right') - 1
+        price_counts = np.bincount(price_buckets.clip(0), minlength=len(PRICE_BUCKETS))
+        in_stock = int(np.count_nonzero(self.stock[matches] > 0))
+        # Ratings run 1-5, so 0 means no reviews yet
+        stars = np.floor(self.rating[matches]).astype(np.int64).clip(0, 5)
+        rating_counts = np.bincount(stars, minlength=6)
+
+        return {
+            'brands': [{'value': self.brands[code], 'count': int(brand_counts[code])}
+                       for code in top_brands if brand_counts[code]],
+            'categories': sorted([{
+                'id': int(category_id),
+                'name': self.category_names.get(int(category_id)),
+                'count': int(count)
+            } for category_id, count in zip(categories, category_counts)], key=lambda facet: -facet['count']),
+            'price': [{
+                'min': low,
+                'max': PRICE_BUCKETS[i + 1] if i + 1 < len(PRICE_BUCKETS) else None,
+                'count': int(price_counts[i])
+            } for i, low in enumerate(PRICE_BUCKETS)],
+            'in_stock': {'in_stock': in_stock, 'out_of_stock': len(matches) - in_stock},
+            'rating': [{'stars': stars, 'count': int(rating_counts[stars])} for stars in range(5, 0, -1)]
+                      + [{'stars': None, 'count': int(rating_counts[0])}],
+        }
+
+
+class CatalogSnapshot:
+    """The current Catalog for one app, kept fresh by a background thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self.catalog = None
+        self._synced_at = None
+        self._last_review_id = 0
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def get(self):
+        if self.catalog is None:
+            with self._lock:
+                if self.catalog is None:
+                    self.reload()
+                    if self.app.config['CATALOG_REFRESH_SECONDS'] > 0 and not self._stopped.is_set():
+                        self._thread = threading.Thread(target=self._refresh_loop, name='catalog-snapshot', daemon=True)
+                        self._thread.start()
+        return self.catalog
+
+    def stop(self):
+        """End the background refresh, e.g. when the app is discarded"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def reload(self):
+        """Load every product; call inside an app context"""
+        started = datetime.utcnow()
+        self._last_review_id = db.session.query(func.max(Review.id)).scalar() or 0
+        self.catalog = Catalog(_product_rows(), _category_names(), approved_synonyms())
+        self._synced_at = started
+        self._loaded_at = time.monotonic()
+
+    def refresh(self):
+        """Apply products changed since the last sync; call inside an app context"""
+        if time.monotonic() - self._loaded_at > FULL_RELOAD_SECONDS:
+            return self.reload()
+        started = datetime.utcnow()
+        changed = _product_rows(Product.updated_at >= self._synced_at - DELTA_OVERLAP)
+
+        # New reviews change ratings without touching Product.updated_at
+        reviewed = db.session.query(Review.id, Review.product_id).filter(Review.id > self._last_review_id).all()
+        if reviewed:
+            self._last_review_id = max(review_id for review_id, _ in reviewed)
+            seen = {row[0] for row in changed}
+            product_ids = {product_id for _, product_id in reviewed} - seen
+            if product_ids:
+                changed.extend(_product_rows(Product.id.in_(product_ids)))
+
+        catalog = self.catalog.with_changes(changed, _category_names(), approved_synonyms())
+        if len(catalog.rows) > db.session.query(func.count(Product.id)).scalar():
+            existing = {product_id for product_id, in db.session.query(Product.id)}
+            catalog = catalog.without([product_id for product_id in catalog.positions if product_id not in existing])
+        self.catalog = catalog
+        self._synced_at = started
+
+    def _refresh_loop(self):
+        while not self._stopped.wait(self.app.config['CATALOG_REFRESH_SECONDS']):
+            with self.app.app_context():
+                try:
+                    with self._lock:
+                        self.refresh()
+                except Exception:
+                    self.app.logger.exception('Catalog snapshot refresh failed')
+
+
+def get_catalog():
+    """The current catalog snapshot for this app"""
+    snapshot = current_app.extensions.get('catalog_snapshot')
+    if snapshot is None:
+        snapshot = current_app.extensions.setdefault(
+            'catalog_snapshot', CatalogSnapshot(current_app._get_current_object())
+        )
+    return snapshot.get()
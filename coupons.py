@@ -0,0 +1,296 @@
+# Coupon Redemption Engine for the Grocery Website
+#
+# Usage limits are enforced with a conditional UPDATE, so concurrent checkouts
+# can never push used_count past usage_limit. Very hot coupons can be split
+# into counter shards, each holding part of the remaining allowance, so that
+# checkouts do not all wait on one row lock. The unsharded claim also requires
+# counter_shards = 0, so a worker whose cached definition predates sharding
+# re-reads it instead of spending used_count. Per-user limits number each
+# user's redemptions, and a unique (coupon, user, use number) constraint
+# rejects a concurrent redemption that takes the same number. Coupon
+# definitions are cached per process by code and invalidated when a Coupon
+# row is written.
+#
+# Usage:
+#   flask shard-coupon SUMMER10 --shards 16
+
+import random
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import click
+from flask import Blueprint
+from sqlalchemy import event, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, object_session
+
+from extensions import db
+from models import Coupon
+
+bp = Blueprint('coupons', __name__, cli_group=None)
+
+CACHE_TTL_SECONDS = 60  # bounds staleness of definitions changed by other workers
+
+CouponDefinition = namedtuple('CouponDefinition', [
+    'id', 'code', 'description', 'discount_type', 'discount_value', 'min_order_amount',
+    'max_discount_amount', 'usage_limit', 'per_user_limit', 'counter_shards',
+    'valid_from', 'valid_until',
+])
+
+
+class CouponRedemption(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    coupon_id = db.Column(db.Integer, db.ForeignKey('coupon.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'))
+    discount_amount = db.Column(db.Float, default=0)
+    shard = db.Column(db.Integer)  # counter shard that was charged, if any
+    use_number = db.Column(db.Integer)  # 1..per_user_limit for this user; NULL without a limit
+    redeemed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_coupon_redemption_coupon_user', 'coupon_id', 'user_id'),
+        db.UniqueConstraint('coupon_id', 'user_id', 'use_number', name='uq_coupon_redemption_use'),
+    )
+
+
+class CouponCounterShard(db.Model):
+    coupon_id = db.Column(db.Integer, db.ForeignKey('coupon.id'), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True)
+    allowance = db.Column(db.Integer)  # NULL means unlimited
+    used_count = db.Column(db.Integer, default=0)
+
+
+class CouponError(Exception):
+    """Raised when a coupon cannot be applied; the message is shown to the customer"""
+
+
+class CouponCache:
+    """Active coupon definitions keyed by upper-case code"""
+
+    def __init__(self, ttl=CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, code):
+        code = (code or '').strip().upper()
+        entry = self._entries.get(code)
+        if entry and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+
+        coupon = Coupon.query.filter_by(code=code, is_active=True).first()
+        definition = None
+        if coupon:
+            definition = CouponDefinition(
+                coupon.id, coupon.code, coupon.description, coupon.discount_type,
+                coupon.discount_value, coupon.min_order_amount or 0, coupon.max_discount_amount,
+                coupon.usage_limit, coupon.per_user_limit, coupon.counter_shards or 0,
+                coupon.valid_from, coupon.valid_until,
+            )
+        # Unknown codes are cached too, so guessing codes does not hit the database
+        with self._lock:
+            self._entries[code] = (definition, time.monotonic())
+        return definition
+
+    def invalidate(self, code=None):
+        with self._lock:
+            if code is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(code.strip().upper(), None)
+
+
+coupon_cache = CouponCache()
+
+
+@event.listens_for(Coupon, 'after_insert')
+@event.listens_for(Coupon, 'after_update')
+@event.listens_for(Coupon, 'after_delete')
+def _coupon_written(mapper, connection, target):
+    sess = object_session(target)
+    if sess is not None:
+        sess.info.setdefault('coupon_codes_written', set()).add(target.code)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_written_coupons(sess):
+    for code in sess.info.pop('coupon_codes_written', ()):
+        coupon_cache.invalidate(code)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_written_coupons(sess):
+    sess.info.pop('coupon_codes_written', None)
+
+
+def compute_discount(coupon, subtotal):
+    """Discount for a subtotal; percentage discounts honour max_discount_amount"""
+    if coupon.discount_type == 'percentage':
+        discount = subtotal * (coupon.discount_value / 100)
+        if coupon.max_discount_amount:
+            discount = min(discount, coupon.max_discount_amount)
+    else:  # fixed amount
+        discount = coupon.discount_value
+    return min(discount, subtotal)
+
+
+def coupon_usage(coupon):
+    """Redemptions so far, summed over shards for sharded coupons"""
+    if coupon.counter_shards:
+        return db.session.query(func.coalesce(func.sum(CouponCounterShard.used_count), 0)).filter(
+            CouponCounterShard.coupon_id == coupon.id
+        ).scalar()
+    return db.session.query(Coupon.used_count).filter(Coupon.id == coupon.id).scalar() or 0
+
+
+def check_coupon(code, subtotal, user_id=None):
+    """Return (coupon, discount) or raise CouponError; does not reserve a use"""
+    coupon = coupon_cache.get(code)
+    if not coupon:
+        raise CouponError('Invalid coupon code')
+
+    now = datetime.utcnow()
+    if coupon.valid_from and coupon.valid_from > now:
+        raise CouponError('Coupon is not active yet')
+    if coupon.valid_until and coupon.valid_until < now:
+        raise CouponError('Coupon has expired')
+    if coupon.usage_limit and coupon_usage(coupon) >= coupon.usage_limit:
+        raise CouponError('Coupon usage limit reached')
+    if user_id and coupon.per_user_limit and _user_redemptions(coupon.id, user_id) >= coupon.per_user_limit:
+        raise CouponError('You have already used this coupon')
+    if subtotal < coupon.min_order_amount:
+        raise CouponError(f'Minimum order amount is ${coupon.min_order_amount:.2f}')
+
+    return coupon, compute_discount(coupon, subtotal)
+
+
+def _user_redemptions(coupon_id, user_id):
+    return db.session.query(func.count(CouponRedemption.id)).filter(
+        CouponRedemption.coupon_id == coupon_id,
+        CouponRedemption.user_id == user_id
+    ).scalar()
+
+
+def _claim_unsharded(coupon):
+    table = Coupon.__table__
+    result = db.session.execute(
+        table.update().where(
+            table.c.id == coupon.id,
+            table.c.is_active == True,
+            func.coalesce(table.c.counter_shards, 0) == 0,
+            (table.c.usage_limit.is_(None)) | (table.c.used_count < table.c.usage_limit)
+        ).values(used_count=func.coalesce(table.c.used_count, 0) + 1)
+    )
+    return result.rowcount == 1
+
+
+def _claim_sharded(coupon):
+    table = CouponCounterShard.__table__
+    shards = list(range(coupon.counter_shards))
+    random.shuffle(shards)
+    # Start on a random shard; only move on when that shard's allowance is used up
+    for shard in shards:
+        result = db.session.execute(
+            table.update().where(
+                table.c.coupon_id == coupon.id,
+                table.c.shard == shard,
+                (table.c.allowance.is_(None)) | (table.c.used_count < table.c.allowance)
+            ).values(used_count=table.c.used_count + 1)
+        )
+        if result.rowcount == 1:
+            return shard
+    return None
+
+
+def _record_redemption(coupon, user_id, order_id, discount_amount, shard):
+    """Insert the redemption row; False if the user has reached per_user_limit"""
+    table = CouponRedemption.__table__
+    row = {
+        'coupon_id': coupon.id,
+        'user_id': user_id,
+        'order_id': order_id,
+        'discount_amount': discount_amount,
+        'shard': shard,
+        'redeemed_at': datetime.utcnow(),
+    }
+    if not coupon.per_user_limit:
+        db.session.execute(table.insert().values(**row))
+        return True
+
+    # Number this use after the user's earlier ones, only while under the limit
+    used = db.select(func.count()).select_from(table).where(
+        table.c.coupon_id == coupon.id, table.c.user_id == user_id
+    ).scalar_subquery()
+    source = db.select(
+        *[db.literal(value, table.c[name].type) for name, value in row.items()], used + 1
+    ).where(used < coupon.per_user_limit)
+    try:
+        result = db.session.execute(table.insert().from_select(list(row) + ['use_number'], source))
+    except IntegrityError:
+        # A concurrent checkout by the same user took this use number
+        return False
+    return result.rowcount == 1
+
+
+def redeem_coupon(coupon, user_id, order_id, discount_amount):
+    """Atomically claim one use of a coupon inside the caller's transaction.
+
+    Raises CouponError if the limit was reached concurrently; the caller should
+    roll back. Nothing is committed here, so a failed checkout releases the use.
+    """
+    if not coupon.counter_shards and not _claim_unsharded(coupon):
+        # The cached definition may predate sharding; only a fresh one can tell
+        coupon_cache.invalidate(coupon.code)
+        coupon = coupon_cache.get(coupon.code)
+        if not coupon or not coupon.counter_shards:
+            raise CouponError('Coupon usage limit reached')
+
+    shard = None
+    if coupon.counter_shards:
+        shard = _claim_sharded(coupon)
+        if shard is None:
+            raise CouponError('Coupon usage limit reached')
+
+    if not _record_redemption(coupon, user_id, order_id, discount_amount, shard):
+        raise CouponError('You have already used this coupon')
+
+
+def shard_coupon(code, shards):
+    """Split a coupon's remaining allowance across counter shards"""
+    coupon = Coupon.query.filter_by(code=code.strip().upper()).first()
+    if not coupon:
+        raise CouponError('Invalid coupon code')
+
+    used = coupon_usage(coupon)
+    CouponCounterShard.query.filter_by(coupon_id=coupon.id).delete()
+    remaining = None if coupon.usage_limit is None else max(coupon.usage_limit - used, 0)
+    rows = []
+    for shard in range(shards):
+        allowance = None
+        if remaining is not None:
+            allowance = remaining // shards + (1 if shard < remaining % shards else 0)
+        # Earlier redemptions are carried on shard 0 so the shard sum stays the total
+        rows.append({
+            'coupon_id': coupon.id,
+            'shard': shard,
+            'allowance': allowance if shard or allowance is None else allowance + used,
+            'used_count': used if shard == 0 else 0,
+        })
+    db.session.execute(CouponCounterShard.__table__.insert(), rows)
+    coupon.counter_shards = shards
+    coupon.used_count = used
+    db.session.commit()
+    return rows
+
+
+@bp.cli.command('shard-coupon')
+@click.argument('code')
+@click.option('--shards', default=16, show_default=True)
+def shard_coupon_command(code, shards):
+    """Spread a hot coupon's usage counter over several rows"""
+    CouponCounterShard.__table__.create(db.engine, checkfirst=True)
+    rows = shard_coupon(code, shards)
+    click.echo(f'{code.upper()} now uses {len(rows)} counter shards')
@@ -0,0 +1,373 @@
+# Delivery Slot Scheduler for the Grocery Website
+#
+# Delivery windows define the recurring time slots and their capacity; a
+# DeliverySlot row is materialized per window and date and carries the
+# counters. reserved_count covers bookings plus unexpired holds and only ever
+# moves through conditional UPDATEs, so a slot can never be overbooked however
+# many checkouts race for it. Availability for the next days is a read-only
+# query, cached per process for a few seconds so the evening rush is served
+# from memory; places held by expired holds are counted as free there and
+# taken back when someone claims the slot.
+#
+# Slot dates and start times are store-local wall-clock times and are always
+# compared with store_now(); hold expiry is kept in UTC. Slots are not created
+# on demand, so run the generator daily (e.g. from cron), and the hold sweep
+# every few minutes to keep the table small.
+#
+# Usage:
+#   flask generate-delivery-slots --days 14
+#   flask release-slot-holds
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import Blueprint, request, jsonify, session
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from auth import admin_required, login_required
+
+bp = Blueprint('delivery_slots', __name__, cli_group=None)
+
+HOLD_MINUTES = 10
+AVAILABILITY_TTL_SECONDS = 5
+MAX_DAYS_AHEAD = 14
+
+
+class DeliveryWindow(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100))
+    weekday = db.Column(db.Integer)  # 0 = Monday; NULL means every day
+    start_time = db.Column(db.String(5), nullable=False)  # HH:MM
+    end_time = db.Column(db.String(5), nullable=False)
+    capacity = db.Column(db.Integer, nullable=False)
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class DeliverySlot(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    window_id = db.Column(db.Integer, db.ForeignKey('delivery_window.id'), nullable=False)
+    slot_date = db.Column(db.Date, nullable=False, index=True)
+    start_time = db.Column(db.String(5), nullable=False)
+    end_time = db.Column(db.String(5), nullable=False)
+    capacity = db.Column(db.Integer, nullable=False)
+    reserved_count = db.Column(db.Integer, default=0)  # bookings plus unexpired holds
+    booked_count = db.Column(db.Integer, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('window_id', 'slot_date', name='uq_delivery_slot_window_date'),
+    )
+
+    @property
+    def label(self):
+        return f'{self.start_time}-{self.end_time}'
+
+    @property
+    def starts_at(self):
+        return datetime.combine(self.slot_date, datetime.strptime(self.start_time, '%H:%M').time())
+
+
+class SlotHold(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    slot_id = db.Column(db.Integer, db.ForeignKey('delivery_slot.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class SlotError(Exception):
+    """Raised when a slot cannot be held or booked; the message is shown to the customer"""
+
+
+def store_now():
+    """Current store-local time, the clock slot dates and start times are in"""
+    return datetime.now()
+
+
+def generate_slots(days=MAX_DAYS_AHEAD, start=None):
+    """Materialize slots for active windows over the next days; existing slots are kept"""
+    start = start or store_now().date()
+    end = start + timedelta(days=days)
+    windows = DeliveryWindow.query.filter_by(is_active=True).all()
+    existing = set(db.session.query(DeliverySlot.window_id, DeliverySlot.slot_date).filter(
+        DeliverySlot.slot_date >= start, DeliverySlot.slot_date < end
+    ))
+
+    rows = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        for window in windows:
+            if window.weekday is not None and window.weekday != day.weekday():
+                continue
+            if (window.id, day) in existing:
+                continue
+            rows.append({
+                'window_id': window.id,
+                'slot_date': day,
+                'start_time': window.start_time,
+                'end_time': window.end_time,
+                'capacity': window.capacity,
+                'reserved_count': 0,
+                'booked_count': 0,
+            })
+    if rows:
+        try:
+            db.session.execute(DeliverySlot.__table__.insert(), rows)
+            db.session.commit()
+        except IntegrityError:
+            # Another worker generated the same days first
+            db.session.rollback()
+            return 0
+    return len(rows)
+
+
+def _release_expired(slot_id, now):
+    # The rowcount of the DELETE is what gets released, so a hold converted
+    # into a booking concurrently is never given back twice
+    holds = SlotHold.__table__
+    slots = DeliverySlot.__table__
+    deleted = db.session.execute(holds.delete().where(
+        holds.c.slot_id == slot_id, holds.c.expires_at < now
+    )).rowcount
+    if deleted:
+        db.session.execute(slots.update().where(slots.c.id == slot_id).values(
+            reserved_count=slots.c.reserved_count - deleted
+        ))
+    return deleted
+
+
+def release_expired_holds(now=None):
+    """Delete expired holds and give their places back to the slots"""
+    now = now or datetime.utcnow()
+    slot_ids = [row[0] for row in db.session.query(SlotHold.slot_id).filter(
+        SlotHold.expires_at < now
+    ).distinct()]
+    released = sum(_release_expired(slot_id, now) for slot_id in slot_ids)
+    db.session.commit()
+    return released
+
+
+def _release_user_holds(user_id):
+    holds = SlotHold.__table__
+    slots = DeliverySlot.__table__
+    for hold_id, slot_id in db.session.query(SlotHold.id, SlotHold.slot_id).filter(SlotHold.user_id == user_id).all():
+        if db.session.execute(holds.delete().where(holds.c.id == hold_id)).rowcount:
+            db.session.execute(slots.update().where(slots.c.id == slot_id).values(
+                reserved_count=slots.c.reserved_count - 1
+            ))
+
+
+def _claim(slot_id, booked):
+    slots = DeliverySlot.__table__
+    values = {'reserved_count': slots.c.reserved_count + 1}
+    if booked:
+        values['booked_count'] = slots.c.booked_count + 1
+    claim = slots.update().where(
+        slots.c.id == slot_id,
+        slots.c.slot_date >= store_now().date(),
+        slots.c.reserved_count < slots.c.capacity
+    ).values(**values)
+    if db.session.execute(claim).rowcount == 1:
+        return True
+    # Full, unless expired holds are still counted; take their places back and retry
+    return bool(_release_expired(slot_id, datetime.utcnow())) and db.session.execute(claim).rowcount == 1
+
+
+def hold_slot(slot_id, user_id, minutes=HOLD_MINUTES):
+    """Reserve a place in a slot for a few minutes; returns (hold_id, expires_at)"""
+    _release_user_holds(user_id)  # one hold per customer
+    if not _claim(slot_id, booked=False):
+        db.session.rollback()
+        raise SlotError('This delivery slot is full')
+    expires_at = datetime.utcnow() + timedelta(minutes=minutes)
+    # Holds are only ever written through Core so no stale ORM copies are left around
+    result = db.session.execute(SlotHold.__table__.insert().values(
+        slot_id=slot_id, user_id=user_id, expires_at=expires_at, created_at=datetime.utcnow()
+    ))
+    db.session.commit()
+    return result.inserted_primary_key[0], expires_at
+
+
+def book_slot(slot_id, user_id, hold_id=None):
+    """Book a place in a slot inside the caller's transaction, using the hold if still valid.
+
+    Raises SlotError if the slot is full; the caller should roll back.
+    """
+    slot = DeliverySlot.query.get(slot_id)
+    if not slot:
+        raise SlotError('Invalid delivery slot')
+
+    holds = SlotHold.__table__
+    slots = DeliverySlot.__table__
+    converted = False
+    if hold_id:
+        converted = db.session.execute(holds.delete().where(
+            holds.c.id == hold_id,
+            holds.c.slot_id == slot_id,
+            holds.c.user_id == user_id,
+            holds.c.expires_at >= datetime.utcnow()
+        )).rowcount == 1
+    if converted:
+        # The place is already counted in reserved_count
+        db.session.execute(slots.update().where(slots.c.id == slot_id).values(
+            booked_count=slots.c.booked_count + 1
+        ))
+    elif not _claim(slot_id, booked=True):
+        raise SlotError('This delivery slot is full')
+    return slot
+
+
+def release_booking(slot_id, count=1):
+    """Give booked places back, e.g. when orders are cancelled"""
+    slots = DeliverySlot.__table__
+    db.session.execute(slots.update().where(
+        slots.c.id == slot_id, slots.c.booked_count >= count
+    ).values(
+        reserved_count=slots.c.reserved_count - count,
+        booked_count=slots.c.booked_count - count
+    ))
+
+
+def slot_availability(days):
+    """Slots from today for the next days with their remaining places; read-only"""
+    now = store_now()
+    today = now.date()
+    in_range = (DeliverySlot.slot_date >= today, DeliverySlot.slot_date < today + timedelta(days=days))
+    slots = DeliverySlot.query.filter(*in_range).order_by(DeliverySlot.slot_date, DeliverySlot.start_time).all()
+    # Places still counted for holds that have expired are free to claim
+    expired = dict(db.session.query(SlotHold.slot_id, func.count(SlotHold.id)).join(
+        DeliverySlot, DeliverySlot.id == SlotHold.slot_id
+    ).filter(SlotHold.expires_at < datetime.utcnow(), *in_range).group_by(SlotHold.slot_id))
+
+    availability = {}
+    for slot in slots:
+        if slot.starts_at <= now:
+            continue
+        available = max(slot.capacity - (slot.reserved_count or 0) + expired.get(slot.id, 0), 0)
+        availability.setdefault(slot.slot_date.isoformat(), []).append({
+            'slot_id': slot.id,
+            'time_slot': slot.label,
+            'capacity': slot.capacity,
+            'available': available,
+            'is_full': available == 0
+        })
+    return [{'date': day, 'slots': day_slots} for day, day_slots in availability.items()]
+
+
+class AvailabilityCache:
+    """Per-process availability snapshots; one thread refreshes while the rest serve the old one"""
+
+    def __init__(self, ttl=AVAILABILITY_TTL_SECONDS):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, days):
+        entry = self._entries.get(days)
+        if entry and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+        if entry and not self._lock.acquire(blocking=False):
+            return entry[0]
+        if not entry:
+            self._lock.acquire()
+        try:
+            entry = self._entries.get(days)
+            if not entry or time.monotonic() - entry[1] >= self.ttl:
+                entry = (slot_availability(days), time.monotonic())
+                self._entries[days] = entry
+            return entry[0]
+        finally:
+            self._lock.release()
+
+    def invalidate(self):
+        self._entries.clear()
+
+
+availability_cache = AvailabilityCache()
+
+
+@bp.route('/api/delivery-slots')
+def get_delivery_slots():
+    days = max(1, min(request.args.get('days', 7, type=int), MAX_DAYS_AHEAD))
+    response = jsonify(availability_cache.get(days))
+    # Counts may be a few seconds old; booking re-checks capacity atomically
+    response.headers['Cache-Control'] = f'public, max-age={AVAILABILITY_TTL_SECONDS}'
+    return response
+
+
+@bp.route('/api/delivery-slots/<int:slot_id>/hold', methods=['POST'])
+@login_required
+def hold_delivery_slot(slot_id):
+    try:
+        hold_id, expires_at = hold_slot(slot_id, session['user_id'])
+    except SlotError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify({
+        'success': True,
+        'hold_id': hold_id,
+        'slot_id': slot_id,
+        'expires_at': expires_at.isoformat()
+    })
+
+
+@bp.route('/api/delivery-slots/hold', methods=['DELETE'])
+@login_required
+def release_delivery_slot_hold():
+    _release_user_holds(session['user_id'])
+    db.session.commit()
+    return jsonify({'success': True})
+
+
+@bp.route('/api/admin/delivery-windows', methods=['GET', 'POST'])
+@admin_required
+def delivery_windows():
+    if request.method == 'POST':
+        data = request.get_json() or {}
+        try:
+            for field in ('start_time', 'end_time'):
+                datetime.strptime(data[field], '%H:%M')
+            capacity = int(data['capacity'])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'error': 'start_time, end_time (HH:MM) and capacity are required'}), 400
+
+        window = DeliveryWindow(
+            name=data.get('name'),
+            weekday=data.get('weekday'),
+            start_time=data['start_time'],
+            end_time=data['end_time'],
+            capacity=capacity
+        )
+        db.session.add(window)
+        db.session.commit()
+        generate_slots()
+        availability_cache.invalidate()
+        return jsonify({'success': True, 'window_id': window.id}), 201
+
+    return jsonify([{
+        'id': window.id,
+        'name': window.name,
+        'weekday': window.weekday,
+        'start_time': window.start_time,
+        'end_time': window.end_time,
+        'capacity': window.capacity,
+        'is_active': window.is_active
+    } for window in DeliveryWindow.query.order_by(DeliveryWindow.weekday, DeliveryWindow.start_time).all()])
+
+
+@bp.cli.command('generate-delivery-slots')
+@click.option('--days', default=MAX_DAYS_AHEAD, show_default=True)
+def generate_delivery_slots_command(days):
+    """Create delivery slots for the coming days from the active windows"""
+    for model in (DeliveryWindow, DeliverySlot, SlotHold):
+        model.__table__.create(db.engine, checkfirst=True)
+    click.echo(f'Created {generate_slots(days)} delivery slots')
+
+
+@bp.cli.command('release-slot-holds')
+def release_slot_holds_command():
+    """Release delivery slot holds that have expired"""
+    click.echo(f'Released {release_expired_holds()} expired holds')
@@ -0,0 +1,340 @@
+# Delivery Route Batching for the Grocery Website
+#
+# Confirmed orders for a delivery date are grouped by time slot and split into
+# vehicle runs: a nearest-neighbour pass from the depot over postal-code
+# distances builds runs of at most max_stops, then 2-opt shortens each run
+# until the time budget is spent. From the CLI, slots are planned in parallel
+# in a spawned process pool; the distance matrix is loaded once per worker.
+# The admin endpoint plans in the request thread within a few seconds in
+# total, so use the CLI for a longer search. Runs, stop sequences and tracking
+# numbers are written back with executemany; run numbers continue from the
+# highest one stored for the date and are unique, so two batches stored at
+# the same time cannot share a number or an order.
+#
+# The distance matrix is a local CSV of from_postal_code,to_postal_code,distance
+# rows (DISPATCH_DISTANCE_MATRIX); pairs missing from it are treated as far
+# apart rather than failing the batch.
+#
+# Usage:
+#   flask batch-routes --date 2024-05-01 --max-stops 25 --time-budget 30
+
+import csv
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+
+import click
+import numpy as np
+from flask import Blueprint, current_app, request, jsonify
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import Order, User
+from auth import admin_required
+
+bp = Blueprint('dispatch', __name__, cli_group=None)
+
+DISPATCH_STATUSES = ('confirmed', 'processing')
+UNKNOWN_DISTANCE_FACTOR = 2  # unknown pairs count as twice the longest known distance
+REQUEST_TIME_BUDGET = 5  # seconds of planning for a batch started from the admin endpoint
+
+
+class DeliveryRun(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    run_number = db.Column(db.String(30), unique=True, nullable=False)
+    delivery_date = db.Column(db.Date, nullable=False, index=True)
+    delivery_time_slot = db.Column(db.String(50))
+    vehicle = db.Column(db.Integer, nullable=False)
+    stop_count = db.Column(db.Integer, default=0)
+    distance = db.Column(db.Float, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class DeliveryRunStop(db.Model):
+    run_id = db.Column(db.Integer, db.ForeignKey('delivery_run.id'), primary_key=True)
+    sequence = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, unique=True)
+
+
+class DispatchError(Exception):
+    """Raised when a batch cannot be stored; the message is shown to the admin"""
+
+
+def load_distance_matrix(path, depot):
+    """Read the postal code distance CSV into ({postal_code: index}, matrix); the depot is index 0"""
+    codes = {depot: 0}
+    entries = []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            a, b = row['from_postal_code'].strip(), row['to_postal_code'].strip()
+            for code in (a, b):
+                codes.setdefault(code, len(codes))
+            entries.append((codes[a], codes[b], float(row['distance'])))
+
+    matrix = np.full((len(codes), len(codes)), np.nan)
+    if entries:
+        rows, cols, values = (np.array(column) for column in zip(*entries))
+        matrix[rows, cols] = values
+        # Fill in the reverse direction where only one direction was supplied
+        matrix = np.where(np.isnan(matrix), matrix.T, matrix)
+    longest = np.nanmax(matrix) if entries else 1.0
+    matrix[np.isnan(matrix)] = longest * UNKNOWN_DISTANCE_FACTOR
+    np.fill_diagonal(matrix, 0)
+    return codes, matrix
+
+
+_matrix = None
+
+
+def _init_worker(matrix):
+    global _matrix
+    _matrix = matrix
+
+
+def _nearest_neighbour_runs(points, max_stops):
+    """Split stop points (matrix indices) into runs, each grown from the depot by nearest stop"""
+    unvisited = np.ones(len(points), dtype=bool)
+    runs = []
+    while unvisited.any():
+        run = []
+        current = 0  # depot
+        while len(run) < max_stops and unvisited.any():
+            distances = np.where(unvisited, _matrix[current, points], np.inf)
+            nearest = int(np.argmin(distances))
+            unvisited[nearest] = False
+            run.append(nearest)
+            current = points[nearest]
+        runs.append(run)
+    return runs
+
+
+def _two_opt(route, deadline):
+    """Improve a depot-to-depot route of matrix indices in place; returns its length"""
+    tour = np.array([0] + list(route) + [0])
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        for i in range(1, len(tour) - 2):
+            # Gain of reversing tour[i:j+1] for every j at once
+            a, b = tour[i - 1], tour[i]
+            c, d = tour[i + 1:-1], tour[i + 2:]
+            delta = _matrix[a, c] + _matrix[b, d] - _matrix[a, b] - _matrix[c, d]
+            best = int(np.argmin(delta))
+            if delta[best] < -1e-9:
+                j = i + 1 + best
+                tour[i:j + 1] = tour[i:j + 1][::-1]
+                improved = True
+    route[:] = tour[1:-1].tolist()
+    return float(_matrix[tour[:-1], tour[1:]].sum())
+
+
+def plan_slot(order_ids, points, max_stops, time_budget):
+    """Plan the runs for one slot; returns [(order_ids in visiting order, distance)]"""
+    deadline = time.monotonic() + time_budget
+    points = np.asarray(points)
+    runs = []
+    for run in _nearest_neighbour_runs(points, max_stops):
+        # Keep nearest-neighbour order for runs left once the budget is spent
+        route = [int(points[stop]) for stop in run]
+        distance = _two_opt(route, deadline)
+        by_point = {}
+        for stop in run:
+            by_point.setdefault(int(points[stop]), []).append(order_ids[stop])
+        runs.append(([by_point[point].pop() for point in route], distance))
+    return runs
+
+
+def _plan_slot_task(args):
+    return plan_slot(*args)
+
+
+def batch_routes(delivery_date, max_stops=25, time_budget=30, workers=None, matrix_path=None, depot=None,
+                 total_budget=None):
+    """Build and store vehicle runs for unassigned orders delivered on a date"""
+    matrix_path = matrix_path or current_app.config['DISPATCH_DISTANCE_MATRIX']
+    depot = depot or current_app.config['DISPATCH_DEPOT_POSTAL_CODE']
+    codes, matrix = load_distance_matrix(matrix_path, depot)
+
+    start = datetime.combine(delivery_date, datetime.min.time())
+    assigned = db.session.query(DeliveryRunStop.order_id)
+    orders = db.session.query(Order.id, Order.delivery_time_slot, User.postal_code).join(
+        User, User.id == Order.user_id
+    ).filter(
+        Order.status.in_(DISPATCH_STATUSES),
+        Order.delivery_date >= start,
+        Order.delivery_date < start + timedelta(days=1),
+        ~Order.id.in_(assigned)
+    ).order_by(Order.id).all()
+
+    slots = {}
+    for order_id, time_slot, postal_code in orders:
+        # Postal codes missing from the matrix get their own far-away point
+        point = codes.setdefault((postal_code or '').strip(), len(codes))
+        order_ids, points = slots.setdefault(time_slot or '', ([], []))
+        order_ids.append(order_id)
+        points.append(point)
+    if len(codes) > len(matrix):
+        grown = np.full((len(codes), len(codes)), (matrix.max() or 1.0) * UNKNOWN_DISTANCE_FACTOR)
+        grown[:len(matrix), :len(matrix)] = matrix
+        np.fill_diagonal(grown, 0)
+        matrix = grown
+
+    if total_budget and slots:
+        time_budget = min(time_budget, total_budget / len(slots))
+    tasks = [(order_ids, points, max_stops, time_budget) for order_ids, points in slots.values()]
+    if workers == 1 or len(tasks) <= 1:
+        _init_worker(matrix)
+        plans = [_plan_slot_task(task) for task in tasks]
+    else:
+        # Spawned, not forked: the parent holds database and logging locks
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker, initargs=(matrix,)
+        ) as pool:
+            plans = list(pool.map(_plan_slot_task, tasks))
+    return _store_runs(delivery_date, list(slots), plans)
+
+
+def _store_runs(delivery_date, time_slots, plans):
+    prefix = f"RUN{delivery_date.strftime('%Y%m%d')}"
+    existing = max((int(number.rsplit('-', 1)[1]) for number, in db.session.query(DeliveryRun.run_number).filter(
+        DeliveryRun.run_number.like(f'{prefix}-%')
+    )), default=0)
+    runs = []
+    for time_slot, plan in zip(time_slots, plans):
+        for stops, distance in plan:
+            runs.append({
+                'run_number': f'{prefix}-{existing + len(runs) + 1:03d}',
+                'delivery_date': delivery_date,
+                'delivery_time_slot': time_slot or None,
+                'vehicle': len(runs) + 1,
+                'stop_count': len(stops),
+                'distance': round(distance, 3),
+                'created_at': datetime.utcnow(),
+                'stops': stops,
+            })
+    if not runs:
+        return []
+
+    run_table = DeliveryRun.__table__
+    try:
+        db.session.execute(run_table.insert(), [
+            {key: value for key, value in run.items() if key != 'stops'} for run in runs
+        ])
+    except IntegrityError:
+        db.session.rollback()
+        raise DispatchError('Another batch for this date was stored at the same time; run it again')
+    run_ids = dict(db.session.query(DeliveryRun.run_number, DeliveryRun.id).filter(
+        DeliveryRun.run_number.in_([run['run_number'] for run in runs])
+    ))
+
+    stops = []
+    tracking = []
+    for run in runs:
+        for sequence, order_id in enumerate(run['stops'], 1):
+            stops.append({'run_id': run_ids[run['run_number']], 'sequence': sequence, 'order_id': order_id})
+            tracking.append({'_id': order_id, 'new_tracking_number': f"{run['run_number']}-{sequence:03d}"})
+    try:
+        db.session.execute(DeliveryRunStop.__table__.insert(), stops)
+    except IntegrityError:
+        db.session.rollback()
+        raise DispatchError('Another batch for this date was stored at the same time; run it again')
+    order_table = Order.__table__
+    db.session.execute(
+        order_table.update().where(order_table.c.id == bindparam('_id')).values(
+            tracking_number=bindparam('new_tracking_number'),
+            updated_at=datetime.utcnow()
+        ),
+        tracking
+    )
+    db.session.commit()
+    return runs
+
+
+def _run_summary(run):
+    return {
+        'run_number': run['run_number'],
+        'time_slot': run['delivery_time_slot'],
+        'vehicle': run['vehicle'],
+        'stop_count': run['stop_count'],
+        'distance': run['distance'],
+        'order_ids': run['stops']
+    }
+
+
+@bp.route('/api/admin/dispatch/batch', methods=['POST'])
+@admin_required
+def create_delivery_runs():
+    data = request.get_json() or {}
+    try:
+        delivery_date = date.fromisoformat(data.get('date') or date.today().isoformat())
+    except ValueError:
+        return jsonify({'error': 'date must be YYYY-MM-DD'}), 400
+    try:
+        max_stops = max(1, int(data.get('max_stops', 25)))
+        time_budget = min(float(data.get('time_budget', REQUEST_TIME_BUDGET)), REQUEST_TIME_BUDGET)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'max_stops and time_budget must be numbers'}), 400
+    try:
+        # No worker processes from a request thread; the whole batch shares the budget
+        runs = batch_routes(delivery_date, max_stops, time_budget, workers=1, total_budget=time_budget)
+    except OSError:
+        return jsonify({'error': 'Distance matrix is not available'}), 503
+    except DispatchError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify({'success': True, 'runs': [_run_summary(run) for run in runs]})
+
+
+@bp.route('/api/admin/dispatch/runs')
+@admin_required
+def get_delivery_runs():
+    try:
+        delivery_date = date.fromisoformat(request.args.get('date') or date.today().isoformat())
+    except ValueError:
+        return jsonify({'error': 'date must be YYYY-MM-DD'}), 400
+
+    runs = DeliveryRun.query.filter_by(delivery_date=delivery_date).order_by(DeliveryRun.vehicle).all()
+    stops = {}
+    for run_id, order_id, order_number, tracking_number in db.session.query(
+        DeliveryRunStop.run_id, Order.id, Order.order_number, Order.tracking_number
+    ).join(Order, Order.id == DeliveryRunStop.order_id).filter(
+        DeliveryRunStop.run_id.in_([run.id for run in runs])
+    ).order_by(DeliveryRunStop.run_id, DeliveryRunStop.sequence):
+        stops.setdefault(run_id, []).append({
+            'order_id': order_id,
+            'order_number': order_number,
+            'tracking_number': tracking_number
+        })
+
+    return jsonify([{
+        'run_number': run.run_number,
+        'time_slot': run.delivery_time_slot,
+        'vehicle': run.vehicle,
+        'stop_count': run.stop_count,
+        'distance': run.distance,
+        'stops': stops.get(run.id, [])
+    } for run in runs])
+
+
+@bp.cli.command('batch-routes')
+@click.option('--date', 'delivery_date', type=click.DateTime(formats=['%Y-%m-%d']), help='defaults to tomorrow')
+@click.option('--max-stops', default=25, show_default=True)
+@click.option('--time-budget', default=30.0, show_default=True, help='seconds of 2-opt per slot')
+@click.option('--workers', type=int, help='worker processes, defaults to one per CPU')
+@click.option('--matrix', 'matrix_path', type=click.Path(exists=True, dir_okay=False), help='defaults to DISPATCH_DISTANCE_MATRIX')
+def batch_routes_command(delivery_date, max_stops, time_budget, workers, matrix_path):
+    """Group a day's orders into vehicle runs and assign tracking numbers"""
+    for model in (DeliveryRun, DeliveryRunStop):
+        model.__table__.create(db.engine, checkfirst=True)
+    delivery_date = delivery_date.date() if delivery_date else date.today() + timedelta(days=1)
+    started = time.monotonic()
+    try:
+        runs = batch_routes(delivery_date, max_stops, time_budget, workers, matrix_path)
+    except DispatchError as e:
+        raise click.ClickException(str(e))
+    click.echo(
+        f'Built {len(runs)} runs for {sum(run["stop_count"] for run in runs)} orders on {delivery_date} '
+        f'({sum(run["distance"] for run in runs):.1f} total distance, {time.monotonic() - started:.1f}s)'
+    )
@@ -169,12 +169,9 @@ def create_email_templates():
     print(f"Created {len(email_templates)} email templates in {templates_dir}/")
 
 # Additional utility functions for email management
-from models import Newsletter, User, Order  # Make sure this import matches your project structure
-
-# Import or define send_email function
-# Define a dummy send_email function if utils.email_utils is not available
-def send_email(to, subject, template, **kwargs):
-    print(f"Sending email to {to} with subject '{subject}' using template '{template}' and context {kwargs}")
+from extensions import db
+from models import Newsletter, User, Order
+from utils import send_email
 
 def send_newsletter(subject, content, recipient_list=None):
     """Send newsletter to subscribers"""
@@ -189,17 +186,31 @@ def send_newsletter(subject, content, recipient_list=None):
 
 def send_order_status_update(order_id, new_status):
     """Send order status update email"""
-    order = Order.query.get(order_id)
-    if order:
-        user = User.query.get(order.user_id)
+    row = db.session.query(Order.order_number, User.email, User.first_name).join(
+        User, User.id == Order.user_id
+    ).filter(Order.id == order_id).first()
+    if row:
+        send_order_status_updates([{
+            'order_id': order_id,
+            'order_number': row.order_number,
+            'email': row.email,
+            'first_name': row.first_name,
+            'status': new_status
+        }])
+
+def send_order_status_updates(notifications):
+    """Send status update emails from preloaded rows, without touching the database; returns one success flag per row"""
+    return [
         send_email(
-            user.email,
-            f'Order Update - {order.order_number}',
+            notification['email'],
+            f"Order Update - {notification['order_number']}",
             'order_status_update.html',
-            user=user,
-            order=order,
-            new_status=new_status
+            user={'email': notification['email'], 'first_name': notification['first_name']},
+            order={'id': notification['order_id'], 'order_number': notification['order_number']},
+            new_status=notification['status']
         )
+        for notification in notifications
+    ]
 
 def send_welcome_email(user_id):
     """Send welcome email to new users"""
@@ -211,8 +222,3 @@ def send_welcome_email(user_id):
             'welcome_email.html',
             user=user
         )
-
-print("Email templates and utilities created!")
-print("Templates available:")
-for template_name in email_templates.keys():
-    print(f"- {template_name}")
\ No newline at end of file
@@ -0,0 +1,205 @@
+# Streaming Data Exports for the Grocery Website
+#
+# Orders, inventory logs and search logs are read with server-side cursors and
+# written out chunk by chunk, so memory use does not depend on the date range.
+#
+# Usage:
+#   GET /api/admin/exports/orders?start=2024-01-01&end=2025-01-01&format=csv&gzip=true
+#   flask export orders --start 2024-01-01 --output orders.csv.gz --gzip
+
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, date
+
+import click
+from flask import Blueprint, Response, request, stream_with_context, jsonify
+from sqlalchemy import select
+
+from extensions import db
+from models import Order, OrderItem, InventoryLog, SearchLog
+from auth import admin_required
+
+bp = Blueprint('exports', __name__, cli_group=None)
+
+FETCH_SIZE = 2000  # rows fetched per cursor round trip
+FLUSH_SIZE = 64 * 1024  # bytes buffered before a chunk is emitted
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def _orders_query():
+    order = Order.__table__
+    item = OrderItem.__table__
+    columns = [
+        order.c.id.label('order_id'),
+        order.c.order_number,
+        order.c.user_id,
+        order.c.status,
+        order.c.payment_status,
+        order.c.payment_method,
+        order.c.total_amount,
+        order.c.tax_amount,
+        order.c.delivery_fee,
+        order.c.discount_amount,
+        order.c.delivery_date,
+        order.c.delivery_time_slot,
+        order.c.created_at,
+        item.c.product_id,
+        item.c.quantity,
+        item.c.price,
+        item.c.total.label('line_total'),
+    ]
+    query = select(*columns).select_from(order.outerjoin(item, item.c.order_id == order.c.id))
+    return query, order.c.created_at, (order.c.id, item.c.id)
+
+
+def _inventory_logs_query():
+    log = InventoryLog.__table__
+    return select(*log.c), log.c.created_at, (log.c.id,)
+
+
+def _search_logs_query():
+    log = SearchLog.__table__
+    return select(*log.c), log.c.created_at, (log.c.id,)
+
+
+EXPORTS = {
+    'orders': _orders_query,
+    'inventory-logs': _inventory_logs_query,
+    'search-logs': _search_logs_query,
+}
+
+
+def iter_rows(kind, start=None, end=None):
+    """Yield (columns, row) pairs for an export using a server-side cursor"""
+    query, created_at, order_by = EXPORTS[kind]()
+    if start:
+        query = query.where(created_at >= start)
+    if end:
+        query = query.where(created_at < end)
+    query = query.order_by(*order_by).execution_options(stream_results=True, yield_per=FETCH_SIZE)
+
+    result = db.session.execute(query)
+    columns = list(result.keys())
+    try:
+        for row in result:
+            yield columns, row
+    finally:
+        result.close()
+
+
+def _serialize(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def iter_csv(rows):
+    """Encode rows as CSV text, emitting roughly FLUSH_SIZE chunks"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header_written = False
+    for columns, row in rows:
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        writer.writerow([_serialize(value) for value in row])
+        if buffer.tell() >= FLUSH_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def iter_jsonl(rows):
+    """Encode rows as JSON lines, emitting roughly FLUSH_SIZE chunks"""
+    parts = []
+    size = 0
+    for columns, row in rows:
+        line = json.dumps({column: _serialize(value) for column, value in zip(columns, row)}) + '\n'
+        parts.append(line)
+        size += len(line)
+        if size >= FLUSH_SIZE:
+            yield ''.join(parts).encode('utf-8')
+            parts = []
+            size = 0
+    if parts:
+        yield ''.join(parts).encode('utf-8')
+
+
+ENCODERS = {'csv': iter_csv, 'jsonl': iter_jsonl}
+
+
+def iter_gzip(chunks):
+    """Gzip-compress a stream of byte chunks incrementally"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def generate_export(kind, fmt='csv', start=None, end=None, compress=False):
+    """Return a generator of byte chunks for the requested export"""
+    chunks = ENCODERS[fmt](iter_rows(kind, start=start, end=end))
+    if compress:
+        chunks = iter_gzip(chunks)
+    return chunks
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
+
+
+@bp.route('/api/admin/exports/<kind>')
+@admin_required
+def export_data(kind):
+    fmt = request.args.get('format', 'csv')
+    compress = request.args.get('gzip', 'false').lower() == 'true'
+
+    if kind not in EXPORTS:
+        return jsonify({'error': f'Unknown export: {kind}'}), 404
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'format must be csv or jsonl'}), 400
+    try:
+        start = _parse_date(request.args.get('start'))
+        end = _parse_date(request.args.get('end'))
+    except ValueError:
+        return jsonify({'error': 'start and end must be ISO dates'}), 400
+
+    filename = f"{kind}-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.{fmt}"
+    headers = {'Content-Disposition': f'attachment; filename={filename}'}
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+
+    return Response(
+        stream_with_context(generate_export(kind, fmt, start, end, compress)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers=headers
+    )
+
+
+@bp.cli.command('export')
+@click.argument('kind', type=click.Choice(sorted(EXPORTS)))
+@click.option('--output', '-o', type=click.Path(dir_okay=False), required=True)
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_FORMATS)), default='csv', show_default=True)
+@click.option('--start', help='ISO date, inclusive')
+@click.option('--end', help='ISO date, exclusive')
+@click.option('--gzip', 'compress', is_flag=True, help='gzip the output')
+def export_command(kind, output, fmt, start, end, compress):
+    """Export orders, inventory logs or search logs to a file"""
+    written = 0
+    with open(output, 'wb') as f:
+        for chunk in generate_export(kind, fmt, _parse_date(start), _parse_date(end), compress):
+            f.write(chunk)
+            written += len(chunk)
+    click.echo(f'Wrote {written} bytes to {output}')
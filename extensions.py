@@ -0,0 +1,45 @@
+# Flask Extensions for the Grocery Website
+#
+# Extensions are created unbound here and attached in create_app(), so every
+# module shares one db and one limiter. Flask-Mail and Stripe are only imported
+# the first time an email or payment needs them, which keeps them out of
+# worker start-up and CLI commands. The session routes reads from @read_only
+# views to the read replicas (see replicas.py).
+
+from flask import current_app
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+from flask_sqlalchemy import SQLAlchemy
+
+from replicas import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+limiter = Limiter(
+    get_remote_address,
+    default_limits=["200 per day", "50 per hour"]
+)
+
+
+def get_mail():
+    """Flask-Mail state for the current app, initialized on first use"""
+    if 'mail' not in current_app.extensions:
+        from flask_mail import Mail
+        Mail(current_app)
+    return current_app.extensions['mail']
+
+
+def get_stripe_client():
+    """A StripeClient for STRIPE_SECRET_KEY with bounded timeouts, created on first use"""
+    client = current_app.extensions.get('stripe_client')
+    if client is None:
+        import stripe
+        config = current_app.config
+        client = current_app.extensions.setdefault('stripe_client', stripe.StripeClient(
+            config['STRIPE_SECRET_KEY'],
+            base_addresses={'api': config['STRIPE_API_BASE']} if config['STRIPE_API_BASE'] else {},
+            http_client=stripe.RequestsClient(
+                timeout=(config['STRIPE_CONNECT_TIMEOUT_SECONDS'], config['STRIPE_TIMEOUT_SECONDS'])
+            ),
+            max_network_retries=config['STRIPE_MAX_NETWORK_RETRIES']
+        ))
+    return client
@@ -0,0 +1,189 @@
+# Typo-Tolerant Search for the Grocery Website
+#
+# A SymSpell-style deletion dictionary over the words in product names,
+# descriptions and brands. Every word is indexed under all strings reachable
+# by deleting up to MAX_EDIT_DISTANCE characters from its first PREFIX_LENGTH
+# letters, so a lookup only generates the deletes of the misspelt term and
+# verifies the few words that share one. No edit-distance scan over the
+# vocabulary is needed.
+#
+# Search terms that are a known word or the prefix of one are left alone;
+# anything else is replaced by its closest, most frequent correction before
+# the query reaches the catalog index.
+#
+# A dictionary that requests may be reading is never changed: copy() shares
+# the index with the original and copies a posting list only when a new word
+# is added to it, so each catalog version keeps its own corrections.
+#
+# Usage:
+#   python benchmark.py --fuzzy
+
+import re
+from bisect import bisect_left
+
+MAX_EDIT_DISTANCE = 2
+PREFIX_LENGTH = 7
+MIN_CORRECTION_LENGTH = 4
+WORD_PATTERN = re.compile(r'[a-z]+')
+
+
+def words(text):
+    """Lowercase alphabetic words in a piece of text"""
+    return WORD_PATTERN.findall(text.lower()) if text else []
+
+
+def _delete_levels(word, max_distance):
+    """Strings reachable from word by deleting 0, 1, ... max_distance characters, one list per count"""
+    found = {word}
+    levels = [[word]]
+    for _ in range(max_distance):
+        next_level = []
+        for candidate in levels[-1]:
+            if len(candidate) <= 1:
+                continue
+            for i in range(len(candidate)):
+                deleted = candidate[:i] + candidate[i + 1:]
+                if deleted not in found:
+                    found.add(deleted)
+                    next_level.append(deleted)
+        levels.append(next_level)
+    return levels
+
+
+def edit_distance(a, b, max_distance):
+    """Optimal string alignment distance, or max_distance + 1 once it is exceeded"""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class FuzzyDictionary:
+    """Word frequencies plus the deletion index used to correct misspelt terms"""
+
+    def __init__(self, max_distance=MAX_EDIT_DISTANCE, prefix_length=PREFIX_LENGTH):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.counts = {}
+        self.index = {}
+        self._sorted = None
+        self._owned = None  # index keys whose posting lists this copy may change; None owns all
+
+    @classmethod
+    def from_texts(cls, texts, **kwargs):
+        dictionary = cls(**kwargs)
+        for text in texts:
+            dictionary.add_text(text)
+        return dictionary
+
+    def copy(self):
+        """A dictionary with the same words that can be changed without changing this one"""
+        new = object.__new__(type(self))
+        new.max_distance = self.max_distance
+        new.prefix_length = self.prefix_length
+        new.counts = dict(self.counts)
+        new.index = dict(self.index)
+        new._sorted = self._sorted
+        new._owned = set()
+        return new
+
+    def add_text(self, text):
+        for word in words(text):
+            self.add_word(word)
+
+    def add_word(self, word, count=1):
+        if word in self.counts:
+            self.counts[word] += count
+            return
+        self.counts[word] = count
+        self._sorted = None
+        for level in _delete_levels(word[:self.prefix_length], self.max_distance):
+            for deleted in level:
+                if self._owned is None or deleted in self._owned:
+                    self.index.setdefault(deleted, []).append(word)
+                else:
+                    # Shared with the dictionary this was copied from
+                    self.index[deleted] = self.index.get(deleted, []) + [word]
+                    self._owned.add(deleted)
+
+    def remove_text(self, text):
+        for word in words(text):
+            self.remove_word(word)
+
+    def remove_word(self, word, count=1):
+        """Take back count occurrences; the word leaves the index once none are left"""
+        if word not in self.counts:
+            return
+        if self.counts[word] > count:
+            self.counts[word] -= count
+            return
+        del self.counts[word]
+        self._sorted = None
+        for level in _delete_levels(word[:self.prefix_length], self.max_distance):
+            for deleted in level:
+                postings = [other for other in self.index.get(deleted, ()) if other != word]
+                if postings:
+                    self.index[deleted] = postings
+                else:
+                    self.index.pop(deleted, None)
+                if self._owned is not None:
+                    self._owned.add(deleted)
+
+    def is_known(self, term):
+        """True for a vocabulary word or the prefix of one, which substring search already handles"""
+        if term in self.counts:
+            return True
+        if self._sorted is None:
+            self._sorted = sorted(self.counts)
+        position = bisect_left(self._sorted, term)
+        return position < len(self._sorted) and self._sorted[position].startswith(term)
+
+    def lookup(self, term):
+        """Closest vocabulary word within the edit distance budget, most frequent first; None if none"""
+        max_distance = self.max_distance if len(term) > 5 else 1
+        best, best_distance, best_count = None, max_distance + 1, 0
+        checked = set()
+        for deleted_count, level in enumerate(_delete_levels(term[:self.prefix_length], max_distance)):
+            # Words reached after k deletes from the term are at least k edits away
+            if deleted_count > best_distance:
+                break
+            for deleted in level:
+                for word in self.index.get(deleted, ()):
+                    # Cheap bounds first: deletes on the word side and the length gap are edits too
+                    limit = min(max_distance, best_distance)
+                    if min(len(word), self.prefix_length) - len(deleted) > limit or abs(len(word) - len(term)) > limit:
+                        continue
+                    if word in checked:
+                        continue
+                    checked.add(word)
+                    distance = edit_distance(term, word, limit)
+                    if distance > max_distance:
+                        continue
+                    count = self.counts[word]
+                    if distance < best_distance or (distance == best_distance and count > best_count):
+                        best, best_distance, best_count = word, distance, count
+        return best
+
+    def correct(self, terms):
+        """The terms with unknown words replaced by their corrections"""
+        corrected = []
+        for term in terms:
+            term = term.lower()
+            if len(term) >= MIN_CORRECTION_LENGTH and term.isalpha() and not self.is_known(term):
+                term = self.lookup(term) or term
+            corrected.append(term)
+        return corrected
@@ -0,0 +1,301 @@
+# Product and Category Image Uploads for the Grocery Website
+#
+# Uploads are streamed to a temporary file in chunks while being hashed, so
+# the request never holds the image in memory. The file is then renamed to
+# its SHA-256, which deduplicates identical images across products. Resizing
+# runs in a process pool off the request thread: every size in IMAGE_VARIANTS
+# is written as WebP and JPEG. The pool is created with the app and uses the
+# spawn start method, so workers never inherit locks held by request
+# threads. When the variants are ready, the thumbnail URL and the variant
+# URLs are recorded on every product and category that uses the image, so
+# listings serve the small version.
+#
+# Send the image as the raw request body (Content-Type: image/jpeg, ...) to
+# skip form parsing entirely; multipart uploads in an "image" field work too.
+#
+# Usage:
+#   flask process-images     # render images left pending, e.g. after a restart
+
+import hashlib
+import json
+import os
+import tempfile
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+
+import click
+from flask import Blueprint, current_app, request, jsonify
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import Product, Category
+from auth import admin_required
+from utils import allowed_file
+
+bp = Blueprint('image_uploads', __name__, cli_group=None)
+
+CHUNK_SIZE = 64 * 1024
+# Longest side in pixels for each variant
+IMAGE_VARIANTS = {'thumb': 200, 'medium': 600, 'large': 1200}
+LISTING_VARIANT = 'thumb'
+CONTENT_TYPES = {'image/png': 'png', 'image/jpeg': 'jpg', 'image/gif': 'gif', 'image/webp': 'webp'}
+MAGIC_NUMBERS = (b'\x89PNG\r\n\x1a\n', b'\xff\xd8\xff', b'GIF87a', b'GIF89a')
+
+class ImageAsset(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    path = db.Column(db.String(200), nullable=False)  # original, relative to UPLOAD_FOLDER
+    size_bytes = db.Column(db.Integer)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    status = db.Column(db.String(20), default='pending')  # pending, ready, failed
+    variants = db.Column(db.Text)  # JSON {variant: {'webp': path, 'jpg': path, 'width': w, 'height': h}}
+    error = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class UploadError(Exception):
+    """Raised for an upload that is not an accepted image; the message is returned to the client"""
+
+
+def _is_image(head):
+    return head.startswith(MAGIC_NUMBERS) or (head[:4] == b'RIFF' and head[8:12] == b'WEBP')
+
+
+def _upload_source():
+    """(readable stream, extension) for a raw-body or multipart upload"""
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('image')
+        if upload is None or not upload.filename:
+            raise UploadError('No image file provided')
+        if not allowed_file(upload.filename):
+            raise UploadError('File type not allowed')
+        return upload.stream, upload.filename.rsplit('.', 1)[1].lower()
+
+    extension = CONTENT_TYPES.get(request.mimetype)
+    if extension is None or extension not in current_app.config['ALLOWED_EXTENSIONS']:
+        raise UploadError(f"Content-Type must be one of {', '.join(CONTENT_TYPES)}")
+    return request.stream, extension
+
+
+def store_upload(stream, extension):
+    """Stream an upload to UPLOAD_FOLDER/originals under its content hash; returns the ImageAsset"""
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    tmp_folder = os.path.join(upload_folder, 'tmp')
+    os.makedirs(tmp_folder, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_folder)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if size == 0 and not _is_image(chunk[:12]):
+                    raise UploadError('File is not a PNG, JPEG, GIF or WebP image')
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        if size == 0:
+            raise UploadError('Empty upload')
+
+        sha256 = digest.hexdigest()
+        asset = ImageAsset.query.filter_by(sha256=sha256).first()
+        if asset is not None:
+            os.remove(tmp_path)
+            return asset
+
+        relative_path = os.path.join('originals', sha256[:2], f'{sha256}.{extension}')
+        os.makedirs(os.path.dirname(os.path.join(upload_folder, relative_path)), exist_ok=True)
+        os.replace(tmp_path, os.path.join(upload_folder, relative_path))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    asset = ImageAsset(sha256=sha256, path=relative_path, size_bytes=size, status='pending')
+    db.session.add(asset)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # The same image was uploaded concurrently; both wrote identical bytes to the same path
+        db.session.rollback()
+        asset = ImageAsset.query.filter_by(sha256=sha256).one()
+    return asset
+
+
+def render_variants(upload_folder, relative_path, sha256, sizes):
+    """Write WebP and JPEG variants of an original; runs in a pool worker.
+
+    Returns (width, height, variants) with variant paths relative to the upload folder.
+    """
+    from PIL import Image, ImageOps  # only the pool workers need Pillow
+
+    variant_folder = os.path.join('variants', sha256[:2])
+    os.makedirs(os.path.join(upload_folder, variant_folder), exist_ok=True)
+    variants = {}
+    with Image.open(os.path.join(upload_folder, relative_path)) as original:
+        image = ImageOps.exif_transpose(original)
+        width, height = image.size
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+        for name, longest_side in sizes.items():
+            resized = image.copy()
+            resized.thumbnail((longest_side, longest_side), Image.LANCZOS)
+            webp_path = os.path.join(variant_folder, f'{sha256}-{name}.webp')
+            jpg_path = os.path.join(variant_folder, f'{sha256}-{name}.jpg')
+            resized.save(os.path.join(upload_folder, webp_path), 'WEBP', quality=80, method=4)
+            if resized.mode == 'RGBA':
+                background = Image.new('RGB', resized.size, (255, 255, 255))
+                background.paste(resized, mask=resized.getchannel('A'))
+                resized = background
+            resized.save(os.path.join(upload_folder, jpg_path), 'JPEG', quality=85, optimize=True, progressive=True)
+            variants[name] = {'webp': webp_path, 'jpg': jpg_path, 'width': resized.width, 'height': resized.height}
+    return width, height, variants
+
+
+def image_url(relative_path):
+    return f"{current_app.config['IMAGE_URL_PREFIX']}/{relative_path.replace(os.sep, '/')}"
+
+
+def variant_urls(asset):
+    """{variant: {'webp': url, 'jpg': url, 'width': w, 'height': h}} for a ready asset"""
+    return {
+        name: dict(variant, webp=image_url(variant['webp']), jpg=image_url(variant['jpg']))
+        for name, variant in json.loads(asset.variants or '{}').items()
+    }
+
+
+def apply_variants(asset):
+    """Record the asset's thumbnail and variant URLs on every product and category showing it"""
+    variants = variant_urls(asset)
+    if not variants:
+        return
+    values = {
+        'thumbnail_url': variants[LISTING_VARIANT]['webp'],
+        'image_variants': json.dumps(variants),
+    }
+    original_url = image_url(asset.path)
+    for model in (Product, Category):
+        table = model.__table__
+        db.session.execute(table.update().where(table.c.image_url == original_url).values(**values))
+
+
+def _finish(app, asset_id, future):
+    # Runs on the pool's result thread once the worker is done
+    with app.app_context():
+        asset = db.session.get(ImageAsset, asset_id)
+        try:
+            asset.width, asset.height, variants = future.result()
+        except Exception as e:
+            asset.status = 'failed'
+            asset.error = str(e)[:200]
+            app.logger.warning(f'Image {asset.sha256} could not be processed: {e}')
+        else:
+            asset.variants = json.dumps(variants)
+            asset.status = 'ready'
+            apply_variants(asset)
+        db.session.commit()
+
+
+def init_image_pool(app):
+    """Create the resize pool at start-up; none when IMAGE_WORKERS is 0"""
+    workers = app.config['IMAGE_WORKERS']
+    if workers:
+        app.extensions['image_pool'] = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+        )
+
+
+def process_asset(asset, wait=False):
+    """Render an asset's variants in the process pool; inline when IMAGE_WORKERS is 0"""
+    app = current_app._get_current_object()
+    args = (app.config['UPLOAD_FOLDER'], asset.path, asset.sha256, IMAGE_VARIANTS)
+    pool = app.extensions.get('image_pool')
+    if pool is None:
+        future = Future()
+        try:
+            future.set_result(render_variants(*args))
+        except Exception as e:
+            future.set_exception(e)
+        _finish(app, asset.id, future)
+    elif wait:
+        future = pool.submit(render_variants, *args)
+        future.exception()  # blocks until the worker is done
+        _finish(app, asset.id, future)
+    else:
+        pool.submit(render_variants, *args).add_done_callback(
+            lambda future: _finish(app, asset.id, future)
+        )
+
+
+def _attach(target):
+    """Handle an upload for a product or category and point its image at the asset"""
+    try:
+        stream, extension = _upload_source()
+        asset = store_upload(stream, extension)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+
+    target.image_url = image_url(asset.path)
+    target.thumbnail_url = None
+    target.image_variants = None
+    db.session.commit()
+
+    if asset.status == 'ready':
+        apply_variants(asset)
+        db.session.commit()
+    else:
+        process_asset(asset)
+        db.session.refresh(asset)  # already finished when rendered inline
+    return jsonify({
+        'success': True,
+        'asset_id': asset.id,
+        'status': asset.status,
+        'image_url': target.image_url,
+        'variants': variant_urls(asset) if asset.status == 'ready' else None
+    }), 202 if asset.status == 'pending' else 200
+
+
+@bp.route('/api/admin/products/<int:product_id>/image', methods=['POST', 'PUT'])
+@admin_required
+def upload_product_image(product_id):
+    return _attach(Product.query.get_or_404(product_id))
+
+
+@bp.route('/api/admin/categories/<int:category_id>/image', methods=['POST', 'PUT'])
+@admin_required
+def upload_category_image(category_id):
+    return _attach(Category.query.get_or_404(category_id))
+
+
+@bp.route('/api/admin/images/<int:asset_id>')
+@admin_required
+def get_image_asset(asset_id):
+    asset = ImageAsset.query.get_or_404(asset_id)
+    return jsonify({
+        'id': asset.id,
+        'sha256': asset.sha256,
+        'status': asset.status,
+        'image_url': image_url(asset.path),
+        'size_bytes': asset.size_bytes,
+        'width': asset.width,
+        'height': asset.height,
+        'variants': variant_urls(asset) if asset.status == 'ready' else None,
+        'error': asset.error
+    })
+
+
+@bp.cli.command('process-images')
+@click.option('--retry-failed', is_flag=True, help='also retry images that failed before')
+def process_images_command(retry_failed):
+    """Render variants for uploaded images that are still pending"""
+    ImageAsset.__table__.create(db.engine, checkfirst=True)
+    statuses = ['pending', 'failed'] if retry_failed else ['pending']
+    assets = ImageAsset.query.filter(ImageAsset.status.in_(statuses)).all()
+    for asset in assets:
+        process_asset(asset, wait=True)
+    ready = ImageAsset.query.filter(ImageAsset.id.in_([asset.id for asset in assets]), ImageAsset.status == 'ready').count()
+    click.echo(f'Processed {len(assets)} images ({ready} ready)')
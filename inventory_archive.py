@@ -0,0 +1,235 @@
+# Inventory Log Compaction and Archival for the Grocery Website
+#
+# Raw InventoryLog rows older than INVENTORY_LOG_RETENTION_DAYS are rolled up
+# into one InventoryLogDaily row per product, day and change type, written to
+# gzipped JSON lines files (one directory per month) and then deleted.
+# Product history merges the daily summaries with the remaining raw rows.
+#
+# Usage (e.g. nightly from cron):
+#   flask compact-inventory-log
+#   flask compact-inventory-log --retention-days 30
+
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+import click
+from flask import Blueprint, current_app, request, jsonify
+from sqlalchemy import bindparam, func
+
+from extensions import db
+from models import Product, InventoryLog
+from auth import admin_required
+
+bp = Blueprint('inventory_archive', __name__, cli_group=None)
+
+CHUNK_SIZE = 50000  # raw rows per archive file and per transaction
+
+
+class InventoryLogDaily(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    change_type = db.Column(db.String(50))
+    entries = db.Column(db.Integer, default=0)
+    quantity_change = db.Column(db.Integer, default=0)
+    opening_quantity = db.Column(db.Integer)
+    closing_quantity = db.Column(db.Integer)
+
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'day', 'change_type', name='uq_inventory_log_daily'),
+    )
+
+
+def _archive_path(folder, first_row, last_row):
+    # The name is derived from the id range, so re-running after a crash
+    # rewrites the same file instead of duplicating it
+    month = first_row.created_at.strftime('%Y-%m')
+    directory = os.path.join(folder, month)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f'inventory_log-{first_row.id:012d}-{last_row.id:012d}.jsonl.gz')
+
+
+def _write_archive(path, rows):
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps({
+                'id': row.id,
+                'product_id': row.product_id,
+                'change_type': row.change_type,
+                'quantity_change': row.quantity_change,
+                'previous_quantity': row.previous_quantity,
+                'new_quantity': row.new_quantity,
+                'reason': row.reason,
+                'created_by': row.created_by,
+                'created_at': row.created_at.isoformat(),
+            }) + '\n')
+    os.replace(tmp_path, path)
+
+
+def _summarize(rows):
+    """Aggregate id-ordered raw rows into {(product_id, day, change_type): summary}"""
+    summaries = {}
+    for row in rows:
+        key = (row.product_id, row.created_at.date(), row.change_type)
+        summary = summaries.get(key)
+        if summary is None:
+            summaries[key] = {
+                'entries': 1,
+                'quantity_change': row.quantity_change,
+                'opening_quantity': row.previous_quantity,
+                'closing_quantity': row.new_quantity,
+            }
+        else:
+            summary['entries'] += 1
+            summary['quantity_change'] += row.quantity_change
+            summary['closing_quantity'] = row.new_quantity
+    return summaries
+
+
+def _merge_summaries(summaries):
+    """Add chunk summaries onto existing daily rows with executemany statements"""
+    table = InventoryLogDaily.__table__
+    product_ids = {product_id for product_id, _, _ in summaries}
+    days = [day for _, day, _ in summaries]
+    existing = {
+        (row.product_id, row.day, row.change_type): row.id
+        for row in db.session.query(
+            InventoryLogDaily.id, InventoryLogDaily.product_id,
+            InventoryLogDaily.day, InventoryLogDaily.change_type
+        ).filter(
+            InventoryLogDaily.product_id.in_(product_ids),
+            InventoryLogDaily.day >= min(days),
+            InventoryLogDaily.day <= max(days)
+        )
+    }
+
+    updates = []
+    inserts = []
+    for key, summary in summaries.items():
+        if key in existing:
+            updates.append({
+                '_id': existing[key],
+                '_entries': summary['entries'],
+                '_quantity_change': summary['quantity_change'],
+                '_closing_quantity': summary['closing_quantity'],
+            })
+        else:
+            product_id, day, change_type = key
+            inserts.append(dict(summary, product_id=product_id, day=day, change_type=change_type))
+
+    if updates:
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('_id')).values(
+                entries=table.c.entries + bindparam('_entries'),
+                quantity_change=table.c.quantity_change + bindparam('_quantity_change'),
+                closing_quantity=bindparam('_closing_quantity'),
+            ),
+            updates
+        )
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+
+
+def compact_inventory_log(retention_days=None, archive_folder=None, chunk_size=CHUNK_SIZE):
+    """Summarize, archive and delete raw inventory log rows older than the retention window"""
+    retention_days = retention_days or current_app.config['INVENTORY_LOG_RETENTION_DAYS']
+    archive_folder = archive_folder or current_app.config['INVENTORY_ARCHIVE_FOLDER']
+    # Cut on a day boundary so a day is never split between raw rows and a summary
+    cutoff = datetime.combine((datetime.utcnow() - timedelta(days=retention_days)).date(), datetime.min.time())
+
+    stats = {'rows': 0, 'files': 0, 'summaries': 0}
+    log_table = InventoryLog.__table__
+    while True:
+        # Oldest month with rows left; each archive file stays inside one month
+        oldest = db.session.query(func.min(InventoryLog.created_at)).filter(InventoryLog.created_at < cutoff).scalar()
+        if oldest is None:
+            break
+        month_start = datetime(oldest.year, oldest.month, 1)
+        month_end = min(datetime(oldest.year + oldest.month // 12, oldest.month % 12 + 1, 1), cutoff)
+
+        last_id = 0
+        while True:
+            rows = InventoryLog.query.filter(
+                InventoryLog.created_at >= month_start,
+                InventoryLog.created_at < month_end,
+                InventoryLog.id > last_id
+            ).order_by(InventoryLog.id.asc()).limit(chunk_size).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            _write_archive(_archive_path(archive_folder, rows[0], rows[-1]), rows)
+            summaries = _summarize(rows)
+            _merge_summaries(summaries)
+            db.session.execute(log_table.delete().where(
+                log_table.c.id.in_([row.id for row in rows])
+            ))
+            db.session.commit()
+            db.session.expunge_all()
+
+            stats['rows'] += len(rows)
+            stats['files'] += 1
+            stats['summaries'] += len(summaries)
+    return stats
+
+
+def product_inventory_history(product_id, since):
+    """Summaries for archived days merged with raw rows still in the log, newest first"""
+    raw = InventoryLog.query.filter(
+        InventoryLog.product_id == product_id,
+        InventoryLog.created_at >= since
+    ).all()
+    daily = InventoryLogDaily.query.filter(
+        InventoryLogDaily.product_id == product_id,
+        InventoryLogDaily.day >= since.date()
+    ).all()
+
+    history = [{
+        'type': 'entry',
+        'timestamp': log.created_at.isoformat(),
+        'change_type': log.change_type,
+        'quantity_change': log.quantity_change,
+        'previous_quantity': log.previous_quantity,
+        'new_quantity': log.new_quantity,
+        'reason': log.reason
+    } for log in raw]
+    history.extend({
+        'type': 'daily_summary',
+        'timestamp': summary.day.isoformat(),
+        'change_type': summary.change_type,
+        'entries': summary.entries,
+        'quantity_change': summary.quantity_change,
+        'previous_quantity': summary.opening_quantity,
+        'new_quantity': summary.closing_quantity
+    } for summary in daily)
+    history.sort(key=lambda entry: entry['timestamp'], reverse=True)
+    return history
+
+
+@bp.route('/api/admin/products/<int:product_id>/inventory-history')
+@admin_required
+def get_inventory_history(product_id):
+    Product.query.get_or_404(product_id)
+    days = request.args.get('days', 30, type=int)
+    since = datetime.utcnow() - timedelta(days=days)
+    return jsonify({
+        'product_id': product_id,
+        'days': days,
+        'history': product_inventory_history(product_id, since)
+    })
+
+
+@bp.cli.command('compact-inventory-log')
+@click.option('--retention-days', type=int, help='defaults to INVENTORY_LOG_RETENTION_DAYS')
+@click.option('--archive-folder', type=click.Path(file_okay=False), help='defaults to INVENTORY_ARCHIVE_FOLDER')
+def compact_inventory_log_command(retention_days, archive_folder):
+    """Roll old inventory log rows into daily summaries and archive files"""
+    InventoryLogDaily.__table__.create(db.engine, checkfirst=True)
+    stats = compact_inventory_log(retention_days, archive_folder)
+    click.echo(
+        f"Archived {stats['rows']} inventory log rows into {stats['files']} files "
+        f"and {stats['summaries']} daily summaries"
+    )
@@ -0,0 +1,153 @@
+# Expiry-aware Inventory Management for the Grocery Website
+#
+# Product.expiry_date is indexed, so both the nightly sweep and the "expiring
+# soon" report are range scans over the index rather than full table scans.
+# The sweep only zeroes a product whose stock and expiry date are still what
+# it read, so a restock or sale that lands in between is left alone (and
+# picked up by the next sweep if still expired), and the log records exactly
+# the stock that was written off.
+#
+# Usage (e.g. from cron, shortly after midnight):
+#   flask sweep-expired
+#   flask sweep-expired --dry-run
+
+from datetime import datetime, date, timedelta
+
+import click
+from flask import Blueprint, request, jsonify, session
+from sqlalchemy import tuple_
+
+from extensions import db
+from models import Product, Category, InventoryLog
+from auth import admin_required
+from low_stock import sync_low_stock
+from pos import barcode_index
+
+bp = Blueprint('inventory_expiry', __name__, cli_group=None)
+
+SWEEP_BATCH_SIZE = 1000  # products per UPDATE ... WHERE (id, stock) IN (...) statement
+MAX_PER_PAGE = 200
+
+
+def expiring_query(within_days=7, today=None):
+    """Products with stock whose expiry date falls within the window"""
+    today = today or date.today()
+    cutoff = today + timedelta(days=within_days)
+    return Product.query.filter(
+        Product.expiry_date.isnot(None),
+        Product.expiry_date <= cutoff,
+        Product.stock_quantity > 0
+    )
+
+
+def sweep_expired(today=None, user_id=None, dry_run=False):
+    """Write off stock of every product whose expiry date has passed"""
+    today = today or date.today()
+    expired = db.session.query(Product.id, Product.barcode, Product.stock_quantity).filter(
+        Product.expiry_date.isnot(None),
+        Product.expiry_date < today,
+        Product.stock_quantity > 0
+    ).all()
+
+    if dry_run or not expired:
+        return {'products': len(expired), 'units': sum(stock for _, _, stock in expired)}
+
+    now = datetime.utcnow()
+    written_off = []
+    for start in range(0, len(expired), SWEEP_BATCH_SIZE):
+        batch = _write_off(expired[start:start + SWEEP_BATCH_SIZE], today, now)
+        if not batch:
+            continue
+        written_off.extend(batch)
+        db.session.execute(InventoryLog.__table__.insert(), [{
+            'product_id': product_id,
+            'change_type': 'expired',
+            'quantity_change': -stock,
+            'previous_quantity': stock,
+            'new_quantity': 0,
+            'reason': f'Expired before {today.isoformat()}',
+            'created_by': user_id,
+            'created_at': now,
+        } for product_id, _, stock in batch])
+        sync_low_stock([product_id for product_id, _, _ in batch])
+    db.session.commit()
+
+    barcode_index.refresh(product_ids=[product_id for product_id, _, _ in written_off])
+
+    return {'products': len(written_off), 'units': sum(stock for _, _, stock in written_off)}
+
+
+def _write_off(batch, today, now):
+    """Zero the stock of products still expired with the stock that was read; returns the rows changed"""
+    table = Product.__table__
+    statement = table.update().where(
+        tuple_(table.c.id, table.c.stock_quantity).in_([(product_id, stock) for product_id, _, stock in batch]),
+        table.c.expiry_date < today
+    ).values(stock_quantity=0, updated_at=now)
+    if db.session.get_bind().dialect.update_returning:
+        changed = {row[0] for row in db.session.execute(statement.returning(table.c.id))}
+    elif db.session.execute(statement).rowcount == len(batch):
+        return batch
+    else:
+        changed = {row[0] for row in db.session.query(Product.id).filter(
+            Product.id.in_([product_id for product_id, _, _ in batch]),
+            Product.stock_quantity == 0,
+            Product.updated_at == now
+        )}
+    return [row for row in batch if row[0] in changed]
+
+
+@bp.route('/api/admin/inventory/expiring')
+@admin_required
+def expiring_soon_report():
+    days = request.args.get('days', 7, type=int)
+    page = request.args.get('page', 1, type=int)
+    per_page = max(1, min(request.args.get('per_page', 50, type=int), MAX_PER_PAGE))
+    today = date.today()
+
+    products = expiring_query(days, today).order_by(
+        Product.expiry_date.asc(), Product.id.asc()
+    ).paginate(page=page, per_page=per_page, error_out=False)
+
+    category_names = dict(db.session.query(Category.id, Category.name).filter(
+        Category.id.in_({p.category_id for p in products.items})
+    )) if products.items else {}
+
+    return jsonify({
+        'days': days,
+        'products': [{
+            'id': p.id,
+            'name': p.name,
+            'barcode': p.barcode,
+            'category_name': category_names.get(p.category_id),
+            'expiry_date': p.expiry_date.isoformat(),
+            'days_left': (p.expiry_date - today).days,
+            'stock_quantity': p.stock_quantity,
+            'stock_value': p.stock_quantity * p.price,
+            'is_expired': p.expiry_date < today
+        } for p in products.items],
+        'pagination': {
+            'page': products.page,
+            'pages': products.pages,
+            'per_page': products.per_page,
+            'total': products.total,
+            'has_next': products.has_next,
+            'has_prev': products.has_prev
+        }
+    })
+
+
+@bp.route('/api/admin/inventory/sweep-expired', methods=['POST'])
+@admin_required
+def sweep_expired_now():
+    result = sweep_expired(user_id=session['user_id'])
+    return jsonify({'success': True, **result})
+
+
+@bp.cli.command('sweep-expired')
+@click.option('--dry-run', is_flag=True, help='report what would be written off')
+def sweep_expired_command(dry_run):
+    """Write off stock of expired products"""
+    result = sweep_expired(dry_run=dry_run)
+    verb = 'Would write off' if dry_run else 'Wrote off'
+    click.echo(f"{verb} {result['units']} units across {result['products']} expired products")
@@ -0,0 +1,201 @@
+# Materialized Low Stock View for the Grocery Website
+#
+# low_stock_item holds one row per available product at or below its minimum
+# stock level, keyed by how far below the minimum it is. ORM writes to
+# Product keep it current inside the same transaction; bulk Core writers call
+# sync_low_stock() for the product ids they touched. Every change to the set
+# also moves the single low_stock_count row, so the dashboard total is one
+# primary key read. Both tables are filled from the product table when they
+# are created.
+#
+# Usage:
+#   flask rebuild-low-stock
+
+from datetime import datetime
+
+import click
+from flask import Blueprint, request, jsonify
+from sqlalchemy import event, inspect, func
+
+from extensions import db
+from models import Product
+from auth import admin_required
+
+bp = Blueprint('low_stock', __name__, cli_group=None)
+
+
+class LowStockItem(db.Model):
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    deficit = db.Column(db.Integer, nullable=False, index=True)  # min_stock_level - stock_quantity
+    stock_quantity = db.Column(db.Integer, nullable=False)
+    min_stock_level = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class LowStockCount(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # always 1
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+def _is_low(stock_quantity, min_stock_level, is_available):
+    return bool(is_available) and (stock_quantity or 0) <= (min_stock_level or 0)
+
+
+def _low_stock_row(product_id, stock_quantity, min_stock_level, now):
+    return {
+        'product_id': product_id,
+        'deficit': (min_stock_level or 0) - (stock_quantity or 0),
+        'stock_quantity': stock_quantity or 0,
+        'min_stock_level': min_stock_level or 0,
+        'updated_at': now,
+    }
+
+
+def _write_rows(connection, product_ids, rows):
+    table = LowStockItem.__table__
+    removed = connection.execute(table.delete().where(table.c.product_id.in_(product_ids))).rowcount
+    if rows:
+        connection.execute(table.insert(), rows)
+    if len(rows) != removed:
+        counter = LowStockCount.__table__
+        connection.execute(counter.update().where(counter.c.id == 1).values(count=counter.c.count + len(rows) - removed))
+
+
+def _reset_count(connection):
+    """Set the counter row from the materialized set"""
+    counter = LowStockCount.__table__
+    connection.execute(counter.delete())
+    connection.execute(counter.insert().from_select(
+        ['id', 'count'], db.select(db.literal(1), func.count()).select_from(LowStockItem.__table__)
+    ))
+
+
+def sync_low_stock(product_ids):
+    """Recompute low stock rows for products changed outside the ORM"""
+    product_ids = list(set(product_ids))
+    if not product_ids:
+        return
+    now = datetime.utcnow()
+    rows = [
+        _low_stock_row(product_id, stock, minimum, now)
+        for product_id, stock, minimum, available in db.session.query(
+            Product.id, Product.stock_quantity, Product.min_stock_level, Product.is_available
+        ).filter(Product.id.in_(product_ids))
+        if _is_low(stock, minimum, available)
+    ]
+    _write_rows(db.session.connection(), product_ids, rows)
+
+
+def _fill(connection):
+    table = LowStockItem.__table__
+    source = db.select(
+        Product.id,
+        (func.coalesce(Product.min_stock_level, 0) - func.coalesce(Product.stock_quantity, 0)),
+        func.coalesce(Product.stock_quantity, 0),
+        func.coalesce(Product.min_stock_level, 0),
+        db.literal(datetime.utcnow())
+    ).where(
+        func.coalesce(Product.stock_quantity, 0) <= func.coalesce(Product.min_stock_level, 0),
+        Product.is_available == True
+    )
+    connection.execute(table.delete())
+    connection.execute(table.insert().from_select(
+        ['product_id', 'deficit', 'stock_quantity', 'min_stock_level', 'updated_at'], source
+    ))
+    _reset_count(connection)
+
+
+def rebuild_low_stock():
+    """Rebuild the whole view with one INSERT ... SELECT"""
+    _fill(db.session.connection())
+    db.session.commit()
+    return low_stock_count()
+
+
+def low_stock_count():
+    """Number of low stock products, read from the maintained counter row"""
+    count = db.session.query(LowStockCount.count).filter(LowStockCount.id == 1).scalar()
+    if count is None:
+        # Counter not initialized yet (tables from before it existed); rebuild-low-stock sets it
+        count = db.session.query(func.count(LowStockItem.product_id)).scalar() or 0
+    return count
+
+
+def low_stock_page(page=1, per_page=20):
+    """Low stock products, most urgent (largest deficit) first"""
+    return db.session.query(LowStockItem, Product.name).join(
+        Product, Product.id == LowStockItem.product_id
+    ).order_by(
+        LowStockItem.deficit.desc(), LowStockItem.product_id.asc()
+    ).offset((page - 1) * per_page).limit(per_page).all()
+
+
+# Fill the view from the products already there when its tables are created
+@event.listens_for(LowStockItem.__table__, 'after_create')
+def _low_stock_created(target, connection, **kw):
+    LowStockCount.__table__.create(connection, checkfirst=True)
+    _fill(connection)
+
+
+@event.listens_for(LowStockCount.__table__, 'after_create')
+def _count_created(target, connection, **kw):
+    if inspect(connection).has_table(LowStockItem.__tablename__):
+        _reset_count(connection)
+
+
+# Keep the view current for ORM writes, in the same flush as the product row
+_TRACKED = ('stock_quantity', 'min_stock_level', 'is_available')
+
+
+@event.listens_for(Product, 'after_insert')
+@event.listens_for(Product, 'after_update')
+def _product_written(mapper, connection, target):
+    state = inspect(target)
+    if state.persistent and not any(state.attrs[name].history.has_changes() for name in _TRACKED):
+        return
+    rows = []
+    if _is_low(target.stock_quantity, target.min_stock_level, target.is_available):
+        rows.append(_low_stock_row(target.id, target.stock_quantity, target.min_stock_level, datetime.utcnow()))
+    _write_rows(connection, [target.id], rows)
+
+
+@event.listens_for(Product, 'before_delete')
+def _product_deleted(mapper, connection, target):
+    _write_rows(connection, [target.id], [])
+
+
+@bp.route('/api/admin/inventory/low-stock')
+@admin_required
+def get_low_stock():
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', 20, type=int), 100)
+
+    total = low_stock_count()
+    items = low_stock_page(page, per_page)
+    pages = (total + per_page - 1) // per_page
+
+    return jsonify({
+        'products': [{
+            'id': item.product_id,
+            'name': name,
+            'current_stock': item.stock_quantity,
+            'min_level': item.min_stock_level,
+            'deficit': item.deficit
+        } for item, name in items],
+        'pagination': {
+            'page': page,
+            'pages': pages,
+            'per_page': per_page,
+            'total': total,
+            'has_next': page < pages,
+            'has_prev': page > 1
+        }
+    })
+
+
+@bp.cli.command('rebuild-low-stock')
+def rebuild_low_stock_command():
+    """Rebuild the materialized low stock view from the product table"""
+    for model in (LowStockItem, LowStockCount):
+        model.__table__.create(db.engine, checkfirst=True)
+    click.echo(f'{rebuild_low_stock()} products are at or below their minimum stock level')
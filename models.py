@@ -1,117 +1,209 @@
-from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
-
-db = SQLAlchemy()
-
-class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
-    first_name = db.Column(db.String(80))
-    last_name = db.Column(db.String(80))
-    phone = db.Column(db.String(20))
-    address = db.Column(db.String(200))
-    city = db.Column(db.String(80))
-    postal_code = db.Column(db.String(20))
-    is_active = db.Column(db.Boolean, default=True)
-    is_admin = db.Column(db.Boolean, default=False)
-    verification_token = db.Column(db.String(128))
-    reset_token = db.Column(db.String(128))
-    reset_token_expires = db.Column(db.DateTime)
-    last_login = db.Column(db.DateTime)
-    # Add relationships if needed
-
-class Category(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(80), nullable=False)
-    description = db.Column(db.String(200))
-    image_url = db.Column(db.String(200))
-    is_active = db.Column(db.Boolean, default=True)
-    sort_order = db.Column(db.Integer, default=0)
-    products = db.relationship('Product', backref='category', lazy=True)
-
-class Product(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(120), nullable=False)
-    description = db.Column(db.Text)
-    price = db.Column(db.Float, nullable=False)
-    original_price = db.Column(db.Float)
-    image_url = db.Column(db.String(200))
-    stock_quantity = db.Column(db.Integer, default=0)
-    unit = db.Column(db.String(20))
-    brand = db.Column(db.String(80))
-    weight = db.Column(db.Float)
-    is_available = db.Column(db.Boolean, default=True)
-    is_featured = db.Column(db.Boolean, default=False)
-    average_rating = db.Column(db.Float, default=0)
-    review_count = db.Column(db.Integer, default=0)
-    category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class Review(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    rating = db.Column(db.Integer)
-    title = db.Column(db.String(120))
-    comment = db.Column(db.Text)
-    is_verified_purchase = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user = db.relationship('User')
-    product = db.relationship('Product')
-
-class CartItem(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
-    quantity = db.Column(db.Integer, default=1)
-    user = db.relationship('User')
-    product = db.relationship('Product')
-
-class WishlistItem(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
-    added_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user = db.relationship('User')
-    product = db.relationship('Product')
-
-class Coupon(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    code = db.Column(db.String(50), unique=True, nullable=False)
-    discount_type = db.Column(db.String(20))  # 'percentage' or 'fixed'
-    discount_value = db.Column(db.Float)
-    min_order_amount = db.Column(db.Float, default=0)
-    max_discount_amount = db.Column(db.Float)
-    valid_until = db.Column(db.DateTime)
-    is_active = db.Column(db.Boolean, default=True)
-    used_count = db.Column(db.Integer, default=0)
-
-class Order(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    order_number = db.Column(db.String(50), unique=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    total_amount = db.Column(db.Float)
-    tax_amount = db.Column(db.Float)
-    delivery_fee = db.Column(db.Float)
-    discount_amount = db.Column(db.Float)
-    delivery_address = db.Column(db.String(200))
-    delivery_date = db.Column(db.DateTime)
-    delivery_time_slot = db.Column(db.String(50))
-    special_instructions = db.Column(db.Text)
-    payment_method = db.Column(db.String(50))
-    stripe_payment_intent_id = db.Column(db.String(100))
-    payment_status = db.Column(db.String(20))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user = db.relationship('User')
-
-class OrderItem(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'))
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
-    quantity = db.Column(db.Integer)
-    price = db.Column(db.Float)
-    total = db.Column(db.Float)
-    order = db.relationship('Order')
-    product = db.relationship('Product')
\ No newline at end of file
+# Database Models for the Grocery Website
+#
+# The one model registry for the core tables. Feature modules define their
+# own tables on the same db, so create_app() sees every model once.
+
+import secrets
+from datetime import datetime
+
+from extensions import db
+
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password_hash = db.Column(db.String(120), nullable=False)
+    first_name = db.Column(db.String(50))
+    last_name = db.Column(db.String(50))
+    phone = db.Column(db.String(20))
+    address = db.Column(db.Text)
+    city = db.Column(db.String(50))
+    postal_code = db.Column(db.String(10))
+    is_admin = db.Column(db.Boolean, default=False)
+    is_active = db.Column(db.Boolean, default=True)
+    email_verified = db.Column(db.Boolean, default=False)
+    verification_token = db.Column(db.String(100))
+    reset_token = db.Column(db.String(100))
+    reset_token_expires = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_login = db.Column(db.DateTime)
+    
+    # Relationships
+    orders = db.relationship('Order', backref='user', lazy=True)
+    cart_items = db.relationship('CartItem', backref='user', lazy=True)
+    reviews = db.relationship('Review', backref='user', lazy=True)
+    wishlist_items = db.relationship('WishlistItem', backref='user', lazy=True)
+
+class Category(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.Text)
+    image_url = db.Column(db.String(200))
+    thumbnail_url = db.Column(db.String(200))  # set by image_uploads once variants exist
+    image_variants = db.Column(db.Text)  # JSON variant URLs
+    is_active = db.Column(db.Boolean, default=True)
+    sort_order = db.Column(db.Integer, default=0)
+    
+    # Relationships
+    products = db.relationship('Product', backref='category', lazy=True)
+
+class Product(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.Text)
+    price = db.Column(db.Float, nullable=False)
+    original_price = db.Column(db.Float)  # For discounts
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
+    image_url = db.Column(db.String(200))
+    thumbnail_url = db.Column(db.String(200))  # set by image_uploads once variants exist
+    image_variants = db.Column(db.Text)  # JSON variant URLs
+    stock_quantity = db.Column(db.Integer, default=0)
+    min_stock_level = db.Column(db.Integer, default=10)
+    is_available = db.Column(db.Boolean, default=True)
+    is_featured = db.Column(db.Boolean, default=False)
+    weight = db.Column(db.Float)  # in kg
+    unit = db.Column(db.String(20))  # piece, kg, liter, etc.
+    barcode = db.Column(db.String(50), unique=True, index=True)
+    brand = db.Column(db.String(100))
+    expiry_date = db.Column(db.Date, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Relationships
+    cart_items = db.relationship('CartItem', backref='product', lazy=True)
+    order_items = db.relationship('OrderItem', backref='product', lazy=True)
+    reviews = db.relationship('Review', backref='product', lazy=True)
+    wishlist_items = db.relationship('WishlistItem', backref='product', lazy=True)
+    
+    @property
+    def average_rating(self):
+        reviews = Review.query.filter_by(product_id=self.id).all()
+        if reviews:
+            return sum(review.rating for review in reviews) / len(reviews)
+        return 0
+    
+    @property
+    def review_count(self):
+        return Review.query.filter_by(product_id=self.id).count()
+
+class CartItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    added_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # One line per product, so concurrent adds update a line instead of duplicating it
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'product_id', name='uq_cart_item_user_product'),
+    )
+
+class Order(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    order_number = db.Column(db.String(20), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    total_amount = db.Column(db.Float, nullable=False)
+    tax_amount = db.Column(db.Float, default=0)
+    delivery_fee = db.Column(db.Float, default=0)
+    discount_amount = db.Column(db.Float, default=0)
+    status = db.Column(db.String(50), default='pending')  # pending, confirmed, processing, shipped, delivered, cancelled
+    payment_status = db.Column(db.String(50), default='pending')  # pending, paid, failed, refunded
+    payment_method = db.Column(db.String(50))
+    stripe_payment_intent_id = db.Column(db.String(100))
+    delivery_address = db.Column(db.Text)
+    delivery_date = db.Column(db.DateTime)
+    delivery_time_slot = db.Column(db.String(50))
+    delivery_slot_id = db.Column(db.Integer)  # DeliverySlot.id, see delivery_slots.py
+    special_instructions = db.Column(db.Text)
+    tracking_number = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Relationships
+    order_items = db.relationship('OrderItem', backref='order', lazy=True)
+    
+    def __init__(self, **kwargs):
+        super(Order, self).__init__(**kwargs)
+        if not self.order_number:
+            self.order_number = self.generate_order_number()
+    
+    def generate_order_number(self):
+        return f"ORD{datetime.now().strftime('%Y%m%d')}{secrets.token_hex(4).upper()}"
+
+class OrderItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    total = db.Column(db.Float, nullable=False)
+
+class Review(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    rating = db.Column(db.Integer, nullable=False)  # 1-5 stars
+    title = db.Column(db.String(200))
+    comment = db.Column(db.Text)
+    is_verified_purchase = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class WishlistItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    added_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Coupon(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(50), unique=True, nullable=False)
+    description = db.Column(db.String(200))
+    discount_type = db.Column(db.String(20))  # percentage, fixed
+    discount_value = db.Column(db.Float, nullable=False)
+    min_order_amount = db.Column(db.Float, default=0)
+    max_discount_amount = db.Column(db.Float)
+    usage_limit = db.Column(db.Integer)
+    used_count = db.Column(db.Integer, default=0)
+    per_user_limit = db.Column(db.Integer)
+    counter_shards = db.Column(db.Integer, default=0)  # > 0 when usage is counted in CouponCounterShard
+    is_active = db.Column(db.Boolean, default=True)
+    valid_from = db.Column(db.DateTime, default=datetime.utcnow)
+    valid_until = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Newsletter(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    is_active = db.Column(db.Boolean, default=True)
+    subscribed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ContactMessage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    email = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200))
+    message = db.Column(db.Text, nullable=False)
+    is_read = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SearchLog(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    query = db.Column(db.String(200), nullable=False)
+    results_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class InventoryLog(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    change_type = db.Column(db.String(50))  # restock, sale, adjustment, expired
+    quantity_change = db.Column(db.Integer, nullable=False)
+    previous_quantity = db.Column(db.Integer, nullable=False)
+    new_quantity = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(200))
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (
+        db.Index('ix_inventory_log_product_created', 'product_id', 'created_at'),
+    )
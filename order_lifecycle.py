@@ -0,0 +1,286 @@
+# Order Lifecycle for the Grocery Website
+#
+# Order.status only moves along ORDER_TRANSITIONS. A wave of orders (explicit
+# ids, a delivery slot or a delivery run) is moved with one guarded UPDATE per
+# current status; only the orders that UPDATE actually changed get a row in
+# order_status_history, a released delivery slot and a customer email queued
+# in order_notification with one INSERT ... SELECT. The queue is drained in
+# batches outside the request; an email that fails stays queued and is retried
+# up to MAX_NOTIFICATION_ATTEMPTS times.
+#
+# Usage:
+#   flask send-order-notifications
+#   flask send-order-notifications --loop   # keep draining every few seconds
+
+import time
+from datetime import date, datetime, timedelta
+
+import click
+from flask import Blueprint, request, jsonify, session
+from sqlalchemy import func, literal
+
+from extensions import db
+from models import Order, User
+from auth import admin_required
+from delivery_slots import release_booking
+from dispatch import DeliveryRun, DeliveryRunStop
+from email_templates import send_order_status_updates
+
+bp = Blueprint('order_lifecycle', __name__, cli_group=None)
+
+ORDER_TRANSITIONS = {
+    'pending': {'confirmed', 'cancelled'},
+    'confirmed': {'processing', 'cancelled'},
+    'processing': {'shipped', 'cancelled'},
+    'shipped': {'delivered'},
+    'delivered': set(),
+    'cancelled': set(),
+}
+NOTIFICATION_BATCH_SIZE = 500
+MAX_NOTIFICATION_ATTEMPTS = 5
+MAX_WAVE_SIZE = 5000
+
+
+class OrderStatusHistory(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
+    from_status = db.Column(db.String(50))
+    to_status = db.Column(db.String(50), nullable=False)
+    changed_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    note = db.Column(db.Text)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class OrderNotification(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
+    status = db.Column(db.String(50), nullable=False)
+    email = db.Column(db.String(120), nullable=False)
+    first_name = db.Column(db.String(50))
+    order_number = db.Column(db.String(20), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, index=True)
+    attempts = db.Column(db.Integer, default=0)  # failed sends so far
+
+
+class TransitionError(Exception):
+    """Raised for an unknown status or a wave that selects no orders"""
+
+
+def allowed_sources(to_status):
+    """Statuses an order may move to to_status from"""
+    if to_status not in ORDER_TRANSITIONS:
+        raise TransitionError(f'Unknown order status: {to_status}')
+    return {status for status, targets in ORDER_TRANSITIONS.items() if to_status in targets}
+
+
+def wave_order_ids(order_ids=None, delivery_date=None, time_slot=None, run_number=None):
+    """Order ids selected by explicit ids, a delivery date and slot, or a delivery run"""
+    if order_ids:
+        return list(order_ids)
+    if run_number:
+        return [row[0] for row in db.session.query(DeliveryRunStop.order_id).join(
+            DeliveryRun, DeliveryRun.id == DeliveryRunStop.run_id
+        ).filter(DeliveryRun.run_number == run_number)]
+    if delivery_date:
+        start = datetime.combine(delivery_date, datetime.min.time())
+        query = db.session.query(Order.id).filter(
+            Order.delivery_date >= start,
+            Order.delivery_date < start + timedelta(days=1)
+        )
+        if time_slot:
+            query = query.filter(Order.delivery_time_slot == time_slot)
+        return [row[0] for row in query]
+    raise TransitionError('Select orders by order_ids, delivery_date or run_number')
+
+
+def transition_orders(order_ids, to_status, changed_by=None, note=None, notify=True):
+    """Move orders to to_status where the transition is allowed.
+
+    Returns (updated order ids, {order_id: current status} for the rejected
+    ones) and commits the session.
+    """
+    sources = allowed_sources(to_status)
+    current = dict(db.session.query(Order.id, Order.status).filter(
+        Order.id.in_(order_ids)
+    ).with_for_update())
+
+    by_status = {}
+    rejected = {}
+    for order_id, status in current.items():
+        status = status or 'pending'
+        if status in sources:
+            by_status.setdefault(status, []).append(order_id)
+        else:
+            rejected[order_id] = status
+
+    now = datetime.utcnow()
+    table = Order.__table__
+    updated = []
+    history = []
+    for from_status, ids in by_status.items():
+        # Guarded on the status that was read, so a concurrent change is not overwritten
+        status_filter = table.c.status == from_status
+        if from_status == 'pending':
+            status_filter = status_filter | table.c.status.is_(None)
+        ids = _guarded_update(table.update().where(table.c.id.in_(ids), status_filter).values(
+            status=to_status, updated_at=now
+        ), ids, to_status, now)
+        updated.extend(ids)
+        history.extend({
+            'order_id': order_id,
+            'from_status': from_status,
+            'to_status': to_status,
+            'changed_by': changed_by,
+            'note': note,
+            'changed_at': now,
+        } for order_id in ids)
+
+    if len(updated) + len(rejected) < len(current):
+        # Orders changed by someone else between the read and the UPDATE
+        lost = set(current) - set(updated) - set(rejected)
+        rejected.update(db.session.query(Order.id, Order.status).filter(Order.id.in_(lost)))
+    if history:
+        db.session.execute(OrderStatusHistory.__table__.insert(), history)
+    if updated and to_status == 'cancelled':
+        _release_delivery_slots(updated)
+    if updated and notify:
+        _enqueue_notifications(updated, to_status, now)
+    db.session.commit()
+    return updated, rejected
+
+
+def _guarded_update(statement, ids, to_status, now):
+    # The ids the UPDATE really changed: RETURNING where the database has it,
+    # otherwise a re-read of the rows it must have written when rowcount is short
+    if db.session.get_bind().dialect.update_returning:
+        return [row[0] for row in db.session.execute(statement.returning(Order.__table__.c.id))]
+    if db.session.execute(statement).rowcount == len(ids):
+        return ids
+    return [row[0] for row in db.session.query(Order.id).filter(
+        Order.id.in_(ids), Order.status == to_status, Order.updated_at == now
+    )]
+
+
+def _release_delivery_slots(order_ids):
+    booked = {}
+    for slot_id, in db.session.query(Order.delivery_slot_id).filter(
+        Order.id.in_(order_ids), Order.delivery_slot_id.isnot(None)
+    ):
+        booked[slot_id] = booked.get(slot_id, 0) + 1
+    for slot_id, count in booked.items():
+        release_booking(slot_id, count)
+
+
+def _enqueue_notifications(order_ids, status, now):
+    source = db.select(
+        Order.id, literal(status), User.email, User.first_name, Order.order_number, literal(now)
+    ).select_from(Order).join(User, User.id == Order.user_id).filter(Order.id.in_(order_ids))
+    db.session.execute(OrderNotification.__table__.insert().from_select(
+        ['order_id', 'status', 'email', 'first_name', 'order_number', 'created_at'], source
+    ))
+
+
+def send_pending_notifications(batch_size=NOTIFICATION_BATCH_SIZE):
+    """Send one batch of queued status emails; returns how many were sent"""
+    pending = OrderNotification.query.filter(
+        OrderNotification.sent_at.is_(None),
+        func.coalesce(OrderNotification.attempts, 0) < MAX_NOTIFICATION_ATTEMPTS
+    ).order_by(OrderNotification.id).limit(batch_size).all()
+    if not pending:
+        return 0
+
+    results = send_order_status_updates([{
+        'order_id': notification.order_id,
+        'order_number': notification.order_number,
+        'email': notification.email,
+        'first_name': notification.first_name,
+        'status': notification.status,
+    } for notification in pending])
+
+    sent = [notification.id for notification, ok in zip(pending, results) if ok]
+    failed = [notification.id for notification, ok in zip(pending, results) if not ok]
+    table = OrderNotification.__table__
+    if sent:
+        db.session.execute(table.update().where(table.c.id.in_(sent)).values(sent_at=datetime.utcnow()))
+    if failed:
+        # Left unsent for the next batch, until the attempts run out
+        db.session.execute(table.update().where(table.c.id.in_(failed)).values(
+            attempts=func.coalesce(table.c.attempts, 0) + 1
+        ))
+    db.session.commit()
+    return len(sent)
+
+
+@bp.route('/api/admin/orders/status', methods=['POST'])
+@admin_required
+def update_order_statuses():
+    data = request.get_json() or {}
+    try:
+        delivery_date = date.fromisoformat(data['delivery_date']) if data.get('delivery_date') else None
+        order_ids = wave_order_ids(
+            data.get('order_ids'), delivery_date, data.get('time_slot'), data.get('run_number')
+        )
+        if len(order_ids) > MAX_WAVE_SIZE:
+            return jsonify({'error': f'A wave can update at most {MAX_WAVE_SIZE} orders'}), 400
+        updated, rejected = transition_orders(
+            order_ids, data.get('status'), session['user_id'], data.get('note'), data.get('notify', True)
+        )
+    except ValueError:
+        return jsonify({'error': 'delivery_date must be YYYY-MM-DD'}), 400
+    except TransitionError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'success': True,
+        'updated': len(updated),
+        'rejected': [{'order_id': order_id, 'status': status} for order_id, status in rejected.items()]
+    })
+
+
+@bp.route('/api/admin/orders/<int:order_id>/status', methods=['PUT'])
+@admin_required
+def update_order_status(order_id):
+    data = request.get_json() or {}
+    try:
+        updated, rejected = transition_orders([order_id], data.get('status'), session['user_id'], data.get('note'))
+    except TransitionError as e:
+        return jsonify({'error': str(e)}), 400
+    if order_id in rejected:
+        return jsonify({'error': f"Cannot change a {rejected[order_id]} order to {data.get('status')}"}), 409
+    if not updated:
+        return jsonify({'error': 'Order not found'}), 404
+    return jsonify({'success': True, 'order_id': order_id, 'status': data.get('status')})
+
+
+@bp.route('/api/admin/orders/<int:order_id>/status-history')
+@admin_required
+def get_order_status_history(order_id):
+    history = OrderStatusHistory.query.filter_by(order_id=order_id).order_by(OrderStatusHistory.id).all()
+    return jsonify([{
+        'from_status': entry.from_status,
+        'to_status': entry.to_status,
+        'changed_by': entry.changed_by,
+        'note': entry.note,
+        'changed_at': entry.changed_at.isoformat()
+    } for entry in history])
+
+
+@bp.cli.command('send-order-notifications')
+@click.option('--batch-size', default=NOTIFICATION_BATCH_SIZE, show_default=True)
+@click.option('--loop', is_flag=True, help='keep polling the queue')
+@click.option('--interval', default=5.0, show_default=True, help='seconds between polls with --loop')
+def send_order_notifications_command(batch_size, loop, interval):
+    """Send queued order status emails in batches"""
+    for model in (OrderStatusHistory, OrderNotification):
+        model.__table__.create(db.engine, checkfirst=True)
+    while True:
+        sent = total = send_pending_notifications(batch_size)
+        while sent == batch_size:
+            sent = send_pending_notifications(batch_size)
+            total += sent
+        if total:
+            click.echo(f'Sent {total} order status emails')
+        if not loop:
+            break
+        time.sleep(interval)
@@ -0,0 +1,245 @@
+# Stripe Payment Intents for the Grocery Website
+#
+# Checkout keeps one open PaymentIntent per user. Each intent records the
+# version of the cart it was created for: a hash of the cart lines and the
+# amount. Asking again for the same cart returns the stored client secret
+# once Stripe confirms the intent is still open; it may have been paid from
+# another tab without an order being placed. A changed cart updates the open
+# intent's amount, and a new intent is only created once the previous one is
+# paid, cancelled or can no longer be changed. Every create and update carries an idempotency
+# key derived from the user and the cart version, so a retried checkout or
+# a retried network call cannot create a second intent.
+#
+# Stripe calls have connect and read timeouts and run through a circuit
+# breaker. After STRIPE_BREAKER_FAILURES connection errors, timeouts or
+# Stripe 5xx/429 responses in a row, checkout answers 503 at once for
+# STRIPE_BREAKER_RESET_SECONDS instead of tying up request threads.
+#
+# Point STRIPE_API_BASE at a local fake Stripe server (e.g. stripe-mock on
+# http://localhost:12111) to run checkout without the real API.
+
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime
+
+from flask import Blueprint, current_app, jsonify
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db, get_stripe_client
+from auth import admin_required
+
+bp = Blueprint('payments', __name__, cli_group=None)
+
+CURRENCY = 'usd'
+# Statuses after which an intent can no longer be reused for a new checkout
+CLOSED_STATUSES = ('succeeded', 'canceled')
+
+
+class PaymentIntentRecord(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    stripe_intent_id = db.Column(db.String(100), unique=True, nullable=False)
+    client_secret = db.Column(db.String(200), nullable=False)
+    cart_version = db.Column(db.String(64), nullable=False)
+    amount = db.Column(db.Integer, nullable=False)  # cents
+    currency = db.Column(db.String(3), default=CURRENCY)
+    status = db.Column(db.String(40), nullable=False)
+    revision = db.Column(db.Integer, default=0)  # amount updates sent to Stripe
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class PaymentUnavailable(Exception):
+    """Raised when Stripe cannot be reached or the circuit breaker is open"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stops calling Stripe after repeated transient failures, then lets one trial call through"""
+
+    def __init__(self, failure_threshold=5, reset_seconds=30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.open_until = 0
+        self.opened = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.failures < self.failure_threshold:
+            return 'closed'
+        return 'open' if time.monotonic() < self.open_until else 'half-open'
+
+    def _allow(self):
+        with self._lock:
+            if self.failures < self.failure_threshold:
+                return True
+            now = time.monotonic()
+            if now < self.open_until:
+                return False
+            # Half-open: this call is the trial, everyone else waits out another period
+            self.open_until = now + self.reset_seconds
+            return True
+
+    def _record(self, failed):
+        with self._lock:
+            if not failed:
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.failures == self.failure_threshold:
+                self.opened += 1
+            if self.failures >= self.failure_threshold:
+                self.open_until = time.monotonic() + self.reset_seconds
+
+    def call(self, f, *args, **kwargs):
+        import stripe
+        if not self._allow():
+            raise PaymentUnavailable('Payments are temporarily unavailable', self.reset_seconds)
+        try:
+            result = f(*args, **kwargs)
+        except (stripe.APIConnectionError, stripe.APIError, stripe.RateLimitError) as e:
+            self._record(failed=True)
+            current_app.logger.warning(f'Stripe request failed: {e}')
+            raise PaymentUnavailable('Payments are temporarily unavailable', self.reset_seconds) from e
+        except stripe.StripeError:
+            self._record(failed=False)  # Stripe answered; the request itself was rejected
+            raise
+        self._record(failed=False)
+        return result
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'failure_threshold': self.failure_threshold,
+            'reset_seconds': self.reset_seconds,
+            'times_opened': self.opened,
+        }
+
+
+def get_breaker():
+    """The Stripe circuit breaker for this app"""
+    breaker = current_app.extensions.get('stripe_breaker')
+    if breaker is None:
+        breaker = current_app.extensions.setdefault('stripe_breaker', CircuitBreaker(
+            current_app.config['STRIPE_BREAKER_FAILURES'], current_app.config['STRIPE_BREAKER_RESET_SECONDS']
+        ))
+    return breaker
+
+
+def cart_version(items, amount):
+    """Short hash of the cart lines and the amount charged for them"""
+    lines = sorted((item['product_id'], item['quantity'], item['price']) for item in items)
+    payload = json.dumps([lines, amount, CURRENCY], separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def _stripe(method, *args, **kwargs):
+    return get_breaker().call(method, *args, **kwargs)
+
+
+def _open_intent(user_id):
+    return PaymentIntentRecord.query.filter(
+        PaymentIntentRecord.user_id == user_id,
+        PaymentIntentRecord.status.notin_(CLOSED_STATUSES)
+    ).order_by(PaymentIntentRecord.id.desc()).first()
+
+
+def _refresh_status(record):
+    """Record the intent's current status on Stripe and return it"""
+    intent = _stripe(get_stripe_client().v1.payment_intents.retrieve, record.stripe_intent_id)
+    if intent.status != record.status:
+        record.status = intent.status
+        db.session.commit()
+    return record.status
+
+
+def _update_amount(record, amount, version):
+    """Move an open intent to a new cart; False if Stripe no longer allows changing it"""
+    import stripe
+    intents = get_stripe_client().v1.payment_intents
+    try:
+        intent = _stripe(
+            intents.update, record.stripe_intent_id,
+            {'amount': amount, 'metadata': {'cart_version': version}},
+            {'idempotency_key': f'pi-update-{record.stripe_intent_id}-{record.revision + 1}-{version}'}
+        )
+    except stripe.InvalidRequestError:
+        # Typically paid or cancelled in the meantime; record where it ended up
+        record.status = _stripe(intents.retrieve, record.stripe_intent_id).status
+        db.session.commit()
+        if record.status not in CLOSED_STATUSES:
+            raise  # e.g. still processing; a second intent could charge twice
+        return False
+    record.amount = amount
+    record.cart_version = version
+    record.status = intent.status
+    record.revision += 1
+    db.session.commit()
+    return True
+
+
+def _create_intent(user_id, amount, version):
+    # Intents paid or cancelled before are counted so a repeat of an earlier cart gets a new key
+    generation = PaymentIntentRecord.query.filter(
+        PaymentIntentRecord.user_id == user_id,
+        PaymentIntentRecord.status.in_(CLOSED_STATUSES)
+    ).count()
+    intent = _stripe(
+        get_stripe_client().v1.payment_intents.create,
+        {
+            'amount': amount,
+            'currency': CURRENCY,
+            'metadata': {'user_id': str(user_id), 'order_type': 'grocery_order', 'cart_version': version}
+        },
+        {'idempotency_key': f'pi-create-{user_id}-{generation}-{version}'}
+    )
+    record = PaymentIntentRecord(
+        user_id=user_id,
+        stripe_intent_id=intent.id,
+        client_secret=intent.client_secret,
+        cart_version=version,
+        amount=amount,
+        status=intent.status
+    )
+    db.session.add(record)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent retry sent the same idempotency key and stored the same intent first
+        db.session.rollback()
+        record = PaymentIntentRecord.query.filter_by(stripe_intent_id=intent.id).one()
+    return record
+
+
+def payment_intent_for_cart(user_id, items, amount):
+    """The user's open PaymentIntentRecord for this cart, reusing or updating the open intent"""
+    version = cart_version(items, amount)
+    record = _open_intent(user_id)
+    if record is not None:
+        if record.cart_version == version:
+            if _refresh_status(record) not in CLOSED_STATUSES:
+                return record
+        elif _update_amount(record, amount, version):
+            return record
+    return _create_intent(user_id, amount, version)
+
+
+def close_payment_intent(user_id, stripe_intent_id):
+    """Mark the intent an order was paid with as used; the caller commits"""
+    PaymentIntentRecord.query.filter_by(user_id=user_id, stripe_intent_id=stripe_intent_id).update(
+        {'status': 'succeeded', 'updated_at': datetime.utcnow()}, synchronize_session=False
+    )
+
+
+@bp.route('/api/admin/payments/stripe-status')
+@admin_required
+def stripe_status():
+    return jsonify(get_breaker().stats())
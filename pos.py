@@ -0,0 +1,364 @@
+# Point of Sale Barcode Scanning for the Grocery Website
+#
+# Barcode lookups are answered from an in-memory hash index instead of the
+# database. The index is warmed when the app starts and kept in sync with
+# Product writes made through the ORM in this process. Writes from other
+# workers and from bulk imports are picked up by re-reading the products whose
+# updated_at moved, at most every POS_INDEX_REFRESH_SECONDS.
+#
+# Scans may show a price that is a few seconds old; a sale never does. The
+# sale endpoint reads price and availability of the basket from the database
+# in the same transaction that records it.
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import Blueprint, current_app, request, jsonify, session
+from sqlalchemy import event, bindparam
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, object_session
+
+from extensions import db
+from models import Product, Order, OrderItem, InventoryLog
+from auth import admin_required
+from low_stock import sync_low_stock
+from sqlite_profile import retry_on_busy
+
+bp = Blueprint('pos', __name__, cli_group=None)
+
+MAX_BATCH_SCAN = 500
+TAX_RATE = 0.08
+# Rows committed late with an older updated_at are caught by re-reading this window
+SYNC_OVERLAP = timedelta(seconds=30)
+
+
+class BarcodeIndex:
+    """Barcode -> product summary map used by the tills"""
+
+    COLUMNS = (
+        Product.id, Product.barcode, Product.name, Product.price, Product.original_price,
+        Product.stock_quantity, Product.unit, Product.is_available,
+    )
+
+    def __init__(self):
+        self._entries = {}
+        self._barcodes_by_id = {}
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._synced_at = None
+        self._next_sync = 0
+        self.loaded = False
+
+    @staticmethod
+    def _entry(product_id, barcode, name, price, original_price, stock, unit, is_available):
+        return {
+            'product_id': product_id,
+            'barcode': barcode,
+            'name': name,
+            'price': price,
+            'original_price': original_price,
+            'stock_quantity': stock or 0,
+            'unit': unit,
+            'is_available': bool(is_available),
+        }
+
+    def warm(self):
+        """Load every barcoded product in one query"""
+        started = datetime.utcnow()
+        entries = {}
+        barcodes_by_id = {}
+        for row in db.session.query(*self.COLUMNS).filter(Product.barcode.isnot(None)):
+            entries[row.barcode] = self._entry(*row)
+            barcodes_by_id[row.id] = row.barcode
+        with self._lock:
+            self._entries = entries
+            self._barcodes_by_id = barcodes_by_id
+            self._synced_at = started
+            self.loaded = True
+        return len(entries)
+
+    def sync(self):
+        """Re-read products changed since the last load or sync, e.g. by other workers or imports"""
+        started = datetime.utcnow()
+        changed = db.session.query(*self.COLUMNS).filter(
+            Product.updated_at >= self._synced_at - SYNC_OVERLAP
+        ).all()
+        for row in changed:
+            self.put(*row)
+        self._synced_at = started
+        return len(changed)
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.warm()
+            self._next_sync = time.monotonic() + current_app.config['POS_INDEX_REFRESH_SECONDS']
+        elif time.monotonic() >= self._next_sync and self._sync_lock.acquire(blocking=False):
+            # One request per worker syncs; the others keep answering from the index meanwhile
+            try:
+                self._next_sync = time.monotonic() + current_app.config['POS_INDEX_REFRESH_SECONDS']
+                self.sync()
+            finally:
+                self._sync_lock.release()
+
+    def get(self, barcode):
+        self.ensure_loaded()
+        return self._entries.get(barcode)
+
+    def put(self, product_id, barcode, *values):
+        with self._lock:
+            old_barcode = self._barcodes_by_id.pop(product_id, None)
+            if old_barcode is not None:
+                self._entries.pop(old_barcode, None)
+            if barcode:
+                self._entries[barcode] = self._entry(product_id, barcode, *values)
+                self._barcodes_by_id[product_id] = barcode
+
+    def remove(self, product_id):
+        with self._lock:
+            barcode = self._barcodes_by_id.pop(product_id, None)
+            if barcode is not None:
+                self._entries.pop(barcode, None)
+
+    def adjust_stock(self, changes):
+        """Apply {product_id: quantity_change} without reloading"""
+        with self._lock:
+            for product_id, change in changes.items():
+                entry = self._entries.get(self._barcodes_by_id.get(product_id))
+                if entry:
+                    entry['stock_quantity'] += change
+
+    def refresh(self, barcodes=None, product_ids=None):
+        """Reload specific products after writes that bypassed the ORM"""
+        if not self.loaded:
+            return
+        query = db.session.query(*self.COLUMNS)
+        if barcodes:
+            query = query.filter(Product.barcode.in_(list(barcodes)))
+        elif product_ids:
+            query = query.filter(Product.id.in_(list(product_ids)))
+        else:
+            return
+        for row in query:
+            self.put(*row)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+barcode_index = BarcodeIndex()
+
+
+def init_barcode_index(app):
+    """Warm the barcode index at start-up; without a product table yet it loads on the first scan"""
+    with app.app_context():
+        try:
+            count = barcode_index.warm()
+        except SQLAlchemyError as e:
+            app.logger.warning(f'Barcode index not warmed: {e}')
+        else:
+            barcode_index._next_sync = time.monotonic() + app.config['POS_INDEX_REFRESH_SECONDS']
+            app.logger.info(f'Barcode index warmed with {count} products')
+
+
+# Keep the index in sync with ORM writes once the transaction commits
+def _stash_change(target, op):
+    sess = object_session(target)
+    if sess is None:
+        return
+    snapshot = None
+    if op != 'delete':
+        snapshot = (
+            target.id, target.barcode, target.name, target.price, target.original_price,
+            target.stock_quantity, target.unit, target.is_available,
+        )
+    sess.info.setdefault('pos_index_changes', []).append((op, target.id, snapshot))
+
+
+@event.listens_for(Product, 'after_insert')
+def _product_inserted(mapper, connection, target):
+    _stash_change(target, 'upsert')
+
+
+@event.listens_for(Product, 'after_update')
+def _product_updated(mapper, connection, target):
+    _stash_change(target, 'upsert')
+
+
+@event.listens_for(Product, 'after_delete')
+def _product_deleted(mapper, connection, target):
+    _stash_change(target, 'delete')
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_index_changes(sess):
+    changes = sess.info.pop('pos_index_changes', None)
+    if not changes or not barcode_index.loaded:
+        return
+    for op, product_id, snapshot in changes:
+        if op == 'delete':
+            barcode_index.remove(product_id)
+        else:
+            barcode_index.put(*snapshot)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_index_changes(sess):
+    sess.info.pop('pos_index_changes', None)
+
+
+def scan_result(entry):
+    """Shape an index entry for the till, including promo information"""
+    result = dict(entry)
+    result['in_stock'] = entry['stock_quantity'] > 0
+    if entry['original_price'] and entry['original_price'] > entry['price']:
+        result['promo'] = {
+            'original_price': entry['original_price'],
+            'savings': round(entry['original_price'] - entry['price'], 2),
+        }
+    else:
+        result['promo'] = None
+    return result
+
+
+@bp.route('/api/pos/scan/<barcode>')
+@admin_required
+def pos_scan(barcode):
+    entry = barcode_index.get(barcode)
+    if not entry:
+        return jsonify({'error': 'Unknown barcode'}), 404
+    return jsonify(scan_result(entry))
+
+
+@bp.route('/api/pos/scan', methods=['POST'])
+@admin_required
+def pos_scan_batch():
+    data = request.get_json(silent=True) or {}
+    barcodes = data.get('barcodes') if isinstance(data, dict) else None
+    if not isinstance(barcodes, list) or not all(isinstance(barcode, str) for barcode in barcodes):
+        return jsonify({'error': 'barcodes must be a list of barcodes'}), 400
+    if len(barcodes) > MAX_BATCH_SCAN:
+        return jsonify({'error': f'At most {MAX_BATCH_SCAN} barcodes per scan'}), 400
+
+    barcode_index.ensure_loaded()
+    items = {}
+    unknown = []
+    for barcode in barcodes:
+        entry = barcode_index.get(barcode)
+        if entry:
+            items[barcode] = scan_result(entry)
+        else:
+            unknown.append(barcode)
+    return jsonify({'items': items, 'unknown': unknown})
+
+
+@bp.route('/api/pos/sale', methods=['POST'])
+@admin_required
+@retry_on_busy
+def pos_record_sale():
+    data = request.get_json()
+    lines = data.get('items') or []
+    payment_method = data.get('payment_method', 'cash')
+
+    if not lines:
+        return jsonify({'error': 'Basket is empty'}), 400
+
+    # Collapse repeated scans of the same barcode into one line
+    quantities = {}
+    for line in lines:
+        barcode = line.get('barcode')
+        try:
+            quantity = int(line.get('quantity', 1))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'quantity must be a whole number'}), 400
+        if quantity <= 0:
+            return jsonify({'error': 'quantity must be positive'}), 400
+        quantities[barcode] = quantities.get(barcode, 0) + quantity
+    if len(quantities) > MAX_BATCH_SCAN:
+        return jsonify({'error': f'At most {MAX_BATCH_SCAN} different barcodes per sale'}), 400
+
+    # Charge what the database says now, not what this worker's index last saw;
+    # the same read supplies the previous stock levels for the inventory log
+    current = {
+        row.barcode: row
+        for row in db.session.query(*BarcodeIndex.COLUMNS).filter(Product.barcode.in_(list(quantities)))
+    }
+    basket = []
+    unknown = []
+    for barcode, quantity in quantities.items():
+        row = current.get(barcode)
+        if row is None or not row.is_available:
+            unknown.append(barcode)
+        else:
+            basket.append((BarcodeIndex._entry(*row), quantity))
+    if unknown:
+        return jsonify({'error': 'Unknown or unavailable barcodes', 'barcodes': unknown}), 400
+
+    subtotal = sum(entry['price'] * quantity for entry, quantity in basket)
+    tax_amount = subtotal * TAX_RATE
+    order = Order(
+        user_id=session['user_id'],
+        total_amount=subtotal + tax_amount,
+        tax_amount=tax_amount,
+        delivery_fee=0,
+        discount_amount=0,
+        status='delivered',
+        payment_method=payment_method,
+        payment_status='paid'
+    )
+    db.session.add(order)
+    db.session.flush()
+
+    now = datetime.utcnow()
+    db.session.execute(OrderItem.__table__.insert(), [{
+        'order_id': order.id,
+        'product_id': entry['product_id'],
+        'quantity': quantity,
+        'price': entry['price'],
+        'total': entry['price'] * quantity,
+    } for entry, quantity in basket])
+
+    # One executemany decrement for the whole basket
+    product_table = Product.__table__
+    product_ids = [entry['product_id'] for entry, _ in basket]
+    previous = {entry['product_id']: entry['stock_quantity'] for entry, _ in basket}
+    db.session.execute(
+        product_table.update()
+        .where(product_table.c.id == bindparam('_id'))
+        .values(stock_quantity=product_table.c.stock_quantity - bindparam('_quantity'), updated_at=now),
+        [{'_id': entry['product_id'], '_quantity': quantity} for entry, quantity in basket]
+    )
+    db.session.execute(InventoryLog.__table__.insert(), [{
+        'product_id': entry['product_id'],
+        'change_type': 'sale',
+        'quantity_change': -quantity,
+        'previous_quantity': previous[entry['product_id']],
+        'new_quantity': previous[entry['product_id']] - quantity,
+        'reason': f'POS sale #{order.order_number}',
+        'created_by': session['user_id'],
+        'created_at': now,
+    } for entry, quantity in basket])
+    sync_low_stock(product_ids)
+    order_id, order_number, total = order.id, order.order_number, order.total_amount
+    db.session.commit()
+
+    for row in current.values():
+        barcode_index.put(*row)
+    barcode_index.adjust_stock({entry['product_id']: -quantity for entry, quantity in basket})
+
+    return jsonify({
+        'success': True,
+        'order_id': order_id,
+        'order_number': order_number,
+        'subtotal': subtotal,
+        'tax_amount': tax_amount,
+        'total': total,
+        'item_count': sum(quantity for _, quantity in basket)
+    })
+
+
+@bp.cli.command('warm-pos-index')
+def warm_pos_index_command():
+    """Load the barcode index and report its size"""
+    click.echo(f'Barcode index loaded with {barcode_index.warm()} products')
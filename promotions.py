@@ -0,0 +1,271 @@
+# Rule-based Promotions Engine for the Grocery Website
+#
+# Active promotions are compiled once into lookups keyed by product and by
+# category, so pricing a cart only touches the rules that can match its lines:
+# O(lines + matching rules) regardless of how many promotions are live.
+#
+# Promotion types:
+#   percent_off   percent off a product or a whole category
+#   bogo          buy `buy_quantity`, get `get_quantity` free (product or category)
+#   bundle        fixed `bundle_price` for one of each product in `bundle_product_ids`
+#   tiered_spend  fixed amount off the cart once the subtotal reaches a tier
+#
+# Malformed tiers and bundle lists are rejected when a Promotion is saved. A
+# rule that still fails to compile (e.g. written with raw SQL) is logged and
+# skipped rather than breaking cart pricing. valid_from and valid_until are
+# checked when a cart is priced, so the compiled cache never serves a rule
+# outside its window.
+
+import json
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session, validates
+
+from extensions import db
+
+CACHE_TTL_SECONDS = 60
+PROMOTION_TYPES = ('percent_off', 'bogo', 'bundle', 'tiered_spend')
+
+
+class Promotion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    promo_type = db.Column(db.String(20), nullable=False)  # percent_off, bogo, bundle, tiered_spend
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
+    percent = db.Column(db.Float)
+    buy_quantity = db.Column(db.Integer)
+    get_quantity = db.Column(db.Integer)
+    bundle_product_ids = db.Column(db.Text)  # JSON list of product ids
+    bundle_price = db.Column(db.Float)
+    tiers = db.Column(db.Text)  # JSON list of {"min_spend": 50, "discount": 5}
+    is_active = db.Column(db.Boolean, default=True)
+    valid_from = db.Column(db.DateTime)
+    valid_until = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @validates('tiers')
+    def validate_tiers(self, key, value):
+        if value is not None:
+            parse_tiers(value)
+        return value
+
+    @validates('bundle_product_ids')
+    def validate_bundle_product_ids(self, key, value):
+        if value is not None:
+            parse_bundle(value)
+        return value
+
+
+def parse_tiers(value):
+    """[(min_spend, discount)] from the tiers JSON; ValueError if malformed"""
+    try:
+        tiers = [(float(tier['min_spend']), float(tier['discount'])) for tier in json.loads(value or '[]')]
+    except (TypeError, KeyError, ValueError):
+        raise ValueError('tiers must be a JSON list of {"min_spend": number, "discount": number}')
+    return tiers
+
+
+def parse_bundle(value):
+    """Sorted distinct product ids from the bundle JSON; ValueError if malformed"""
+    try:
+        product_ids = json.loads(value or '[]')
+        if not isinstance(product_ids, list):
+            raise TypeError
+        return tuple(sorted({int(product_id) for product_id in product_ids}))
+    except (TypeError, ValueError):
+        raise ValueError('bundle_product_ids must be a JSON list of product ids')
+
+
+def _line_discount(rule, line):
+    """Discount a single-line rule gives a cart line"""
+    if rule.promo_type == 'percent_off':
+        return line['price'] * line['quantity'] * (rule.percent or 0) / 100
+    if rule.promo_type == 'bogo':
+        group = (rule.buy_quantity or 1) + (rule.get_quantity or 1)
+        free_units = (line['quantity'] // group) * (rule.get_quantity or 1)
+        return free_units * line['price']
+    return 0
+
+
+class CompiledPromotions:
+    """Active promotions indexed for cart evaluation"""
+
+    def __init__(self, rules, now=None):
+        now = now or datetime.utcnow()
+        self.by_product = {}
+        self.by_category = {}
+        self.bundles_by_product = {}
+        self.tiers = []  # (min_spend, discount, rule) sorted by min_spend descending
+        self.rule_count = 0
+        self.skipped = []  # (rule id, error) for rules that could not be compiled
+        self._windows = {}  # id(rule) -> (valid_from, valid_until), for rules that have a window
+
+        for rule in rules:
+            # Rules that have ended stay ended; rules not started yet are kept and checked at lookup
+            if not rule.is_active or (rule.valid_until and rule.valid_until < now):
+                continue
+            if rule.valid_from or rule.valid_until:
+                self._windows[id(rule)] = (rule.valid_from, rule.valid_until)
+            try:
+                self._add(rule)
+            except ValueError as e:
+                self.skipped.append((rule.id, str(e)))
+                continue
+            self.rule_count += 1
+        self.tiers.sort(key=lambda tier: -tier[0])
+
+    def _add(self, rule):
+        if rule.promo_type in ('percent_off', 'bogo'):
+            if rule.product_id:
+                self._add_line_rule(self.by_product.setdefault(rule.product_id, []), rule)
+            elif rule.category_id:
+                self._add_line_rule(self.by_category.setdefault(rule.category_id, []), rule)
+        elif rule.promo_type == 'bundle':
+            product_ids = parse_bundle(rule.bundle_product_ids)
+            if product_ids:
+                # Indexed under its first product only; that product must be in the cart
+                self.bundles_by_product.setdefault(product_ids[0], []).append((product_ids, rule))
+        elif rule.promo_type == 'tiered_spend':
+            for min_spend, discount in parse_tiers(rule.tiers):
+                self.tiers.append((min_spend, discount, rule))
+
+    @staticmethod
+    def _add_line_rule(rules, rule):
+        # A larger percent always wins, so only the best always-on percent_off
+        # rule per product or category is kept; this bounds the rules checked
+        # per line. Rules with a time window are kept, as they may not apply yet
+        def always_on(r):
+            return r.promo_type == 'percent_off' and not r.valid_from and not r.valid_until
+        if always_on(rule):
+            for i, existing in enumerate(rules):
+                if always_on(existing):
+                    if (rule.percent or 0) > (existing.percent or 0):
+                        rules[i] = rule
+                    return
+        rules.append(rule)
+
+    def _in_window(self, rule, now):
+        window = self._windows.get(id(rule))
+        if window is None:
+            return True
+        valid_from, valid_until = window
+        return not ((valid_from and valid_from > now) or (valid_until and valid_until < now))
+
+    def price(self, lines, now=None):
+        """Apply promotions to cart lines (dicts with product_id, category_id, price, quantity).
+
+        Each line gets its single best product or category promotion. Bundles
+        apply to lines left without a line promotion, and the best reachable
+        spend tier applies to the discounted subtotal.
+        """
+        now = now or datetime.utcnow()
+        applied = []
+        line_discounts = {}
+        for line in lines:
+            best_rule, best = None, 0
+            for rule in self.by_product.get(line['product_id'], ()):
+                if not self._in_window(rule, now):
+                    continue
+                discount = _line_discount(rule, line)
+                if discount > best:
+                    best_rule, best = rule, discount
+            for rule in self.by_category.get(line.get('category_id'), ()):
+                if not self._in_window(rule, now):
+                    continue
+                discount = _line_discount(rule, line)
+                if discount > best:
+                    best_rule, best = rule, discount
+            if best_rule:
+                line_discounts[line['product_id']] = best
+                applied.append({'promotion_id': best_rule.id, 'name': best_rule.name,
+                                'product_id': line['product_id'], 'discount': round(best, 2)})
+
+        # Bundles, on lines that did not already get a line promotion
+        remaining = {line['product_id']: line for line in lines if line['product_id'] not in line_discounts}
+        for product_id in list(remaining):
+            for product_ids, rule in self.bundles_by_product.get(product_id, ()):
+                if not self._in_window(rule, now) or not all(pid in remaining for pid in product_ids):
+                    continue
+                sets = min(remaining[pid]['quantity'] for pid in product_ids)
+                regular = sum(remaining[pid]['price'] for pid in product_ids)
+                saving = (regular - (rule.bundle_price or 0)) * sets
+                if sets and saving > 0:
+                    applied.append({'promotion_id': rule.id, 'name': rule.name,
+                                    'product_ids': list(product_ids), 'discount': round(saving, 2)})
+                    line_discounts[product_id] = line_discounts.get(product_id, 0) + saving
+                    for pid in product_ids:
+                        remaining.pop(pid, None)
+                    break
+
+        subtotal = sum(line['price'] * line['quantity'] for line in lines)
+        discount = sum(line_discounts.values())
+        for min_spend, tier_discount, rule in self.tiers:
+            if subtotal - discount >= min_spend and self._in_window(rule, now):
+                discount += tier_discount
+                applied.append({'promotion_id': rule.id, 'name': rule.name, 'discount': round(tier_discount, 2)})
+                break
+
+        return {
+            'subtotal': subtotal,
+            'discount': round(min(discount, subtotal), 2),
+            'applied': applied
+        }
+
+
+class PromotionCache:
+    """Per-process compiled promotions, recompiled after Promotion writes or the TTL"""
+
+    def __init__(self, ttl=CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self._compiled = None
+        self._compiled_at = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._compiled is None or time.monotonic() - self._compiled_at > self.ttl:
+            with self._lock:
+                rules = Promotion.query.filter(Promotion.is_active == True).all()
+                # Detach the rows so later commits in this session do not expire them
+                for rule in rules:
+                    db.session.expunge(rule)
+                self._compiled = CompiledPromotions(rules)
+                self._compiled_at = time.monotonic()
+                for rule_id, error in self._compiled.skipped:
+                    current_app.logger.warning(f'Promotion {rule_id} skipped: {error}')
+        return self._compiled
+
+    def invalidate(self):
+        self._compiled = None
+
+
+promotion_cache = PromotionCache()
+
+
+def price_cart(lines):
+    """Promotion discount for cart lines using the compiled active rules"""
+    return promotion_cache.get().price(lines)
+
+
+@event.listens_for(Promotion, 'after_insert')
+@event.listens_for(Promotion, 'after_update')
+@event.listens_for(Promotion, 'after_delete')
+def _promotion_written(mapper, connection, target):
+    sess = object_session(target)
+    if sess is not None:
+        sess.info['promotions_written'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_promotions(sess):
+    if sess.info.pop('promotions_written', False):
+        promotion_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_promotion_writes(sess):
+    sess.info.pop('promotions_written', None)
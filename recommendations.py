@@ -0,0 +1,313 @@
+# "Frequently Bought Together" Recommendations for the Grocery Website
+#
+# An offline job builds a sparse item-item co-occurrence matrix from paid
+# orders and keeps the top K neighbours of every product in fixed-width NumPy
+# arrays. The arrays are written as .npy files and memory-mapped read-only by
+# every worker, so the index is shared through the page cache.
+#
+# Usage:
+#   flask build-recommendations            # full rebuild
+#   flask update-recommendations           # fold in orders paid since the last run
+#
+# Updates track the highest order id seen plus the ids of orders that were
+# still unpaid below it, so an order paid after later ones were processed is
+# folded in when its payment arrives.
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import click
+import numpy as np
+from flask import Blueprint, request, jsonify
+from sqlalchemy import and_, func, or_
+
+from extensions import db
+from models import Product, Order, OrderItem
+
+bp = Blueprint('recommendations', __name__, cli_group=None)
+
+TOP_K = 20
+RELOAD_CHECK_SECONDS = 30
+RECOMMENDATIONS_FOLDER = os.environ.get('RECOMMENDATIONS_FOLDER') or 'data/recommendations'
+KEEP_VERSIONS = 3
+# Unpaid orders are re-checked on every update until paid, closed or this old
+UNPAID_RECHECK_DAYS = 30
+CLOSED_PAYMENT_STATUSES = ('failed', 'refunded')
+
+
+def _manifest_path(folder):
+    return os.path.join(folder, 'current.json')
+
+
+def read_manifest(folder=RECOMMENDATIONS_FOLDER):
+    try:
+        with open(_manifest_path(folder), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_index(product_ids, neighbors, scores, last_order_id, unpaid_order_ids=(), folder=RECOMMENDATIONS_FOLDER):
+    """Write a new index version and atomically point current.json at it"""
+    # Built in a private directory and renamed into place, so two builds never share one
+    os.makedirs(folder, exist_ok=True)
+    tmp_directory = tempfile.mkdtemp(prefix='.build-', dir=folder)
+    np.save(os.path.join(tmp_directory, 'product_ids.npy'), product_ids.astype(np.int64))
+    np.save(os.path.join(tmp_directory, 'neighbors.npy'), neighbors.astype(np.int64))
+    np.save(os.path.join(tmp_directory, 'scores.npy'), scores.astype(np.float32))
+    # The timestamp keeps versions in build order for pruning; the uuid keeps them unique
+    version = f'v{int(time.time() * 1000)}-{uuid.uuid4().hex[:12]}'
+    os.rename(tmp_directory, os.path.join(folder, version))
+
+    manifest = {
+        'version': version,
+        'last_order_id': int(last_order_id),
+        'unpaid_order_ids': [int(order_id) for order_id in unpaid_order_ids],
+        'top_k': int(neighbors.shape[1]),
+    }
+    tmp_path = f'{_manifest_path(folder)}.{version}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, _manifest_path(folder))
+
+    # Older versions may still be mapped by running workers, so keep a few besides this one
+    versions = sorted(name for name in os.listdir(folder) if name.startswith('v') and name != version)
+    for old in versions[:max(len(versions) - KEEP_VERSIONS + 1, 0)]:
+        shutil.rmtree(os.path.join(folder, old), ignore_errors=True)
+    return manifest
+
+
+def load_index(folder=RECOMMENDATIONS_FOLDER, mmap_mode='r'):
+    """Return (manifest, product_ids, neighbors, scores) for the current version"""
+    manifest = read_manifest(folder)
+    if not manifest:
+        return None, None, None, None
+    directory = os.path.join(folder, manifest['version'])
+    return (
+        manifest,
+        np.load(os.path.join(directory, 'product_ids.npy'), mmap_mode=mmap_mode),
+        np.load(os.path.join(directory, 'neighbors.npy'), mmap_mode=mmap_mode),
+        np.load(os.path.join(directory, 'scores.npy'), mmap_mode=mmap_mode),
+    )
+
+
+def load_baskets(after_order_id=0, recheck_order_ids=()):
+    """Return (order_rows, product_ids, last_order_id, unpaid_order_ids) for newly paid orders.
+
+    Orders after after_order_id and the recheck ids from the previous run are
+    read. Paid ones become baskets; the rest that can still be paid later are
+    returned as unpaid_order_ids, to be checked again on the next run.
+    """
+    order_rows = []
+    product_ids = []
+    order_index = {}
+    last_order_id = max(db.session.query(func.max(Order.id)).scalar() or 0, after_order_id)
+    in_scope = or_(
+        and_(Order.id > after_order_id, Order.id <= last_order_id),
+        Order.id.in_(list(recheck_order_ids))
+    )
+    query = db.session.query(OrderItem.order_id, OrderItem.product_id).join(
+        Order, Order.id == OrderItem.order_id
+    ).filter(
+        Order.payment_status == 'paid',
+        in_scope
+    ).order_by(OrderItem.order_id).execution_options(yield_per=20000)
+
+    for order_id, product_id in query:
+        order_rows.append(order_index.setdefault(order_id, len(order_index)))
+        product_ids.append(product_id)
+
+    unpaid_order_ids = [order_id for order_id, in db.session.query(Order.id).filter(
+        in_scope,
+        Order.payment_status.notin_(('paid',) + CLOSED_PAYMENT_STATUSES),
+        Order.status != 'cancelled',
+        Order.created_at >= datetime.utcnow() - timedelta(days=UNPAID_RECHECK_DAYS)
+    ).order_by(Order.id)]
+    return (
+        np.asarray(order_rows, dtype=np.int64), np.asarray(product_ids, dtype=np.int64),
+        last_order_id, unpaid_order_ids
+    )
+
+
+def co_occurrence(order_rows, item_columns, n_items):
+    """Item x item co-purchase counts (CSR) from (order row, item column) pairs"""
+    from scipy import sparse  # only the offline build needs scipy; keeps it out of worker start-up
+    if not len(order_rows):
+        return sparse.csr_matrix((n_items, n_items), dtype=np.float32)
+    baskets = sparse.csr_matrix(
+        (np.ones(len(order_rows), dtype=np.float32), (order_rows, item_columns)),
+        shape=(int(order_rows.max()) + 1, n_items)
+    )
+    baskets.data[:] = 1  # the same product twice in one order counts once
+    counts = (baskets.T @ baskets).tocsr()
+    counts.setdiag(0)
+    counts.eliminate_zeros()
+    return counts
+
+
+def top_k_rows(counts, catalog_ids, k=TOP_K):
+    """Fixed-width top-k neighbour ids (-1 padded) and scores for every row of a CSR matrix"""
+    n_items = counts.shape[0]
+    neighbors = np.full((n_items, k), -1, dtype=np.int64)
+    scores = np.zeros((n_items, k), dtype=np.float32)
+    indptr, indices, data = counts.indptr, counts.indices, counts.data
+    for row in np.flatnonzero(np.diff(indptr)):
+        start, end = indptr[row], indptr[row + 1]
+        row_data = data[start:end]
+        if end - start > k:
+            best = np.argpartition(row_data, -k)[-k:]
+        else:
+            best = np.arange(end - start)
+        best = best[np.argsort(-row_data[best], kind='stable')]
+        neighbors[row, :len(best)] = catalog_ids[indices[start:end][best]]
+        scores[row, :len(best)] = row_data[best]
+    return neighbors, scores
+
+
+def build_recommendations(k=TOP_K, folder=RECOMMENDATIONS_FOLDER):
+    """Full rebuild from every paid order"""
+    catalog_ids = np.asarray([row[0] for row in db.session.query(Product.id).order_by(Product.id)], dtype=np.int64)
+    order_rows, product_ids, last_order_id, unpaid_order_ids = load_baskets()
+
+    columns = np.searchsorted(catalog_ids, product_ids)
+    known = columns < len(catalog_ids)
+    known[known] = catalog_ids[columns[known]] == product_ids[known]
+    counts = co_occurrence(order_rows[known], columns[known], len(catalog_ids))
+
+    neighbors, scores = top_k_rows(counts, catalog_ids, k)
+    return write_index(catalog_ids, neighbors, scores, last_order_id, unpaid_order_ids, folder)
+
+
+def update_recommendations(folder=RECOMMENDATIONS_FOLDER):
+    """Fold orders paid since the last build into the affected rows only.
+
+    Counts for pairs that were outside a row's top K are not stored, so a pair
+    that was just below the cut-off enters with its new co-purchases only.
+    The periodic full rebuild corrects that drift.
+    """
+    manifest, product_ids, neighbors, scores = load_index(folder, mmap_mode=None)
+    if manifest is None:
+        return build_recommendations(folder=folder)
+
+    order_rows, basket_products, last_order_id, unpaid_order_ids = load_baskets(
+        manifest['last_order_id'], manifest.get('unpaid_order_ids', ())
+    )
+    if not len(order_rows) and last_order_id == manifest['last_order_id'] \
+            and unpaid_order_ids == manifest.get('unpaid_order_ids', []):
+        return manifest
+
+    # New products get empty rows appended to the catalog
+    new_ids = np.setdiff1d(np.unique(basket_products), product_ids)
+    if len(new_ids):
+        product_ids = np.concatenate([product_ids, new_ids])
+        order = np.argsort(product_ids, kind='stable')
+        product_ids = product_ids[order]
+        neighbors = np.concatenate([neighbors, np.full((len(new_ids), neighbors.shape[1]), -1, dtype=np.int64)])[order]
+        scores = np.concatenate([scores, np.zeros((len(new_ids), scores.shape[1]), dtype=np.float32)])[order]
+
+    columns = np.searchsorted(product_ids, basket_products)
+    delta = co_occurrence(order_rows, columns, len(product_ids))
+    k = neighbors.shape[1]
+
+    for row in np.flatnonzero(np.diff(delta.indptr)):
+        merged = {}
+        for neighbor, score in zip(neighbors[row], scores[row]):
+            if neighbor >= 0:
+                merged[int(neighbor)] = float(score)
+        start, end = delta.indptr[row], delta.indptr[row + 1]
+        for column, count in zip(delta.indices[start:end], delta.data[start:end]):
+            neighbor = int(product_ids[column])
+            merged[neighbor] = merged.get(neighbor, 0.0) + float(count)
+        best = sorted(merged.items(), key=lambda item: -item[1])[:k]
+        neighbors[row] = -1
+        scores[row] = 0
+        neighbors[row, :len(best)] = [neighbor for neighbor, _ in best]
+        scores[row, :len(best)] = [score for _, score in best]
+
+    return write_index(product_ids, neighbors, scores, last_order_id, unpaid_order_ids, folder)
+
+
+class RelatedProductsIndex:
+    """Per-process view of the memory-mapped index, reloaded when a new version is published"""
+
+    def __init__(self, folder=RECOMMENDATIONS_FOLDER):
+        self.folder = folder
+        self.version = None
+        self.product_ids = self.neighbors = self.scores = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < RELOAD_CHECK_SECONDS and self.version is not None:
+            return
+        with self._lock:
+            self._checked_at = now
+            manifest = read_manifest(self.folder)
+            if manifest and manifest['version'] != self.version:
+                _, self.product_ids, self.neighbors, self.scores = load_index(self.folder)
+                self.version = manifest['version']
+
+    def related(self, product_id, limit=TOP_K):
+        self._maybe_reload()
+        if self.product_ids is None:
+            return []
+        row = int(np.searchsorted(self.product_ids, product_id))
+        if row >= len(self.product_ids) or self.product_ids[row] != product_id:
+            return []
+        ids = self.neighbors[row]
+        valid = ids >= 0
+        return list(zip(ids[valid][:limit].tolist(), self.scores[row][valid][:limit].tolist()))
+
+
+related_index = RelatedProductsIndex()
+
+
+@bp.route('/api/products/<int:product_id>/related')
+def get_related_products(product_id):
+    limit = min(request.args.get('limit', 10, type=int), TOP_K)
+    # Ask for a few extra in case some neighbours are no longer available
+    related = related_index.related(product_id, limit + 5)
+    if not related:
+        return jsonify({'product_id': product_id, 'related': []})
+
+    products = {p.id: p for p in Product.query.filter(
+        Product.id.in_([neighbor for neighbor, _ in related]),
+        Product.is_available == True
+    )}
+    return jsonify({
+        'product_id': product_id,
+        'related': [{
+            'id': p.id,
+            'name': p.name,
+            'price': p.price,
+            'original_price': p.original_price,
+            'image_url': p.image_url,
+            'unit': p.unit,
+            'co_purchases': int(score)
+        } for p, score in ((products.get(neighbor), score) for neighbor, score in related) if p][:limit]
+    })
+
+
+@bp.cli.command('build-recommendations')
+@click.option('--top-k', default=TOP_K, show_default=True)
+def build_recommendations_command(top_k):
+    """Rebuild the frequently-bought-together index from all paid orders"""
+    started = time.perf_counter()
+    manifest = build_recommendations(k=top_k)
+    click.echo(f"Built recommendation index {manifest['version']} in {time.perf_counter() - started:.1f}s")
+
+
+@bp.cli.command('update-recommendations')
+def update_recommendations_command():
+    """Fold newly paid orders into the recommendation index"""
+    started = time.perf_counter()
+    manifest = update_recommendations()
+    click.echo(f"Recommendation index {manifest['version']} up to order {manifest['last_order_id']} "
+               f"({time.perf_counter() - started:.1f}s)")
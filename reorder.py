@@ -0,0 +1,235 @@
+# Demand Forecasting and Reorder Suggestions for the Grocery Website
+#
+# Daily unit sales per product are aggregated in SQL from the items of every
+# order that was not cancelled or refunded, which covers web checkout and POS
+# sales alike, and loaded into NumPy arrays. The forecast, safety stock,
+# reorder point and reorder quantity are then computed for a whole block of
+# SKUs at once. Results are written back with executemany statements.
+#
+# Usage:
+#   flask compute-reorder --history-days 730
+#   flask compute-reorder --apply   # also copy reorder points to min_stock_level
+
+import time
+from array import array
+from datetime import datetime, date, timedelta
+
+import click
+import numpy as np
+from flask import Blueprint, request, jsonify
+from sqlalchemy import func, bindparam
+
+from extensions import db
+from models import Product, Order, OrderItem
+from auth import admin_required
+from low_stock import rebuild_low_stock
+
+bp = Blueprint('reorder', __name__, cli_group=None)
+
+BLOCK_SIZE = 20000  # products per dense (products x days) matrix
+DEFAULT_HISTORY_DAYS = 365
+DEFAULT_LEAD_TIME_DAYS = 3
+DEFAULT_REVIEW_DAYS = 7
+DEFAULT_SERVICE_Z = 1.65  # ~95% cycle service level
+DEFAULT_ALPHA = 0.1  # exponential smoothing factor
+VARIABILITY_WINDOW = 56  # days used for the demand standard deviation
+# Orders in these payment states never turned into demand
+EXCLUDED_PAYMENT_STATUSES = ('failed', 'refunded')
+
+
+class ReorderSuggestion(db.Model):
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    forecast_daily = db.Column(db.Float, nullable=False)
+    moving_average = db.Column(db.Float, nullable=False)
+    safety_stock = db.Column(db.Float, nullable=False)
+    reorder_point = db.Column(db.Integer, nullable=False)
+    reorder_quantity = db.Column(db.Integer, nullable=False, index=True)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+def _as_date(value):
+    # SQLite returns date() as text, other backends as a date
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+def load_daily_sales(start):
+    """Return (product_ids, day_offsets, quantities) arrays of daily unit sales since start"""
+    products = array('q')
+    days = array('i')
+    quantities = array('d')
+    start_ordinal = start.toordinal()
+
+    day = func.date(Order.created_at)
+    daily = db.session.query(
+        OrderItem.product_id, day, func.sum(OrderItem.quantity)
+    ).join(Order, Order.id == OrderItem.order_id).filter(
+        Order.created_at >= datetime.combine(start, datetime.min.time()),
+        Order.status != 'cancelled',
+        Order.payment_status.notin_(EXCLUDED_PAYMENT_STATUSES)
+    ).group_by(OrderItem.product_id, day)
+
+    # At most history_days distinct days, so each is parsed once
+    offsets = {}
+    result = db.session.execute(daily.statement.execution_options(yield_per=10000))
+    for partition in result.partitions():
+        for product_id, sale_day, quantity in partition:
+            offset = offsets.get(sale_day)
+            if offset is None:
+                offset = offsets[sale_day] = _as_date(sale_day).toordinal() - start_ordinal
+            products.append(product_id)
+            days.append(offset)
+            quantities.append(quantity or 0)
+
+    return (
+        np.frombuffer(products, dtype=np.int64),
+        np.frombuffer(days, dtype=np.int32),
+        np.frombuffer(quantities, dtype=np.float64),
+    )
+
+
+def smoothing_weights(n_days, alpha):
+    """Weights w such that S @ w is simple exponential smoothing seeded with the first day"""
+    exponents = np.arange(n_days - 1, -1, -1, dtype=np.float64)
+    weights = alpha * (1 - alpha) ** exponents
+    weights[0] += (1 - alpha) ** n_days
+    return weights
+
+
+def forecast_block(sales, stock, alpha, lead_time, review_days, service_z):
+    """Vectorized forecast for a (products x days) sales matrix"""
+    n_days = sales.shape[1]
+    window = min(VARIABILITY_WINDOW, n_days)
+    recent = sales[:, -window:]
+
+    moving_average = recent.mean(axis=1)
+    forecast = sales @ smoothing_weights(n_days, alpha)
+    sigma = recent.std(axis=1)
+
+    safety_stock = service_z * sigma * np.sqrt(lead_time)
+    reorder_point = np.ceil(forecast * lead_time + safety_stock)
+    order_up_to = forecast * (lead_time + review_days) + safety_stock
+    reorder_quantity = np.ceil(np.clip(order_up_to - stock, 0, None))
+    # Nothing to order until stock actually reaches the reorder point
+    reorder_quantity[stock > reorder_point] = 0
+
+    return {
+        'forecast_daily': forecast,
+        'moving_average': moving_average,
+        'safety_stock': safety_stock,
+        'reorder_point': reorder_point.astype(np.int64),
+        'reorder_quantity': reorder_quantity.astype(np.int64),
+    }
+
+
+def compute_reorder_suggestions(history_days=DEFAULT_HISTORY_DAYS, lead_time=DEFAULT_LEAD_TIME_DAYS,
+                                review_days=DEFAULT_REVIEW_DAYS, service_z=DEFAULT_SERVICE_Z,
+                                alpha=DEFAULT_ALPHA, apply=False):
+    """Recompute ReorderSuggestion rows for every available product"""
+    started = time.perf_counter()
+    today = date.today()
+    start = today - timedelta(days=history_days)
+
+    catalog = db.session.query(Product.id, Product.stock_quantity).filter(
+        Product.is_available == True
+    ).order_by(Product.id).all()
+    if not catalog:
+        return {'products': 0, 'seconds': 0}
+    product_ids = np.fromiter((row[0] for row in catalog), dtype=np.int64, count=len(catalog))
+    stock = np.fromiter((row[1] or 0 for row in catalog), dtype=np.float64, count=len(catalog))
+
+    sale_products, sale_days, sale_quantities = load_daily_sales(start)
+    rows = np.searchsorted(product_ids, sale_products)
+    known = (rows < len(product_ids)) & (product_ids[np.minimum(rows, len(product_ids) - 1)] == sale_products)
+    known &= (sale_days >= 0) & (sale_days < history_days)
+    rows, sale_days, sale_quantities = rows[known], sale_days[known], sale_quantities[known]
+
+    table = ReorderSuggestion.__table__
+    db.session.execute(table.delete())
+    now = datetime.utcnow()
+    for block_start in range(0, len(product_ids), BLOCK_SIZE):
+        block_end = min(block_start + BLOCK_SIZE, len(product_ids))
+        in_block = (rows >= block_start) & (rows < block_end)
+        cells = (rows[in_block] - block_start) * history_days + sale_days[in_block]
+        sales = np.bincount(
+            cells, weights=sale_quantities[in_block], minlength=(block_end - block_start) * history_days
+        ).reshape(block_end - block_start, history_days)
+
+        result = forecast_block(sales, stock[block_start:block_end], alpha, lead_time, review_days, service_z)
+        ids = product_ids[block_start:block_end]
+        db.session.execute(table.insert(), [{
+            'product_id': int(ids[i]),
+            'forecast_daily': float(result['forecast_daily'][i]),
+            'moving_average': float(result['moving_average'][i]),
+            'safety_stock': float(result['safety_stock'][i]),
+            'reorder_point': int(result['reorder_point'][i]),
+            'reorder_quantity': int(result['reorder_quantity'][i]),
+            'computed_at': now,
+        } for i in range(len(ids))])
+
+        if apply:
+            product_table = Product.__table__
+            db.session.execute(
+                product_table.update().where(product_table.c.id == bindparam('_id')).values(
+                    min_stock_level=bindparam('_min_stock_level')
+                ),
+                [{'_id': int(ids[i]), '_min_stock_level': int(result['reorder_point'][i])} for i in range(len(ids))]
+            )
+    db.session.commit()
+
+    if apply:
+        # min_stock_level changed outside the ORM, so the low stock view is rebuilt
+        rebuild_low_stock()
+
+    return {'products': len(product_ids), 'sales_rows': int(known.sum()),
+            'seconds': time.perf_counter() - started}
+
+
+@bp.route('/api/admin/inventory/reorder-suggestions')
+@admin_required
+def get_reorder_suggestions():
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', 50, type=int), 200)
+
+    suggestions = db.session.query(ReorderSuggestion, Product.name, Product.stock_quantity).join(
+        Product, Product.id == ReorderSuggestion.product_id
+    ).filter(
+        ReorderSuggestion.reorder_quantity > 0
+    ).order_by(
+        ReorderSuggestion.reorder_quantity.desc(), ReorderSuggestion.product_id.asc()
+    ).paginate(page=page, per_page=per_page, error_out=False)
+
+    return jsonify({
+        'suggestions': [{
+            'product_id': s.product_id,
+            'name': name,
+            'current_stock': stock,
+            'forecast_daily': round(s.forecast_daily, 2),
+            'moving_average': round(s.moving_average, 2),
+            'safety_stock': round(s.safety_stock, 2),
+            'reorder_point': s.reorder_point,
+            'reorder_quantity': s.reorder_quantity,
+            'computed_at': s.computed_at.isoformat()
+        } for s, name, stock in suggestions.items],
+        'pagination': {
+            'page': suggestions.page,
+            'pages': suggestions.pages,
+            'per_page': suggestions.per_page,
+            'total': suggestions.total,
+            'has_next': suggestions.has_next,
+            'has_prev': suggestions.has_prev
+        }
+    })
+
+
+@bp.cli.command('compute-reorder')
+@click.option('--history-days', default=DEFAULT_HISTORY_DAYS, show_default=True)
+@click.option('--lead-time', default=DEFAULT_LEAD_TIME_DAYS, show_default=True, help='supplier lead time in days')
+@click.option('--review-days', default=DEFAULT_REVIEW_DAYS, show_default=True, help='days between orders')
+@click.option('--service-z', default=DEFAULT_SERVICE_Z, show_default=True, help='safety stock z-score')
+@click.option('--alpha', default=DEFAULT_ALPHA, show_default=True, help='exponential smoothing factor')
+@click.option('--apply', is_flag=True, help='write reorder points to Product.min_stock_level')
+def compute_reorder_command(history_days, lead_time, review_days, service_z, alpha, apply):
+    """Forecast demand and compute reorder suggestions for every product"""
+    ReorderSuggestion.__table__.create(db.engine, checkfirst=True)
+    stats = compute_reorder_suggestions(history_days, lead_time, review_days, service_z, alpha, apply)
+    click.echo(f"Computed reorder suggestions for {stats['products']} products in {stats['seconds']:.1f}s")
@@ -0,0 +1,141 @@
+# Read-Replica Routing for the Grocery Website
+#
+# Views marked @read_only send their queries to one of the replicas in
+# SQLALCHEMY_REPLICA_URIS. The replica is picked round-robin once per request.
+# A request goes back to the primary for the rest of its lifetime as soon as
+# it flushes or executes a write, so reads after a write see that write.
+# Replicas that fail are skipped until a health check succeeds again, and a
+# read-only view that hits a failing replica is rerun on the primary.
+#
+# Works with any SQLAlchemy URLs, e.g. two local SQLite files:
+#   DATABASE_URL=sqlite:////srv/grocery.db
+#   DATABASE_REPLICA_URLS=sqlite:////srv/grocery-replica.db
+#
+# Usage:
+#   flask check-replicas
+
+import threading
+import time
+from functools import wraps
+
+import click
+from flask import Blueprint, current_app, g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql.dml import UpdateBase
+
+HEALTH_CHECK_SECONDS = 10
+
+bp = Blueprint('replicas', __name__, cli_group=None)
+
+
+class Replica:
+    """One replica engine and its health"""
+
+    def __init__(self, url):
+        self.engine = create_engine(url, pool_pre_ping=True)
+        self.healthy = True
+        self.retry_at = 0
+
+    def mark_down(self, interval=HEALTH_CHECK_SECONDS):
+        self.healthy = False
+        self.retry_at = time.monotonic() + interval
+
+    def check(self):
+        """Ping the replica and record the result"""
+        try:
+            with self.engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+        except OperationalError:
+            self.mark_down()
+        else:
+            self.healthy = True
+        return self.healthy
+
+    def available(self):
+        if self.healthy:
+            return True
+        # Down replicas are pinged again once their retry time has passed
+        return time.monotonic() >= self.retry_at and self.check()
+
+
+class ReplicaSet:
+    """Round-robin over the replicas that are currently healthy"""
+
+    def __init__(self, urls):
+        self.replicas = [Replica(url) for url in urls]
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def pick(self):
+        for _ in range(len(self.replicas)):
+            with self._lock:
+                replica = self.replicas[self._next % len(self.replicas)]
+                self._next += 1
+            if replica.available():
+                return replica
+        return None
+
+
+def init_replicas(app):
+    """Create the replica engines configured for the app; call after db.init_app"""
+    urls = app.config['SQLALCHEMY_REPLICA_URIS']
+    if urls:
+        app.extensions['replicas'] = ReplicaSet(urls)
+
+
+def _request_replica():
+    # The replica for this request, or None once the request has to use the primary
+    if not has_request_context() or not g.get('read_only') or g.get('db_wrote'):
+        return None
+    if 'replica' not in g:
+        replicas = current_app.extensions.get('replicas')
+        g.replica = replicas.pick() if replicas else None
+    return g.replica
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends reads from @read_only views to a replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context() and g.get('read_only'):
+            if self._flushing or isinstance(clause, UpdateBase):
+                g.db_wrote = True  # stay on the primary for the rest of the request
+            else:
+                replica = _request_replica()
+                if replica is not None:
+                    return replica.engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(f):
+    """Serve the view from a replica when one is configured and healthy"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.read_only = True
+        try:
+            return f(*args, **kwargs)
+        except OperationalError:
+            replica = g.get('replica')
+            if replica is None or g.get('db_wrote'):
+                raise
+            # The replica failed mid-request; take it out and rerun on the primary
+            replica.mark_down()
+            current_app.extensions['sqlalchemy'].session.rollback()
+            current_app.logger.warning(f'Replica {replica.engine.url!r} failed, using the primary')
+            g.read_only = False
+            return f(*args, **kwargs)
+    return decorated_function
+
+
+@bp.cli.command('check-replicas')
+def check_replicas_command():
+    """Ping every configured read replica"""
+    replicas = current_app.extensions.get('replicas')
+    if not replicas:
+        click.echo('No read replicas configured (DATABASE_REPLICA_URLS)')
+        return
+    for replica in replicas.replicas:
+        status = 'ok' if replica.check() else 'DOWN'
+        click.echo(f'{replica.engine.url!r}: {status}')
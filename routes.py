@@ -1,44 +1,30 @@
 # Complete API Routes for the supermarket Website
 
-from flask import Flask, request, jsonify, session
-# Make sure to import or define all other required modules and objects here
-
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
+import json
 import secrets
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
-import json
-
-import stripe
-stripe.api_key = "your_stripe_secret_key"  # Replace with your actual Stripe secret key
 
-# Import your models here
-from models import User  # Make sure 'models.py' contains the User model
-from .models import db    # Import db from your models (assuming db is defined there)
-from .models import Product  # Import Product model
-from .models import Review   # Import Review model
-from .models import Category  # Import Category model
-from .models import CartItem  # Import CartItem model
-from .models import WishlistItem  # Import WishlistItem model
-from .models import Coupon  # Import Coupon model
-from .models import Order   # Import Order model
-from .models import OrderItem  # Import OrderItem model if not already imported
-
-# Import or define send_email function
-from utils import send_email  # Make sure utils.py contains send_email, or define it below
+from flask import Blueprint, request, jsonify, session
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash, check_password_hash
 
-app = Flask(__name__)
+from extensions import db, limiter
+from models import User, Product, Review, Category, CartItem, WishlistItem, Order, OrderItem, InventoryLog
+from auth import login_required
+from buy_again import record_purchase
+from catalog_snapshot import get_catalog
+from coupons import check_coupon, redeem_coupon, CouponError
+from delivery_slots import book_slot, SlotError
+from payments import payment_intent_for_cart, close_payment_intent, PaymentUnavailable
+from promotions import price_cart
+from replicas import read_only
+from sqlite_profile import retry_on_busy
+from utils import send_email
 
-# Initialize Flask-Limiter
-limiter = Limiter(
-    get_remote_address,
-    app=app,
-    default_limits=["200 per day", "50 per hour"]
-)
+bp = Blueprint('routes', __name__)
 
 # Authentication and User Management Routes
-@app.route('/api/auth/register', methods=['POST'])
+@bp.route('/api/auth/register', methods=['POST'])
 @limiter.limit("5 per minute")
 def register():
     data = request.get_json()
@@ -88,7 +74,7 @@ def register():
         'message': 'Registration successful. Please check your email to verify your account.'
     })
 
-@app.route('/api/auth/login', methods=['POST'])
+@bp.route('/api/auth/login', methods=['POST'])
 @limiter.limit("10 per minute")
 def login():
     data = request.get_json()
@@ -124,12 +110,12 @@ def login():
     else:
         return jsonify({'error': 'Invalid credentials'}), 401
 
-@app.route('/api/auth/logout', methods=['POST'])
+@bp.route('/api/auth/logout', methods=['POST'])
 def logout():
     session.clear()
     return jsonify({'success': True, 'message': 'Logged out successfully'})
 
-@app.route('/api/auth/forgot-password', methods=['POST'])
+@bp.route('/api/auth/forgot-password', methods=['POST'])
 @limiter.limit("3 per minute")
 def forgot_password():
     data = request.get_json()
@@ -156,7 +142,8 @@ def forgot_password():
     })
 
 # Product and Category Routes
-@app.route('/api/products')
+@bp.route('/api/products')
+@read_only
 def get_products():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
@@ -169,79 +156,40 @@ def get_products():
     in_stock_only = request.args.get('in_stock_only', 'false').lower() == 'true'
     featured_only = request.args.get('featured_only', 'false').lower() == 'true'
     
-    query = Product.query.filter_by(is_available=True)
-    
-    # Apply filters
-    if category_id:
-        query = query.filter_by(category_id=category_id)
-    
-    if search:
-        query = query.filter(
-            db.or_(
-                Product.name.contains(search),
-                Product.description.contains(search),
-                Product.brand.contains(search)
-            )
-        )
-    
-    if min_price is not None:
-        query = query.filter(Product.price >= min_price)
-    
-    if max_price is not None:
-        query = query.filter(Product.price <= max_price)
-    
-    if in_stock_only:
-        query = query.filter(Product.stock_quantity > 0)
-    
-    if featured_only:
-        query = query.filter_by(is_featured=True)
-    
-    # Apply sorting
-    if sort_by == 'price':
-        if sort_order == 'desc':
-            query = query.order_by(Product.price.desc())
-        else:
-            query = query.order_by(Product.price.asc())
-    elif sort_by == 'name':
-        if sort_order == 'desc':
-            query = query.order_by(Product.name.desc())
-        else:
-            query = query.order_by(Product.name.asc())
-    elif sort_by == 'created_at':
-        query = query.order_by(Product.created_at.desc())
-    
-    # Paginate
-    products = query.paginate(
-        page=page, per_page=per_page, error_out=False
+    if page < 1:
+        page = 1
+    if per_page < 1:
+        per_page = 20
+    
+    # Served from the in-memory snapshot, not SQL (see catalog_snapshot.py)
+    products, total = get_catalog().query(
+        category_id=category_id,
+        search=search,
+        min_price=min_price,
+        max_price=max_price,
+        in_stock_only=in_stock_only,
+        featured_only=featured_only,
+        sort_by=sort_by,
+        sort_order=sort_order,
+        page=page,
+        per_page=per_page
     )
+    pages = -(-total // per_page)
     
     return jsonify({
-        'products': [{
-            'id': p.id,
-            'name': p.name,
-            'description': p.description,
-            'price': p.price,
-            'original_price': p.original_price,
-            'image_url': p.image_url,
-            'stock_quantity': p.stock_quantity,
-            'unit': p.unit,
-            'brand': p.brand,
-            'category_id': p.category_id,
-            'is_featured': p.is_featured,
-            'average_rating': p.average_rating,
-            'review_count': p.review_count
-        } for p in products.items],
+        'products': products,
         'pagination': {
-            'page': products.page,
-            'pages': products.pages,
-            'per_page': products.per_page,
-            'total': products.total,
-            'has_next': products.has_next,
-            'has_prev': products.has_prev
+            'page': page,
+            'pages': pages,
+            'per_page': per_page,
+            'total': total,
+            'has_next': page < pages,
+            'has_prev': page > 1
         }
     })
 
-@app.route('/api/products/<int:product_id>')
+@bp.route('/api/products/<int:product_id>')
+@read_only
 def get_product(product_id):
     product = Product.query.get_or_404(product_id)
     reviews = Review.query.filter_by(product_id=product_id).order_by(Review.created_at.desc()).limit(10).all()
@@ -253,6 +201,7 @@ def get_product(product_id):
         'price': product.price,
         'original_price': product.original_price,
         'image_url': product.image_url,
+        'image_variants': json.loads(product.image_variants) if product.image_variants else None,
         'stock_quantity': product.stock_quantity,
         'unit': product.unit,
         'brand': product.brand,
@@ -273,31 +222,29 @@ def get_product(product_id):
         } for r in reviews]
     })
 
-@app.route('/api/categories')
+@bp.route('/api/categories')
+@read_only
 def get_categories():
     categories = Category.query.filter_by(is_active=True).order_by(Category.sort_order).all()
     return jsonify([{
         'id': c.id,
         'name': c.name,
         'description': c.description,
-        'image_url': c.image_url,
+        'image_url': c.thumbnail_url or c.image_url,
+        'image_variants': json.loads(c.image_variants) if c.image_variants else None,
         'product_count': len(c.products)
     } for c in categories])
 
-# Define a simple login_required decorator if not already defined
-from functools import wraps
-from flask import redirect, url_for
-
-def login_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            return jsonify({'error': 'Authentication required'}), 401
-        return f(*args, **kwargs)
-    return decorated_function
+def _promotion_lines(cart_items):
+    return [{
+        'product_id': product.id,
+        'category_id': product.category_id,
+        'price': product.price,
+        'quantity': cart_item.quantity
+    } for cart_item, product in cart_items]
 
 # Shopping Cart Routes
-@app.route('/api/cart')
+@bp.route('/api/cart')
 @login_required
 def get_cart():
     cart_items = db.session.query(CartItem, Product).join(Product).filter(
@@ -322,27 +269,35 @@ def get_cart():
             'unit': product.unit
         })
     
+    # Apply active promotions
+    promotions = price_cart(_promotion_lines(cart_items))
+    
     # Calculate tax and delivery fee
     tax_rate = 0.08  # 8% tax
     tax_amount = subtotal * tax_rate
     delivery_fee = 5.99 if subtotal < 50 else 0  # Free delivery over $50
-    total = subtotal + tax_amount + delivery_fee
+    total = subtotal + tax_amount + delivery_fee - promotions['discount']
     
     return jsonify({
         'items': cart_data,
         'subtotal': subtotal,
+        'promotion_discount': promotions['discount'],
+        'promotions': promotions['applied'],
         'tax_amount': tax_amount,
         'delivery_fee': delivery_fee,
         'total': total,
         'item_count': len(cart_data)
     })
 
-@app.route('/api/cart/add', methods=['POST'])
+@bp.route('/api/cart/add', methods=['POST'])
 @login_required
+@retry_on_busy
 def add_to_cart():
-    data = request.get_json()
+    data = request.get_json() or {}
     product_id = data.get('product_id')
     quantity = data.get('quantity', 1)
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+        return jsonify({'error': 'quantity must be a whole number of at least 1'}), 400
     
     # Validate product exists and is available
     product = Product.query.get(product_id)
@@ -372,11 +327,27 @@ def add_to_cart():
         )
         db.session.add(cart_item)
     
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another request added the same product first; add to that line instead, once
+        db.session.rollback()
+        table = CartItem.__table__
+        result = db.session.execute(table.update().where(
+            table.c.user_id == session['user_id'],
+            table.c.product_id == product_id,
+            table.c.quantity + quantity <= product.stock_quantity
+        ).values(quantity=table.c.quantity + quantity))
+        if result.rowcount != 1:
+            db.session.rollback()
+            if not CartItem.query.filter_by(user_id=session['user_id'], product_id=product_id).first():
+                raise  # not the cart line race
+            return jsonify({'error': 'Insufficient stock'}), 400
+        db.session.commit()
     return jsonify({'success': True, 'message': 'Item added to cart'})
 
 # Wishlist Routes
-@app.route('/api/wishlist')
+@bp.route('/api/wishlist')
 @login_required
 def get_wishlist():
     wishlist_items = db.session.query(WishlistItem, Product).join(Product).filter(
@@ -394,7 +365,7 @@ def get_wishlist():
         'added_at': item.added_at.isoformat()
     } for item, product in wishlist_items])
 
-@app.route('/api/wishlist/add', methods=['POST'])
+@bp.route('/api/wishlist/add', methods=['POST'])
 @login_required
 def add_to_wishlist():
     data = request.get_json()
@@ -420,7 +391,7 @@ def add_to_wishlist():
     return jsonify({'success': True, 'message': 'Item added to wishlist'})
 
 # Payment and Order Routes
-@app.route('/api/orders/create-payment-intent', methods=['POST'])
+@bp.route('/api/orders/create-payment-intent', methods=['POST'])
 @login_required
 def create_payment_intent():
     data = request.get_json()
@@ -430,25 +401,25 @@ def create_payment_intent():
     cart_data = json.loads(cart_response.data)
     total_amount = int(cart_data['total'] * 100)  # Convert to cents
     
+    # The open intent is reused for an unchanged cart and updated for a changed one
     try:
-        intent = stripe.PaymentIntent.create(
-            amount=total_amount,
-            currency='usd',
-            metadata={
-                'user_id': session['user_id'],
-                'order_type': 'grocery_order'
-            }
-        )
-        
-        return jsonify({
-            'client_secret': intent.client_secret,
-            'amount': total_amount
-        })
+        intent = payment_intent_for_cart(session['user_id'], cart_data['items'], total_amount)
+    except PaymentUnavailable as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = str(int(e.retry_after))
+        return response, 503
     except Exception as e:
         return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'client_secret': intent.client_secret,
+        'payment_intent_id': intent.stripe_intent_id,
+        'amount': total_amount
+    })
 
-@app.route('/api/orders', methods=['POST'])
+@bp.route('/api/orders', methods=['POST'])
 @login_required
+@retry_on_busy
 def create_order():
     data = request.get_json()
     delivery_address = data.get('delivery_address')
@@ -458,6 +429,8 @@ def create_order():
     payment_method = data.get('payment_method')
     stripe_payment_intent_id = data.get('stripe_payment_intent_id')
     coupon_code = data.get('coupon_code')
+    delivery_slot_id = data.get('delivery_slot_id')
+    slot_hold_id = data.get('slot_hold_id')
     
     # Get cart items
     cart_items = db.session.query(CartItem, Product).join(Product).filter(
@@ -471,24 +444,30 @@ def create_order():
     subtotal = sum(product.price * cart_item.quantity for cart_item, product in cart_items)
     tax_amount = subtotal * 0.08
     delivery_fee = 5.99 if subtotal < 50 else 0
-    discount_amount = 0
+    promotion_discount = price_cart(_promotion_lines(cart_items))['discount']
     
-    # Apply coupon if provided
+    # Apply coupon if provided; an invalid coupon is ignored as before
+    coupon = None
+    coupon_discount = 0
     if coupon_code:
-        coupon = Coupon.query.filter_by(code=coupon_code, is_active=True).first()
-        if coupon and coupon.valid_until > datetime.utcnow():
-            if subtotal >= coupon.min_order_amount:
-                if coupon.discount_type == 'percentage':
-                    discount_amount = subtotal * (coupon.discount_value / 100)
-                    if coupon.max_discount_amount:
-                        discount_amount = min(discount_amount, coupon.max_discount_amount)
-                else:  # fixed amount
-                    discount_amount = coupon.discount_value
-                
-                coupon.used_count += 1
+        try:
+            coupon, coupon_discount = check_coupon(coupon_code, subtotal, session['user_id'])
+        except CouponError:
+            coupon, coupon_discount = None, 0
     
+    discount_amount = promotion_discount + coupon_discount
     total_amount = subtotal + tax_amount + delivery_fee - discount_amount
     
+    # Book the delivery slot; capacity is claimed atomically and released on rollback
+    if delivery_slot_id:
+        try:
+            slot = book_slot(delivery_slot_id, session['user_id'], slot_hold_id)
+        except SlotError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 409
+        delivery_date = slot.starts_at.isoformat()
+        delivery_time_slot = slot.label
+    
     # Create order
     order = Order(
         user_id=session['user_id'],
@@ -499,6 +478,7 @@ def create_order():
         delivery_address=delivery_address,
         delivery_date=datetime.fromisoformat(delivery_date) if delivery_date else None,
         delivery_time_slot=delivery_time_slot,
+        delivery_slot_id=delivery_slot_id,
         special_instructions=special_instructions,
         payment_method=payment_method,
         stripe_payment_intent_id=stripe_payment_intent_id,
@@ -508,6 +488,14 @@ def create_order():
     db.session.add(order)
     db.session.flush()  # Get order ID
     
+    # Claim the coupon use atomically; the limit may have been reached since validation
+    if coupon:
+        try:
+            redeem_coupon(coupon, session['user_id'], order.id, coupon_discount)
+        except CouponError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 409
+    
     # Create order items and update inventory
     for cart_item, product in cart_items:
         order_item = OrderItem(
@@ -519,20 +507,25 @@ def create_order():
         )
         db.session.add(order_item)
         
-        # Update inventory
-        # Define update_inventory if not already defined
-        def update_inventory(product_id, quantity_change, reason, reference, user_id):
-            product = Product.query.get(product_id)
-            if product:
-                product.stock_quantity += quantity_change
-                db.session.add(product)
-                # Optionally, log inventory change here
-        update_inventory(
-            product.id,
-            -cart_item.quantity,
-            'sale',
-            f'Order #{order.order_number}',
-            session['user_id']
+        # Update inventory and log the sale in the stock history
+        previous_quantity = product.stock_quantity
+        product.stock_quantity -= cart_item.quantity
+        db.session.add(InventoryLog(
+            product_id=product.id,
+            change_type='sale',
+            quantity_change=-cart_item.quantity,
+            previous_quantity=previous_quantity,
+            new_quantity=product.stock_quantity,
+            reason=f'Order #{order.order_number}',
+            created_by=session['user_id']
+        ))
+    
+    # Retire the intent the order was paid with and keep the buy-again profile current
+    if order.payment_status == 'paid':
+        close_payment_intent(session['user_id'], stripe_payment_intent_id)
+        record_purchase(
+            session['user_id'],
+            [(product.id, cart_item.quantity) for cart_item, product in cart_items]
         )
     
     # Clear cart
@@ -556,14 +549,3 @@ def create_order():
         'order_id': order.id,
         'order_number': order.order_number
     })
-
-print("Complete API routes loaded!")
-print("Available endpoints:")
-print("- Authentication: /api/auth/register, /api/auth/login, /api/auth/logout")
-print("- Products: /api/products, /api/products/<id>")
-print("- Categories: /api/categories")
-print("- Cart: /api/cart, /api/cart/add, /api/cart/remove, /api/cart/update")
-print("- Wishlist: /api/wishlist, /api/wishlist/add")
-print("- Orders: /api/orders, /api/orders/create-payment-intent")
-print("- Reviews: /api/reviews")
-print("- Search: /api/search")
\ No newline at end of file
@@ -1,28 +1,40 @@
 # Advanced Search and Analytics Features
 
-from urllib import request
-import app
-from sqlalchemy import func, text
 from datetime import datetime, timedelta
-import json
-from flask import jsonify, session
 
-from app import db  # Make sure 'db' is imported from your app module
+from flask import Blueprint, request, jsonify, session
+from sqlalchemy import func
 
-# Import or define the admin_required decorator
-from app.auth import admin_required  # Adjust the import path as needed
-from app.auth import login_required  # Import login_required decorator
+from extensions import db
+from models import Product, Category, Order, OrderItem, User, Review, SearchLog
+from auth import admin_required, login_required
+from catalog_snapshot import get_catalog
+from low_stock import low_stock_count, low_stock_page
+from coupons import check_coupon, CouponError
+from replicas import read_only
+from search_cache import get_search_cache
+from search_synonyms import normalize_query
 
-# Import your models here
-from models import Product, Category, Order, OrderItem, User, Review, Coupon  # Adjust the import path as needed
+bp = Blueprint('search_and_analytics', __name__)
+
+# sort_by values for /api/search; rating and relevance fall back to name order
+SEARCH_SORTS = {
+    'price_low': ('price', 'asc'),
+    'price_high': ('price', 'desc'),
+    'newest': ('created_at', 'desc'),
+}
 
 # Search functionality
-@app.route('/api/search')
+@bp.route('/api/search')
+@read_only
 def search_products():
     query = request.args.get('q', '').strip()
     category_id = request.args.get('category_id', type=int)
     min_price = request.args.get('min_price', type=float)
     max_price = request.args.get('max_price', type=float)
+    brand = request.args.get('brand')
+    in_stock_only = request.args.get('in_stock_only', 'false').lower() == 'true'
+    min_rating = request.args.get('min_rating', type=float)
     sort_by = request.args.get('sort_by', 'relevance')
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
@@ -30,79 +42,67 @@ def search_products():
     if not query:
         return jsonify({'error': 'Search query is required'}), 400
     
-    # Build search query
-    search_query = Product.query.filter(Product.is_available == True)
-    
-    # Text search across multiple fields
-    search_terms = query.split()
-    for term in search_terms:
-        search_query = search_query.filter(
-            db.or_(
-                Product.name.ilike(f'%{term}%'),
-                Product.description.ilike(f'%{term}%'),
-                Product.brand.ilike(f'%{term}%')
-            )
-        )
-    
-    # Apply filters
-    if category_id:
-        search_query = search_query.filter(Product.category_id == category_id)
-    
-    if min_price is not None:
-        search_query = search_query.filter(Product.price >= min_price)
-    
-    if max_price is not None:
-        search_query = search_query.filter(Product.price <= max_price)
-    
-    # Apply sorting
-    if sort_by == 'price_low':
-        search_query = search_query.order_by(Product.price.asc())
-    elif sort_by == 'price_high':
-        search_query = search_query.order_by(Product.price.desc())
-    elif sort_by == 'rating':
-        # Sort by average rating (would need a subquery for exact implementation)
-        search_query = search_query.order_by(Product.name.asc())
-    elif sort_by == 'newest':
-        search_query = search_query.order_by(Product.created_at.desc())
-    else:  # relevance
-        search_query = search_query.order_by(Product.name.asc())
-    
-    # Paginate results
-    results = search_query.paginate(
-        page=page, per_page=per_page, error_out=False
-    )
-    
-    # Log search query for analytics
-    if 'user_id' in session:
-        log_search_query(session['user_id'], query, len(results.items))
+    if page < 1:
+        page = 1
+    if per_page < 1:
+        per_page = 20
+    
+    # Approved synonyms rewrite the query first. Hot queries come from the result
+    # cache; misses correct typos, then match against the in-memory catalog
+    # (which also gives the facet counts)
+    catalog = get_catalog()
+    cache = get_search_cache()
+    search_query = catalog.synonyms.get(normalize_query(query), query)
+    sort_by, sort_order = SEARCH_SORTS.get(sort_by, ('name', 'asc'))
+    filters = {
+        'category_id': category_id,
+        'brand': brand,
+        'min_price': min_price,
+        'max_price': max_price,
+        'in_stock_only': in_stock_only,
+        'min_rating': min_rating,
+        'sort_by': sort_by,
+        'sort_order': sort_order
+    }
+    cache_key = cache.key(search_query, **filters)
+    cached = cache.get(catalog.version, cache_key)
+    if cached:
+        ids, facets, terms = cached
+    else:
+        terms = catalog.vocabulary.correct(search_query.split())
+        matches = catalog.match(terms, **filters)
+        ids = catalog.ids[matches]
+        facets = catalog.facets(matches)
+        cache.put(catalog.version, cache_key, ids, facets, terms)
+    corrected_query = ' '.join(terms)
+    total = len(ids)
+    pages = -(-total // per_page)
+    start = (page - 1) * per_page
+    results = [catalog.payloads[catalog.positions[product_id]] for product_id in ids[start:start + per_page].tolist()]
+    
+    # Log search query for analytics: once per search, with the number of matches
+    if 'user_id' in session and page == 1:
+        log_search_query(session['user_id'], query, total)
     
     return jsonify({
         'query': query,
-        'results': [{
-            'id': p.id,
-            'name': p.name,
-            'description': p.description,
-            'price': p.price,
-            'original_price': p.original_price,
-            'image_url': p.image_url,
-            'stock_quantity': p.stock_quantity,
-            'unit': p.unit,
-            'brand': p.brand,
-            'category_name': p.category.name,
-            'average_rating': p.average_rating,
-            'review_count': p.review_count
-        } for p in results.items],
+        'corrected_query': corrected_query if corrected_query != ' '.join(query.lower().split()) else None,
+        'results': [
+            dict(p, category_name=catalog.category_names.get(p['category_id'])) for p in results
+        ],
+        'facets': facets,
         'pagination': {
-            'page': results.page,
-            'pages': results.pages,
-            'per_page': results.per_page,
-            'total': results.total,
-            'has_next': results.has_next,
-            'has_prev': results.has_prev
+            'page': page,
+            'pages': pages,
+            'per_page': per_page,
+            'total': total,
+            'has_next': page < pages,
+            'has_prev': page > 1
         }
     })
 
-@app.route('/api/search/suggestions')
+@bp.route('/api/search/suggestions')
+@read_only
 def search_suggestions():
     query = request.args.get('q', '').strip()
     limit = request.args.get('limit', 10, type=int)
@@ -140,14 +140,13 @@ def search_suggestions():
     
     return jsonify(suggestions[:limit])
 
-# Analytics and reporting
-class SearchLog(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    query = db.Column(db.String(200), nullable=False)
-    results_count = db.Column(db.Integer, default=0)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+@bp.route('/api/admin/search/cache-stats')
+@admin_required
+def search_cache_stats():
+    # Per worker process; each worker keeps its own cache
+    return jsonify(get_search_cache().stats())
 
+# Analytics and reporting
 def log_search_query(user_id, query, results_count):
     """Log search query for analytics"""
     search_log = SearchLog(
@@ -158,8 +157,9 @@ def log_search_query(user_id, query, results_count):
     db.session.add(search_log)
     db.session.commit()
 
-@app.route('/api/admin/analytics/dashboard')
+@bp.route('/api/admin/analytics/dashboard')
 @admin_required
+@read_only
 def analytics_dashboard():
     # Get date range
     days = request.args.get('days', 30, type=int)
@@ -187,7 +187,7 @@ def analytics_dashboard():
     category_sales = db.session.query(
         Category.name,
         func.sum(OrderItem.total).label('revenue')
-    ).join(Product).join(OrderItem).join(Order).filter(
+    ).select_from(Category).join(Product).join(OrderItem).join(Order).filter(
         Order.created_at >= start_date,
         Order.payment_status == 'paid'
     ).group_by(Category.id, Category.name).order_by(
@@ -210,11 +210,9 @@ def analytics_dashboard():
         func.count(SearchLog.id).desc()
     ).limit(10).all()
     
-    # Low stock products
-    low_stock_products = Product.query.filter(
-        Product.stock_quantity <= Product.min_stock_level,
-        Product.is_available == True
-    ).all()
+    # Low stock products, read from the materialized view (most urgent first)
+    low_stock_total = low_stock_count()
+    low_stock_products = low_stock_page(per_page=5)
     
     return jsonify({
         'period_days': days,
@@ -225,13 +223,13 @@ def analytics_dashboard():
         },
         'products': {
             'top_selling': [{'name': name, 'quantity_sold': int(qty)} for name, qty in top_products],
-            'low_stock_count': len(low_stock_products),
+            'low_stock_count': low_stock_total,
             'low_stock_products': [{
-                'id': p.id,
-                'name': p.name,
-                'current_stock': p.stock_quantity,
-                'min_level': p.min_stock_level
-            } for p in low_stock_products[:5]]
+                'id': item.product_id,
+                'name': name,
+                'current_stock': item.stock_quantity,
+                'min_level': item.min_stock_level
+            } for item, name in low_stock_products]
         },
         'categories': {
             'sales_by_category': [{'name': name, 'revenue': float(revenue)} for name, revenue in category_sales]
@@ -246,7 +244,7 @@ def analytics_dashboard():
     })
 
 # Reviews and ratings
-@app.route('/api/reviews', methods=['POST'])
+@bp.route('/api/reviews', methods=['POST'])
 @login_required
 def add_review():
     data = request.get_json()
@@ -289,7 +287,8 @@ def add_review():
     
     return jsonify({'success': True, 'message': 'Review added successfully'})
 
-@app.route('/api/products/<int:product_id>/reviews')
+@bp.route('/api/products/<int:product_id>/reviews')
+@read_only
 def get_product_reviews(product_id):
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
@@ -329,37 +328,17 @@ def get_product_reviews(product_id):
     })
 
 # Coupon system
-@app.route('/api/coupons/validate', methods=['POST'])
+@bp.route('/api/coupons/validate', methods=['POST'])
 @login_required
 def validate_coupon():
     data = request.get_json()
     coupon_code = data.get('coupon_code', '').upper()
     cart_total = data.get('cart_total', 0)
     
-    coupon = Coupon.query.filter_by(code=coupon_code, is_active=True).first()
-    
-    if not coupon:
-        return jsonify({'valid': False, 'message': 'Invalid coupon code'})
-    
-    if coupon.valid_until and coupon.valid_until < datetime.utcnow():
-        return jsonify({'valid': False, 'message': 'Coupon has expired'})
-    
-    if coupon.usage_limit and coupon.used_count >= coupon.usage_limit:
-        return jsonify({'valid': False, 'message': 'Coupon usage limit reached'})
-    
-    if cart_total < coupon.min_order_amount:
-        return jsonify({
-            'valid': False,
-            'message': f'Minimum order amount is ${coupon.min_order_amount:.2f}'
-        })
-    
-    # Calculate discount
-    if coupon.discount_type == 'percentage':
-        discount_amount = cart_total * (coupon.discount_value / 100)
-        if coupon.max_discount_amount:
-            discount_amount = min(discount_amount, coupon.max_discount_amount)
-    else:  # fixed amount
-        discount_amount = min(coupon.discount_value, cart_total)
+    try:
+        coupon, discount_amount = check_coupon(coupon_code, cart_total, session['user_id'])
+    except CouponError as e:
+        return jsonify({'valid': False, 'message': str(e)})
     
     return jsonify({
         'valid': True,
@@ -368,12 +347,3 @@ def validate_coupon():
         'discount_value': coupon.discount_value,
         'description': coupon.description
     })
-
-print("Advanced search and analytics features loaded!")
-print("New endpoints:")
-print("- /api/search - Advanced product search")
-print("- /api/search/suggestions - Search autocomplete")
-print("- /api/admin/analytics/dashboard - Analytics dashboard")
-print("- /api/reviews - Add product reviews")
-print("- /api/products/<id>/reviews - Get product reviews")
-print("- /api/coupons/validate - Validate coupon codes")
\ No newline at end of file
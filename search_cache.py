@@ -0,0 +1,91 @@
+# Search Result Cache for the Grocery Website
+#
+# Hot queries ("milk", "bread", "eggs") are answered from a per-worker LRU of
+# ranked product id lists and their facet counts, keyed on the normalized
+# query, filters and sort. Pages are hydrated from the catalog snapshot's
+# product payloads, so only ids are stored. Every catalog snapshot version has
+# its own number, and the cache empties itself when the version moves on.
+#
+# Size is bounded both by entry count and by the total number of ids held, so
+# a few very broad queries cannot pin a lot of memory.
+
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+
+
+class SearchResultCache:
+    """LRU of (ranked ids, facets, corrected terms) for one catalog version"""
+
+    def __init__(self, max_entries=1000, max_ids=1000000):
+        self.max_entries = max_entries
+        self.max_ids = max_ids
+        self.version = None
+        self._entries = OrderedDict()
+        self._ids_held = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    @staticmethod
+    def key(query, **filters):
+        """Cache key: lower-cased, de-duplicated, sorted terms plus every filter and the sort"""
+        return (tuple(sorted(set(query.lower().split()))),) + tuple(sorted(filters.items()))
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._ids_held = 0
+            self.version = version
+
+    def get(self, version, key):
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, version, key, ids, facets, terms):
+        if len(ids) > self.max_ids:
+            return
+        with self._lock:
+            self._check_version(version)
+            if key in self._entries:
+                return
+            self._entries[key] = (ids, facets, terms)
+            self._ids_held += len(ids)
+            while len(self._entries) > self.max_entries or self._ids_held > self.max_ids:
+                _, (evicted_ids, _, _) = self._entries.popitem(last=False)
+                self._ids_held -= len(evicted_ids)
+                self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'catalog_version': self.version,
+            'entries': len(self._entries),
+            'ids_held': self._ids_held,
+            'max_entries': self.max_entries,
+            'max_ids': self.max_ids,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+def get_search_cache():
+    """The search result cache for this app"""
+    cache = current_app.extensions.get('search_cache')
+    if cache is None:
+        cache = current_app.extensions.setdefault('search_cache', SearchResultCache(
+            current_app.config['SEARCH_CACHE_SIZE'], current_app.config['SEARCH_CACHE_MAX_IDS']
+        ))
+    return cache
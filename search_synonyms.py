@@ -0,0 +1,378 @@
+# Search Synonyms and Zero-Result Analytics for the Grocery Website
+#
+# A batch job streams SearchLog in id order, one chunk at a time, starting
+# after the last id it processed. Each chunk is folded into per-query totals
+# (search_query_stats) and into "searched X, found nothing, then searched Y"
+# reformulation counts. Only the current chunk and each user's latest failed
+# search are held in memory, so months of logs run in bounded memory. A run
+# resumes by replaying the last REFORMULATION_WINDOW of processed logs, so a
+# retry logged after the previous run still pairs with its failed search.
+# Searches are logged once, from the first page, with the total match count.
+#
+# Proposals map a failing query to the successful query that users most
+# often retried with. Failing that, they map it to a successful near-duplicate:
+# the same words in another order or number, or a query within two edits.
+# An admin approves or rejects each proposal. The catalog snapshot loads
+# approved synonyms and rewrites whole queries before search.
+#
+# Usage:
+#   flask process-search-logs              # fold new SearchLog rows into the stats
+#   flask process-search-logs --propose    # ... then propose synonyms
+
+from datetime import datetime, timedelta
+
+import click
+from flask import Blueprint, request, jsonify, session
+from sqlalchemy import bindparam
+
+from extensions import db
+from models import SearchLog
+from auth import admin_required
+from fuzzy_search import FuzzyDictionary
+
+bp = Blueprint('search_synonyms', __name__, cli_group=None)
+
+CHUNK_SIZE = 10000
+LOW_RESULTS = 3  # a search showing this many results or fewer counts as low-result
+REFORMULATION_WINDOW = timedelta(minutes=2)
+MIN_SEARCHES = 3
+MIN_FAILURE_RATE = 0.5
+MIN_REFORMULATIONS = 2
+SYNONYM_STATUSES = ('proposed', 'approved', 'rejected')
+JOB_NAME = 'search_log'
+
+
+class SearchQueryStats(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    term = db.Column(db.String(200), unique=True, nullable=False)  # normalized query
+    searches = db.Column(db.Integer, default=0)
+    zero_results = db.Column(db.Integer, default=0)
+    low_results = db.Column(db.Integer, default=0)
+    last_searched_at = db.Column(db.DateTime)
+
+
+class SearchReformulation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    term = db.Column(db.String(200), nullable=False)
+    next_term = db.Column(db.String(200), nullable=False)
+    count = db.Column(db.Integer, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('term', 'next_term', name='uq_search_reformulation'),
+    )
+
+
+class SearchSynonym(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    term = db.Column(db.String(200), unique=True, nullable=False)
+    replacement = db.Column(db.String(200), nullable=False)
+    reason = db.Column(db.String(20))  # reformulation, near_duplicate, manual
+    score = db.Column(db.Integer, default=0)
+    status = db.Column(db.String(20), default='proposed', index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    reviewed_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    reviewed_at = db.Column(db.DateTime)
+
+
+class SearchJobCheckpoint(db.Model):
+    job = db.Column(db.String(50), primary_key=True)
+    last_log_id = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+
+def approved_synonyms():
+    """{normalized query: replacement} for approved synonyms"""
+    return dict(db.session.query(SearchSynonym.term, SearchSynonym.replacement).filter(
+        SearchSynonym.status == 'approved'
+    ))
+
+
+def _aggregate(rows, pending):
+    """Fold id-ordered log rows into per-query stats and reformulation pair counts.
+
+    pending holds {user_id: (query, searched_at)} for each user's latest
+    zero-result search and carries over between chunks.
+    """
+    stats = {}
+    pairs = {}
+    for _, user_id, query, results_count, created_at in rows:
+        query = normalize_query(query)
+        results_count = results_count or 0
+        entry = stats.setdefault(query, {'searches': 0, 'zero_results': 0, 'low_results': 0, 'last_searched_at': created_at})
+        entry['searches'] += 1
+        entry['zero_results'] += results_count == 0
+        entry['low_results'] += results_count <= LOW_RESULTS
+        entry['last_searched_at'] = max(entry['last_searched_at'], created_at)
+
+        if user_id is None:
+            continue
+        failed = pending.pop(user_id, None)
+        if failed and failed[0] != query and created_at - failed[1] <= REFORMULATION_WINDOW and results_count > LOW_RESULTS:
+            pairs[(failed[0], query)] = pairs.get((failed[0], query), 0) + 1
+        if results_count == 0:
+            pending[user_id] = (query, created_at)
+
+    # Failed searches older than the window can no longer be reformulated
+    if rows:
+        cutoff = rows[-1][4] - REFORMULATION_WINDOW
+        for user_id in [user_id for user_id, (_, searched_at) in pending.items() if searched_at < cutoff]:
+            del pending[user_id]
+    return stats, pairs
+
+
+def _pending_at(last_id):
+    """Each user's failed search still open for reformulation at the checkpoint"""
+    pending = {}
+    last_at = db.session.query(SearchLog.created_at).filter(SearchLog.id == last_id).scalar()
+    if last_at is None:
+        return pending
+    for user_id, query, results_count, created_at in db.session.query(
+        SearchLog.user_id, SearchLog.query, SearchLog.results_count, SearchLog.created_at
+    ).filter(
+        SearchLog.id <= last_id, SearchLog.created_at >= last_at - REFORMULATION_WINDOW, SearchLog.user_id.isnot(None)
+    ).order_by(SearchLog.id):
+        if results_count:
+            pending.pop(user_id, None)
+        else:
+            pending[user_id] = (normalize_query(query), created_at)
+    return pending
+
+
+def _merge_stats(stats):
+    table = SearchQueryStats.__table__
+    existing = dict(db.session.query(SearchQueryStats.term, SearchQueryStats.id).filter(
+        SearchQueryStats.term.in_(list(stats))
+    ))
+    updates = [{
+        '_id': existing[query],
+        '_searches': entry['searches'],
+        '_zero_results': entry['zero_results'],
+        '_low_results': entry['low_results'],
+        '_last_searched_at': entry['last_searched_at'],
+    } for query, entry in stats.items() if query in existing]
+    inserts = [dict(entry, term=query) for query, entry in stats.items() if query not in existing]
+
+    if updates:
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('_id')).values(
+                searches=table.c.searches + bindparam('_searches'),
+                zero_results=table.c.zero_results + bindparam('_zero_results'),
+                low_results=table.c.low_results + bindparam('_low_results'),
+                last_searched_at=bindparam('_last_searched_at'),
+            ),
+            updates
+        )
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+
+
+def _merge_pairs(pairs):
+    table = SearchReformulation.__table__
+    failed_queries = {query for query, _ in pairs}
+    existing = {
+        (row.term, row.next_term): row.id
+        for row in db.session.query(
+            SearchReformulation.id, SearchReformulation.term, SearchReformulation.next_term
+        ).filter(SearchReformulation.term.in_(failed_queries))
+    }
+    updates = [{'_id': existing[pair], '_count': count} for pair, count in pairs.items() if pair in existing]
+    inserts = [{'term': query, 'next_term': next_query, 'count': count}
+               for (query, next_query), count in pairs.items() if (query, next_query) not in existing]
+
+    if updates:
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('_id')).values(count=table.c.count + bindparam('_count')),
+            updates
+        )
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+
+
+def process_search_logs(chunk_size=CHUNK_SIZE):
+    """Fold SearchLog rows after the checkpoint into the stats, committing per chunk"""
+    checkpoint = db.session.get(SearchJobCheckpoint, JOB_NAME)
+    if checkpoint is None:
+        checkpoint = SearchJobCheckpoint(job=JOB_NAME, last_log_id=0)
+        db.session.add(checkpoint)
+    last_id = checkpoint.last_log_id
+
+    totals = {'rows': 0, 'queries': 0, 'reformulations': 0}
+    pending = _pending_at(last_id)
+    log = SearchLog.__table__
+    while True:
+        rows = db.session.execute(
+            db.select(log.c.id, log.c.user_id, log.c.query, log.c.results_count, log.c.created_at)
+            .where(log.c.id > last_id).order_by(log.c.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+
+        stats, pairs = _aggregate(rows, pending)
+        _merge_stats(stats)
+        if pairs:
+            _merge_pairs(pairs)
+        last_id = rows[-1][0]
+        checkpoint.last_log_id = last_id
+        db.session.commit()
+
+        totals['rows'] += len(rows)
+        totals['queries'] += len(stats)
+        totals['reformulations'] += sum(pairs.values())
+    db.session.commit()
+    return totals
+
+
+def _signature(query):
+    """Order- and plural-insensitive form of a query, for grouping near-duplicates"""
+    words = []
+    for word in query.split():
+        if len(word) > 4 and word.endswith('es'):
+            word = word[:-2]
+        elif len(word) > 3 and word.endswith('s'):
+            word = word[:-1]
+        words.append(word)
+    return tuple(sorted(words))
+
+
+def propose_synonyms(min_searches=MIN_SEARCHES, min_failure_rate=MIN_FAILURE_RATE):
+    """Propose a replacement for each frequently failing query; returns how many were added"""
+    stats = db.session.query(
+        SearchQueryStats.term, SearchQueryStats.searches, SearchQueryStats.low_results
+    ).filter(SearchQueryStats.searches >= min_searches).all()
+    failing = {query: searches for query, searches, low in stats if low / searches >= min_failure_rate}
+    successful = {query: searches for query, searches, low in stats if low / searches < min_failure_rate}
+    decided = {row[0] for row in db.session.query(SearchSynonym.term)}
+    failing = {query: searches for query, searches in failing.items() if query not in decided}
+    if not failing or not successful:
+        return 0
+
+    by_signature = {}
+    near_duplicates = FuzzyDictionary()
+    for query, searches in successful.items():
+        signature = _signature(query)
+        if signature not in by_signature or searches > successful[by_signature[signature]]:
+            by_signature[signature] = query
+        near_duplicates.add_word(query, searches)
+
+    reformulations = {}
+    for query, next_query, count in db.session.query(
+        SearchReformulation.term, SearchReformulation.next_term, SearchReformulation.count
+    ).filter(SearchReformulation.term.in_(list(failing)), SearchReformulation.count >= MIN_REFORMULATIONS):
+        if next_query in successful and count > reformulations.get(query, (None, 0))[1]:
+            reformulations[query] = (next_query, count)
+
+    proposals = []
+    for query, searches in failing.items():
+        if query in reformulations:
+            replacement, reason = reformulations[query][0], 'reformulation'
+        else:
+            replacement = by_signature.get(_signature(query)) or near_duplicates.lookup(query)
+            reason = 'near_duplicate'
+        if replacement and replacement != query:
+            proposals.append({
+                'term': query,
+                'replacement': replacement,
+                'reason': reason,
+                'score': searches,
+                'status': 'proposed',
+                'created_at': datetime.utcnow(),
+            })
+    if proposals:
+        db.session.execute(SearchSynonym.__table__.insert(), proposals)
+    db.session.commit()
+    return len(proposals)
+
+
+@bp.route('/api/admin/search/zero-results')
+@admin_required
+def get_zero_result_queries():
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    rows = db.session.query(SearchQueryStats, SearchSynonym).outerjoin(
+        SearchSynonym, SearchSynonym.term == SearchQueryStats.term
+    ).filter(SearchQueryStats.zero_results > 0).order_by(
+        SearchQueryStats.zero_results.desc()
+    ).limit(limit).all()
+    return jsonify([{
+        'query': stats.term,
+        'searches': stats.searches,
+        'zero_results': stats.zero_results,
+        'low_results': stats.low_results,
+        'last_searched_at': stats.last_searched_at.isoformat() if stats.last_searched_at else None,
+        'synonym': {
+            'id': synonym.id,
+            'replacement': synonym.replacement,
+            'status': synonym.status
+        } if synonym else None
+    } for stats, synonym in rows])
+
+
+@bp.route('/api/admin/search/synonyms', methods=['GET'])
+@admin_required
+def get_search_synonyms():
+    status = request.args.get('status', 'proposed')
+    synonyms = SearchSynonym.query.filter_by(status=status).order_by(SearchSynonym.score.desc()).all()
+    return jsonify([{
+        'id': synonym.id,
+        'query': synonym.term,
+        'replacement': synonym.replacement,
+        'reason': synonym.reason,
+        'score': synonym.score,
+        'status': synonym.status,
+        'created_at': synonym.created_at.isoformat()
+    } for synonym in synonyms])
+
+
+@bp.route('/api/admin/search/synonyms', methods=['POST'])
+@admin_required
+def create_search_synonym():
+    data = request.get_json() or {}
+    query = normalize_query(data.get('query') or '')
+    replacement = normalize_query(data.get('replacement') or '')
+    if not query or not replacement:
+        return jsonify({'error': 'query and replacement are required'}), 400
+    if SearchSynonym.query.filter_by(term=query).first():
+        return jsonify({'error': 'A synonym for this query already exists'}), 409
+
+    synonym = SearchSynonym(
+        term=query, replacement=replacement, reason='manual', status='approved',
+        reviewed_by=session['user_id'], reviewed_at=datetime.utcnow()
+    )
+    db.session.add(synonym)
+    db.session.commit()
+    return jsonify({'success': True, 'id': synonym.id}), 201
+
+
+@bp.route('/api/admin/search/synonyms/<int:synonym_id>', methods=['PUT'])
+@admin_required
+def review_search_synonym(synonym_id):
+    synonym = SearchSynonym.query.get_or_404(synonym_id)
+    data = request.get_json() or {}
+    status = data.get('status', synonym.status)
+    if status not in SYNONYM_STATUSES:
+        return jsonify({'error': f"status must be one of {', '.join(SYNONYM_STATUSES)}"}), 400
+    if data.get('replacement'):
+        synonym.replacement = normalize_query(data['replacement'])
+    synonym.status = status
+    synonym.reviewed_by = session['user_id']
+    synonym.reviewed_at = datetime.utcnow()
+    db.session.commit()
+    # Search picks the change up with the next catalog snapshot refresh
+    return jsonify({'success': True, 'id': synonym.id, 'status': synonym.status})
+
+
+@bp.cli.command('process-search-logs')
+@click.option('--chunk-size', default=CHUNK_SIZE, show_default=True)
+@click.option('--propose', is_flag=True, help='propose synonyms for failing queries afterwards')
+def process_search_logs_command(chunk_size, propose):
+    """Aggregate new SearchLog rows and optionally propose search synonyms"""
+    for model in (SearchQueryStats, SearchReformulation, SearchSynonym, SearchJobCheckpoint):
+        model.__table__.create(db.engine, checkfirst=True)
+    totals = process_search_logs(chunk_size)
+    click.echo(f"Processed {totals['rows']} search log rows "
+               f"({totals['reformulations']} reformulations after failed searches)")
+    if propose:
+        click.echo(f'Proposed {propose_synonyms()} synonyms')
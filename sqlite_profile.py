@@ -0,0 +1,99 @@
+# SQLite Production Profile for the Grocery Website
+#
+# For file-based SQLite databases the engine gets a bounded connection pool
+# shared safely across worker threads, and every new connection is switched
+# to WAL with tuned pragmas, so readers keep reading while a checkout writes.
+# Writers still see "database is locked" when the busy timeout runs out or
+# when a read transaction cannot be upgraded to a write; @retry_on_busy
+# reruns those views with backoff.
+#
+# Set SQLITE_PRODUCTION_PROFILE=false to fall back to the SQLAlchemy defaults.
+
+import random
+import sqlite3
+import time
+from functools import wraps
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
+
+from extensions import db
+
+BUSY_RETRIES = 3
+BUSY_BACKOFF_SECONDS = 0.05
+
+
+def sqlite_pragmas(config):
+    """PRAGMA statements run on every new connection"""
+    return [
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',  # durable at checkpoints; safe with WAL
+        f"PRAGMA busy_timeout={config['SQLITE_BUSY_TIMEOUT_MS']}",
+        f"PRAGMA cache_size=-{config['SQLITE_CACHE_SIZE_KB']}",
+        f"PRAGMA mmap_size={config['SQLITE_MMAP_SIZE']}",
+        'PRAGMA temp_store=MEMORY',
+    ]
+
+
+def configure_sqlite(app):
+    """Set SQLALCHEMY_ENGINE_OPTIONS for a file-based SQLite database; call before db.init_app"""
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        return
+    if not app.config['SQLITE_PRODUCTION_PROFILE']:
+        return
+
+    pragmas = sqlite_pragmas(app.config)
+
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    # A pool class per app, so the pragma listener only applies to this engine
+    pool_class = type('SQLiteProfilePool', (QueuePool,), {})
+    event.listen(pool_class, 'connect', apply_pragmas)
+
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    options.update({
+        'poolclass': pool_class,
+        'pool_size': app.config['SQLITE_POOL_SIZE'],
+        'max_overflow': app.config['SQLITE_POOL_OVERFLOW'],
+        'pool_timeout': app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000,
+        # The pool hands each connection to one thread at a time
+        'connect_args': {
+            'check_same_thread': False,
+            'timeout': app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000,
+        },
+    })
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def is_busy_error(error):
+    return isinstance(error.orig, sqlite3.OperationalError) and (
+        'locked' in str(error.orig) or 'busy' in str(error.orig)
+    )
+
+
+def retry_on_busy(f):
+    """Retry a write view when SQLite reports the database as locked.
+
+    The view's database work is a single transaction, so once it is rolled
+    back the whole view can run again.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        for attempt in range(BUSY_RETRIES + 1):
+            try:
+                return f(*args, **kwargs)
+            except OperationalError as e:
+                db.session.rollback()
+                if attempt == BUSY_RETRIES or not is_busy_error(e):
+                    raise
+                current_app.logger.warning(f'Database busy in {f.__name__}, retry {attempt + 1}')
+                time.sleep(BUSY_BACKOFF_SECONDS * 2 ** attempt * (1 + random.random()))
+    return decorated_function
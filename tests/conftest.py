@@ -0,0 +1,85 @@
+# Shared fixtures: a fresh app on a temporary SQLite file per test
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from app import Config, create_app
+from coupons import coupon_cache
+from extensions import db
+from models import User, Category, Product
+
+
+class TestConfig(Config):
+    TESTING = True
+    RATELIMIT_ENABLED = False
+    SECRET_KEY = 'test'
+    SQLALCHEMY_REPLICA_URIS = []
+    IMAGE_WORKERS = 0
+    CATALOG_REFRESH_SECONDS = 0  # tests call refresh() themselves
+    STRIPE_SECRET_KEY = 'sk_test_fake'
+    STRIPE_API_BASE = None
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # The app writes logs and uploads relative to the working directory
+    monkeypatch.chdir(tmp_path)
+
+    class AppConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+
+    app = create_app(AppConfig)
+    # Per-process caches outlive an app; start every test from the new database
+    coupon_cache.invalidate()
+    with app.app_context():
+        db.create_all()
+        yield app
+        snapshot = app.extensions.get('catalog_snapshot')
+        if snapshot is not None:
+            snapshot.stop()
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def user(app):
+    user = User(username='shopper', email='shopper@example.com', password_hash=generate_password_hash('x'))
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def admin(app):
+    admin = User(username='admin', email='admin@example.com', password_hash=generate_password_hash('x'), is_admin=True)
+    db.session.add(admin)
+    db.session.commit()
+    return admin
+
+
+def login(client, user):
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+        sess['is_admin'] = bool(user.is_admin)
+    return client
+
+
+@pytest.fixture
+def category(app):
+    category = Category(name='Fruit')
+    db.session.add(category)
+    db.session.commit()
+    return category
+
+
+@pytest.fixture
+def make_product(app, category):
+    def make_product(name, price=2.0, stock=10, **kwargs):
+        product = Product(
+            name=name, price=price, stock_quantity=stock, category_id=category.id,
+            is_available=kwargs.pop('is_available', True), **kwargs
+        )
+        db.session.add(product)
+        db.session.commit()
+        return product
+    return make_product
@@ -0,0 +1,29 @@
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmark import IMPORT_BUDGET_SECONDS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOOT = 'import sys, time; start = time.perf_counter(); from app import create_app; create_app(); ' \
+       'print(time.perf_counter() - start); print(",".join(sorted(sys.modules)))'
+
+
+def _boot(tmp_path):
+    # A fresh interpreter, so nothing imported by other tests is counted
+    result = subprocess.run(
+        [sys.executable, '-c', BOOT], cwd=tmp_path, capture_output=True, text=True, check=True,
+        env=dict(os.environ, PYTHONPATH=ROOT, DATABASE_URL=f"sqlite:///{tmp_path / 'boot.db'}")
+    )
+    seconds, modules = result.stdout.strip().splitlines()[-2:]
+    return float(seconds), set(modules.split(','))
+
+
+def test_create_app_leaves_optional_dependencies_unimported(tmp_path):
+    _, modules = _boot(tmp_path)
+    assert not modules & {'stripe', 'flask_mail', 'PIL'}
+
+
+def test_create_app_cold_start_within_budget(tmp_path):
+    assert statistics.median(_boot(tmp_path)[0] for _ in range(3)) <= IMPORT_BUDGET_SECONDS
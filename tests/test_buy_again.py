@@ -0,0 +1,53 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import CartItem
+from buy_again import PurchaseProfile, bulk_add_to_cart
+
+from conftest import login
+
+
+def _profile(user, product, times_bought, quantity=2):
+    db.session.add(PurchaseProfile(
+        user_id=user.id, product_id=product.id, times_bought=times_bought,
+        total_quantity=quantity * times_bought, last_quantity=quantity
+    ))
+    db.session.commit()
+
+
+def test_upsert_adds_to_existing_line_capped_at_stock(app, user, make_product):
+    apple, pear = make_product('Apple', stock=5), make_product('Pear', stock=10)
+    db.session.add(CartItem(user_id=user.id, product_id=apple.id, quantity=4))
+    db.session.commit()
+
+    bulk_add_to_cart(user.id, {apple.id: 3, pear.id: 2})
+    bulk_add_to_cart(user.id, {pear.id: 2})
+
+    lines = {item.product_id: item.quantity for item in CartItem.query.filter_by(user_id=user.id)}
+    assert lines == {apple.id: 5, pear.id: 4}
+
+
+def test_cart_lines_are_unique_per_product(app, user, make_product):
+    apple = make_product('Apple')
+    db.session.add_all([CartItem(user_id=user.id, product_id=apple.id, quantity=1) for _ in range(2)])
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+
+
+def test_requested_products_outside_top_n_are_added(app, user, make_product):
+    products = [make_product(f'Product {i}') for i in range(3)]
+    for times_bought, product in enumerate(products, start=1):
+        _profile(user, product, times_bought)
+    client = login(app.test_client(), user)
+
+    response = client.post('/api/me/buy-again/add-to-cart', json={'product_ids': [products[0].id], 'limit': 1})
+
+    assert response.json['added'] == 1
+    assert [item.product_id for item in CartItem.query.all()] == [products[0].id]
+
+
+@pytest.mark.parametrize('body', [{'limit': '5'}, {'limit': 0}, {'product_ids': 'all'}, {'product_ids': ['1']}])
+def test_bad_parameters_are_rejected(app, user, body):
+    response = login(app.test_client(), user).post('/api/me/buy-again/add-to-cart', json=body)
+    assert response.status_code == 400
@@ -0,0 +1,70 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import CartItem
+from conftest import login
+
+
+@pytest.fixture
+def client(app, user):
+    return login(app.test_client(), user)
+
+
+def _on_cart_insert(action):
+    calls = []
+
+    def listener(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('INSERT INTO cart_item'):
+            calls.append(statement)
+            action(cursor)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    return calls, lambda: event.remove(db.engine, 'before_cursor_execute', listener)
+
+
+def test_add_to_cart_validates_quantity(app, client, make_product):
+    apple = make_product('Apple', stock=5)
+    for quantity in ('2', -1, 0, 1.5, True, None):
+        response = client.post('/api/cart/add', json={'product_id': apple.id, 'quantity': quantity})
+        assert response.status_code == 400, quantity
+    assert client.post('/api/cart/add', json={}).status_code == 400
+
+    assert client.post('/api/cart/add', json={'product_id': apple.id, 'quantity': 2}).status_code == 200
+    assert client.post('/api/cart/add', json={'product_id': apple.id}).status_code == 200
+    assert client.post('/api/cart/add', json={'product_id': apple.id, 'quantity': 3}).status_code == 400
+    assert CartItem.query.one().quantity == 3
+
+
+def test_concurrent_add_updates_the_line_once(app, client, user, make_product):
+    apple = make_product('Apple', stock=5)
+
+    # Another request commits the same cart line first
+    def add_first(cursor):
+        cursor.execute('INSERT INTO cart_item (user_id, product_id, quantity) VALUES (?, ?, ?)', (user.id, apple.id, 2))
+        cursor.connection.commit()
+
+    calls, remove = _on_cart_insert(add_first)
+    try:
+        assert client.post('/api/cart/add', json={'product_id': apple.id, 'quantity': 3}).status_code == 200
+    finally:
+        remove()
+    assert len(calls) == 1
+    assert CartItem.query.one().quantity == 5
+
+
+def test_other_integrity_errors_are_not_retried(app, client, make_product):
+    apple = make_product('Apple', stock=5)
+
+    def fail(cursor):
+        raise sqlite3.IntegrityError('FOREIGN KEY constraint failed')
+
+    calls, remove = _on_cart_insert(fail)
+    try:
+        with pytest.raises(IntegrityError):
+            client.post('/api/cart/add', json={'product_id': apple.id, 'quantity': 1})
+    finally:
+        remove()
+    assert len(calls) == 1
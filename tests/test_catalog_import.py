@@ -0,0 +1,71 @@
+import io
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import Category, InventoryLog, Product
+from catalog_import import import_catalog
+
+CSV_FEED = (
+    'barcode,name,category,price,stock_quantity,expiry_date\n'
+    '100,Apple,Fruit,1.5,10,\n'
+    '200,Pear,Fruit,2.0,0,2024-06-01\n'
+    '300,,Fruit,1.0,5,\n'
+    '400,Milk,Dairy,-1,5,\n'
+    '100,Apple,Fruit,1.75,12,\n'
+)
+
+
+def test_csv_import_upserts_by_barcode(app):
+    errors = []
+    stats = import_catalog(io.StringIO(CSV_FEED), chunk_size=2, on_error=lambda *error: errors.append(error))
+    assert {key: stats[key] for key in ('rows', 'inserted', 'updated', 'rejected')} == {
+        'rows': 5, 'inserted': 2, 'updated': 1, 'rejected': 2
+    }
+    assert [(line, message) for line, _, message in errors] == [(3, 'name is required'), (4, 'price must not be negative')]
+
+    apple = Product.query.filter_by(barcode='100').one()
+    assert (apple.price, apple.stock_quantity) == (1.75, 12)
+    assert [(log.change_type, log.quantity_change) for log in InventoryLog.query.order_by(InventoryLog.id)] == [
+        ('restock', 10), ('restock', 2)
+    ]
+    assert [category.name for category in Category.query] == ['Fruit']
+
+
+def test_jsonl_rejects_bad_lines(app):
+    feed = '{"barcode": "1", "name": "Kiwi", "category": "Fruit", "price": 1}\nnot json\n[1, 2]\n\n'
+    stats = import_catalog(io.StringIO(feed), fmt='jsonl')
+    assert (stats['rows'], stats['inserted'], stats['rejected']) == (3, 1, 2)
+
+
+def test_barcodes_are_unique(app, make_product):
+    make_product('Apple', barcode='100')
+    with pytest.raises(IntegrityError):
+        make_product('Other apple', barcode='100')
+
+
+def test_chunk_losing_an_insert_race_is_retried_as_update(app, category):
+    raced = []
+
+    # Another import commits barcode 100 after this one found it missing
+    def insert_first(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('INSERT INTO product') and not raced:
+            raced.append(True)
+            cursor.execute(
+                'INSERT INTO product (name, price, stock_quantity, category_id, barcode) VALUES (?, ?, ?, ?, ?)',
+                ('Apple', 1.0, 4, category.id, '100')
+            )
+            cursor.connection.commit()
+
+    event.listen(db.engine, 'before_cursor_execute', insert_first)
+    try:
+        stats = import_catalog(io.StringIO(CSV_FEED))
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', insert_first)
+
+    assert (stats['inserted'], stats['updated']) == (1, 1)
+    apple = Product.query.filter_by(barcode='100').one()
+    assert (apple.price, apple.stock_quantity) == (1.75, 12)
+    assert Product.query.count() == 2
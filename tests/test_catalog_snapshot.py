@@ -0,0 +1,160 @@
+import time
+
+import pytest
+
+import catalog_snapshot
+from extensions import db
+from models import Category, Product, Review
+from catalog_snapshot import get_catalog
+
+
+@pytest.fixture
+def products(app, make_product):
+    return [
+        make_product('Apple', price=1.5, stock=10, brand='Orchard'),
+        make_product('Banana', price=0.5, stock=0, brand='Tropic'),
+        make_product('Cherry', price=6.0, stock=3, brand='Orchard', is_featured=True),
+        make_product('Date', price=12.0, stock=8, brand=None),
+        make_product('Elderberry', price=3.0, stock=2, is_available=False),
+    ]
+
+
+def _names(payloads):
+    return [payload['name'] for payload in payloads]
+
+
+def test_filters_sort_and_page(app, products):
+    catalog = get_catalog()
+    page, total = catalog.query()
+    assert (_names(page), total) == (['Apple', 'Banana', 'Cherry', 'Date'], 4)
+
+    assert _names(catalog.query(sort_by='price', sort_order='desc')[0]) == ['Date', 'Cherry', 'Apple', 'Banana']
+    assert _names(catalog.query(min_price=1, max_price=10)[0]) == ['Apple', 'Cherry']
+    assert _names(catalog.query(in_stock_only=True, featured_only=True)[0]) == ['Cherry']
+    assert _names(catalog.query(search='ERR')[0]) == ['Cherry']
+    assert catalog.query(page=2, per_page=3) == ([catalog.payloads[catalog.positions[products[3].id]]], 4)
+
+    response = app.test_client().get('/api/products?per_page=2&page=2&sort_by=price')
+    body = response.get_json()
+    assert _names(body['products']) == ['Cherry', 'Date']
+    assert (body['pagination']['total'], body['pagination']['pages']) == (4, 2)
+
+
+
+@pytest.fixture
+def faceted(app, user, products, make_product):
+    dairy = Category(name='Dairy')
+    db.session.add(dairy)
+    db.session.commit()
+    milk = make_product('Milk', price=25.0, stock=1, brand='Meadow')
+    milk.category_id = dairy.id
+    for product, rating in ((products[0], 4), (products[0], 5), (products[2], 2), (milk, 5)):
+        db.session.add(Review(user_id=user.id, product_id=product.id, rating=rating))
+    db.session.commit()
+    return products + [milk]
+
+
+def _counts(facets, key, field):
+    return {facet[field]: facet['count'] for facet in facets[key]}
+
+
+def test_facets_count_every_available_match(app, faceted):
+    fruit, dairy = faceted[0].category_id, faceted[5].category_id
+    catalog = get_catalog()
+    facets = catalog.facets(catalog.match())
+
+    # Most common first
+    assert facets['brands'] == [
+        {'value': 'Orchard', 'count': 2}, {'value': 'Meadow', 'count': 1}, {'value': 'Tropic', 'count': 1}
+    ]
+    assert facets['categories'] == [
+        {'id': fruit, 'name': 'Fruit', 'count': 4}, {'id': dairy, 'name': 'Dairy', 'count': 1}
+    ]
+    assert [(facet['min'], facet['max'], facet['count']) for facet in facets['price']] == [
+        (0, 2, 2), (2, 5, 0), (5, 10, 1), (10, 20, 1), (20, 50, 1), (50, None, 0)
+    ]
+    assert facets['in_stock'] == {'in_stock': 4, 'out_of_stock': 1}
+    # Apple averages 4.5 stars, Banana and Date have no reviews
+    assert _counts(facets, 'rating', 'stars') == {5: 1, 4: 1, 3: 0, 2: 1, 1: 0, None: 2}
+
+
+def test_facets_follow_the_filters(app, faceted):
+    fruit = faceted[0].category_id
+    catalog = get_catalog()
+
+    facets = catalog.facets(catalog.match(category_id=fruit, in_stock_only=True))
+    assert _counts(facets, 'brands', 'value') == {'Orchard': 2}
+    assert _counts(facets, 'categories', 'name') == {'Fruit': 3}
+    assert [facet['count'] for facet in facets['price']] == [1, 0, 1, 1, 0, 0]
+    assert facets['in_stock'] == {'in_stock': 3, 'out_of_stock': 0}
+    assert _counts(facets, 'rating', 'stars') == {5: 0, 4: 1, 3: 0, 2: 1, 1: 0, None: 1}
+
+    facets = catalog.facets(catalog.match(['e'], brand='Orchard', min_rating=4))
+    assert (_counts(facets, 'brands', 'value'), facets['in_stock']) == ({'Orchard': 1}, {'in_stock': 1, 'out_of_stock': 0})
+
+    facets = catalog.facets(catalog.match(brand='Unknown'))
+    assert (facets['brands'], facets['categories'], facets['in_stock']) == ([], [], {'in_stock': 0, 'out_of_stock': 0})
+    assert sum(facet['count'] for facet in facets['price'] + facets['rating']) == 0
+
+    # /api/search returns the same counts for its filters
+    body = app.test_client().get('/api/search?q=e&brand=Orchard&per_page=1').get_json()
+    assert (body['pagination']['total'], _counts(body['facets'], 'brands', 'value')) == (2, {'Orchard': 2})
+    assert _counts(body['facets'], 'price', 'min') == {0: 1, 2: 0, 5: 1, 10: 0, 20: 0, 50: 0}
+
+def test_refresh_applies_changes_and_new_rows(app, products, make_product):
+    snapshot_catalog = get_catalog()
+    products[1].stock_quantity = 20
+    products[0].name = 'Apricot'
+    db.session.commit()
+    make_product('Fig', price=2.0)
+
+    app.extensions['catalog_snapshot'].refresh()
+    catalog = get_catalog()
+    assert catalog is not snapshot_catalog
+    assert _names(catalog.query()[0]) == ['Apricot', 'Banana', 'Cherry', 'Date', 'Fig']
+    assert _names(catalog.query(in_stock_only=True, max_price=1)[0]) == ['Banana']
+    # The old version is untouched for requests still using it
+    assert _names(snapshot_catalog.query()[0]) == ['Apple', 'Banana', 'Cherry', 'Date']
+
+
+def test_refresh_drops_deleted_products(app, products):
+    get_catalog()
+    db.session.delete(products[2])
+    db.session.execute(Product.__table__.delete().where(Product.id == products[3].id))
+    db.session.commit()
+
+    app.extensions['catalog_snapshot'].refresh()
+    catalog = get_catalog()
+    assert catalog.query() == (catalog.payloads[:2], 2)
+    assert _names(catalog.query()[0]) == ['Apple', 'Banana']
+    assert catalog.query(search='cherry')[1] == 0
+    assert 'cherry' not in catalog.vocabulary.counts
+
+
+def test_full_reload(app, products, monkeypatch):
+    get_catalog()
+    snapshot = app.extensions['catalog_snapshot']
+    fruit = db.session.get(Category, products[0].category_id)
+    fruit.name = 'Fresh fruit'
+    db.session.commit()
+
+    monkeypatch.setattr(catalog_snapshot, 'FULL_RELOAD_SECONDS', 0)
+    snapshot.refresh()
+    assert get_catalog().category_names[fruit.id] == 'Fresh fruit'
+    assert get_catalog().query()[1] == 4
+
+
+def test_refresh_thread_stops(app, products):
+    app.config['CATALOG_REFRESH_SECONDS'] = 0.01
+    get_catalog()
+    snapshot = app.extensions['catalog_snapshot']
+    products[1].stock_quantity = 5
+    db.session.commit()
+
+    deadline = time.monotonic() + 5
+    while not get_catalog().query(in_stock_only=True, max_price=1)[1] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert get_catalog().query(in_stock_only=True, max_price=1)[1] == 1
+
+    snapshot.stop()
+    assert not snapshot._thread.is_alive()
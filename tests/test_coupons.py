@@ -0,0 +1,77 @@
+import time
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+
+from extensions import db
+from models import Coupon, User
+from coupons import (
+    CouponCounterShard, CouponError, CouponRedemption, check_coupon, coupon_cache, coupon_usage,
+    redeem_coupon, shard_coupon,
+)
+
+
+@pytest.fixture
+def users(app):
+    users = [User(username=f'u{i}', email=f'u{i}@example.com', password_hash=generate_password_hash('x')) for i in range(6)]
+    db.session.add_all(users)
+    db.session.commit()
+    return users
+
+
+def _coupon(**kwargs):
+    coupon = Coupon(code=kwargs.pop('code', 'SAVE5'), discount_type='fixed', discount_value=5, **kwargs)
+    db.session.add(coupon)
+    db.session.commit()
+    return coupon_cache.get(coupon.code)
+
+
+def _redeem(definition, user):
+    """One checkout: claim inside a transaction, commit on success"""
+    try:
+        redeem_coupon(definition, user.id, None, 5)
+    except CouponError:
+        db.session.rollback()
+        return False
+    db.session.commit()
+    return True
+
+
+def test_usage_limit_is_never_exceeded(app, users):
+    definition = _coupon(usage_limit=2)
+    assert [_redeem(definition, user) for user in users[:3]] == [True, True, False]
+    assert coupon_usage(definition) == 2
+    with pytest.raises(CouponError):
+        check_coupon('save5', 50)
+
+
+def test_stale_unsharded_definition_claims_through_shards(app, users):
+    stale = _coupon(usage_limit=3)
+    assert _redeem(stale, users[0])
+    shard_coupon('SAVE5', 2)
+    # Another worker still holds the definition cached before sharding
+    coupon_cache._entries['SAVE5'] = (stale, time.monotonic())
+
+    results = [_redeem(stale, user) for user in users[1:5]]
+
+    assert results == [True, True, False, False]
+    assert coupon_usage(coupon_cache.get('SAVE5')) == 3
+    assert db.session.query(db.func.sum(CouponCounterShard.used_count)).scalar() == 3
+    assert db.session.query(Coupon.used_count).scalar() == 1
+
+
+def test_per_user_limit_numbers_each_use(app, users):
+    definition = _coupon(per_user_limit=2)
+    assert [_redeem(definition, users[0]) for _ in range(3)] == [True, True, False]
+    assert _redeem(definition, users[1])
+    assert sorted(r.use_number for r in CouponRedemption.query.filter_by(user_id=users[0].id)) == [1, 2]
+
+
+def test_use_numbers_are_unique_per_user(app, users):
+    definition = _coupon(per_user_limit=1)
+    # What a second checkout that counted before the first one committed would write
+    for _ in range(2):
+        db.session.add(CouponRedemption(coupon_id=definition.id, user_id=users[0].id, use_number=1))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from extensions import db
+from delivery_slots import (
+    DeliverySlot, DeliveryWindow, SlotError, SlotHold, availability_cache, book_slot, generate_slots,
+    hold_slot, release_expired_holds, store_now
+)
+
+
+@pytest.fixture
+def slot(app):
+    db.session.add(DeliveryWindow(name='Evening', start_time='23:58', end_time='23:59', capacity=2))
+    db.session.commit()
+    generate_slots(days=2, start=store_now().date() + timedelta(days=1))
+    availability_cache.invalidate()
+    return DeliverySlot.query.order_by(DeliverySlot.slot_date).first()
+
+
+def _expire_holds():
+    SlotHold.query.update({'expires_at': datetime.utcnow() - timedelta(minutes=1)})
+    db.session.commit()
+
+
+def test_claims_never_exceed_capacity(app, user, admin, slot):
+    hold_slot(slot.id, user.id)
+    book_slot(slot.id, admin.id)
+    db.session.commit()
+    with pytest.raises(SlotError):
+        book_slot(slot.id, admin.id)
+    db.session.rollback()
+
+    db.session.refresh(slot)
+    assert (slot.reserved_count, slot.booked_count) == (2, 1)
+
+
+def test_hold_converts_into_booking(app, user, slot):
+    hold_id, _ = hold_slot(slot.id, user.id)
+    book_slot(slot.id, user.id, hold_id)
+    db.session.commit()
+
+    db.session.refresh(slot)
+    assert (slot.reserved_count, slot.booked_count) == (1, 1)
+    assert SlotHold.query.count() == 0
+
+
+def test_expired_holds_are_taken_back_on_claim(app, user, admin, slot):
+    hold_slot(slot.id, user.id)
+    hold_slot(slot.id, admin.id)
+    _expire_holds()
+
+    book_slot(slot.id, admin.id)
+    db.session.commit()
+    db.session.refresh(slot)
+    assert (slot.reserved_count, slot.booked_count) == (1, 1)
+    assert SlotHold.query.count() == 0
+
+
+def test_release_expired_holds(app, user, slot):
+    hold_slot(slot.id, user.id)
+    _expire_holds()
+    assert release_expired_holds() == 1
+    db.session.refresh(slot)
+    assert slot.reserved_count == 0
+
+
+def test_availability_endpoint_is_read_only(app, user, admin, slot):
+    hold_slot(slot.id, user.id)
+    hold_slot(slot.id, admin.id)
+    _expire_holds()
+    db.session.add(DeliveryWindow(name='Morning', start_time='09:00', end_time='10:00', capacity=5))
+    db.session.commit()
+
+    days = app.test_client().get('/api/delivery-slots?days=7').get_json()
+    assert [s['available'] for day in days for s in day['slots'] if s['slot_id'] == slot.id] == [2]
+    # No slots generated for the new window and the expired holds are still there
+    assert DeliverySlot.query.count() == 2
+    assert SlotHold.query.count() == 2
@@ -0,0 +1,79 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import dispatch
+from extensions import db
+from models import Order, User
+from dispatch import DeliveryRun, DeliveryRunStop, DispatchError, _store_runs, batch_routes
+from conftest import login
+
+DAY = date.today() + timedelta(days=1)
+
+
+@pytest.fixture
+def matrix(app, tmp_path):
+    path = tmp_path / 'distances.csv'
+    path.write_text(
+        'from_postal_code,to_postal_code,distance\n'
+        'DEPOT,A,1\nDEPOT,B,2\nDEPOT,C,3\nA,B,1\nA,C,2\nB,C,1\n'
+    )
+    app.config['DISPATCH_DISTANCE_MATRIX'] = str(path)
+    return path
+
+
+def _orders(user, postal_codes, slot='18:00-20:00'):
+    ids = []
+    for code in postal_codes:
+        customer = User(username=f'c{len(ids)}{code}', email=f'{code}{len(ids)}@example.com',
+                        password_hash='x', postal_code=code)
+        db.session.add(customer)
+        db.session.flush()
+        order = Order(user_id=customer.id, total_amount=1, status='confirmed', delivery_time_slot=slot,
+                      delivery_date=datetime.combine(DAY, datetime.min.time()) + timedelta(hours=18))
+        db.session.add(order)
+        db.session.flush()
+        ids.append(order.id)
+    db.session.commit()
+    return ids
+
+
+def test_batches_orders_into_numbered_runs(app, user, matrix):
+    first = _orders(user, ['C', 'A', 'B'])
+    runs = batch_routes(DAY, max_stops=2, time_budget=1, workers=1)
+    assert [run['run_number'] for run in runs] == [f"RUN{DAY:%Y%m%d}-001", f"RUN{DAY:%Y%m%d}-002"]
+    assert sorted(order_id for run in runs for order_id in run['stops']) == sorted(first)
+
+    # A later batch continues after the highest number, even with gaps
+    DeliveryRun.query.filter_by(run_number=f"RUN{DAY:%Y%m%d}-001").update({'run_number': f"RUN{DAY:%Y%m%d}-007"})
+    db.session.commit()
+    second = _orders(user, ['A'], slot='20:00-22:00')
+    runs = batch_routes(DAY, max_stops=2, time_budget=1, workers=1)
+    assert [(run['run_number'], run['stops']) for run in runs] == [(f"RUN{DAY:%Y%m%d}-008", second)]
+
+
+def test_batch_racing_for_the_same_orders_is_rejected(app, user, matrix):
+    order_id, = _orders(user, ['A'])
+    plan = [[([order_id], 2.0)]]
+    _store_runs(DAY, ['18:00-20:00'], plan)
+    # A second batch planned from the same unassigned orders before the first was stored
+    with pytest.raises(DispatchError):
+        _store_runs(DAY, ['18:00-20:00'], plan)
+    assert DeliveryRun.query.count() == 1
+    assert DeliveryRunStop.query.count() == 1
+
+
+def test_endpoint_plans_in_the_request_within_the_budget(app, admin, user, matrix, monkeypatch):
+    _orders(user, ['A', 'B', 'C'])
+
+    def no_pool(*args, **kwargs):
+        raise AssertionError('no worker processes from a request')
+    monkeypatch.setattr(dispatch, 'ProcessPoolExecutor', no_pool)
+
+    client = login(app.test_client(), admin)
+    response = client.post('/api/admin/dispatch/batch', json={'date': DAY.isoformat(), 'time_budget': 600})
+    assert response.status_code == 200
+    assert sum(run['stop_count'] for run in response.get_json()['runs']) == 3
+
+    response = client.post('/api/admin/dispatch/batch', json={'date': DAY.isoformat(), 'max_stops': 'many'})
+    assert response.status_code == 400
@@ -0,0 +1,78 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime
+
+import pytest
+
+import exports
+from extensions import db
+from models import Order, OrderItem, SearchLog
+from exports import generate_export
+from conftest import login
+
+
+@pytest.fixture
+def small_pages(monkeypatch):
+    # Tiny fetch and flush sizes, so paging and chunking are exercised on a few rows
+    monkeypatch.setattr(exports, 'FETCH_SIZE', 2)
+    monkeypatch.setattr(exports, 'FLUSH_SIZE', 64)
+
+
+@pytest.fixture
+def orders(app, user, make_product, small_pages):
+    apple, pear = make_product('Apple'), make_product('Pear')
+    for day, products in ((1, [apple, pear]), (2, [apple]), (3, []), (10, [pear])):
+        order = Order(order_number=f'ORD-{day}', user_id=user.id, total_amount=2.0 * len(products),
+                      created_at=datetime(2024, 5, day, 9, 30))
+        db.session.add(order)
+        db.session.flush()
+        for product in products:
+            db.session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=1, price=2.0, total=2.0))
+    db.session.commit()
+    return apple, pear
+
+
+def test_csv_export_has_one_row_per_order_line(orders):
+    apple, pear = orders
+    chunks = list(generate_export('orders', 'csv', start=datetime(2024, 5, 1), end=datetime(2024, 5, 10)))
+    assert len(chunks) > 1
+
+    rows = list(csv.DictReader(io.StringIO(b''.join(chunks).decode('utf-8'))))
+    assert [(row['order_number'], row['product_id']) for row in rows] == [
+        ('ORD-1', str(apple.id)), ('ORD-1', str(pear.id)), ('ORD-2', str(apple.id)), ('ORD-3', '')
+    ]
+    assert rows[0]['created_at'] == '2024-05-01T09:30:00'
+    assert rows[0]['line_total'] == '2.0'
+
+
+def test_jsonl_export(app, user, small_pages):
+    for i in range(5):
+        db.session.add(SearchLog(user_id=user.id, query=f'apple {i}', results_count=i,
+                                 created_at=datetime(2024, 5, 1, 12, i)))
+    db.session.commit()
+
+    chunks = list(generate_export('search-logs', 'jsonl'))
+    assert len(chunks) > 1
+    records = [json.loads(line) for line in b''.join(chunks).decode('utf-8').splitlines()]
+    assert [(record['query'], record['results_count']) for record in records] == [(f'apple {i}', i) for i in range(5)]
+    assert records[4]['created_at'] == '2024-05-01T12:04:00'
+    assert records[0]['user_id'] == user.id
+
+
+def test_gzip_export_endpoint(app, admin, orders):
+    response = login(app.test_client(), admin).get('/api/admin/exports/orders?format=jsonl&gzip=true')
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.mimetype == 'application/x-ndjson'
+
+    records = [json.loads(line) for line in gzip.decompress(response.data).decode('utf-8').splitlines()]
+    assert [record['order_number'] for record in records] == ['ORD-1', 'ORD-1', 'ORD-2', 'ORD-3', 'ORD-10']
+
+
+def test_export_rejects_unknown_kind_and_format(app, admin):
+    client = login(app.test_client(), admin)
+    assert client.get('/api/admin/exports/users').status_code == 404
+    assert client.get('/api/admin/exports/orders?format=xml').status_code == 400
+    assert client.get('/api/admin/exports/orders?start=yesterday').status_code == 400
@@ -0,0 +1,69 @@
+from datetime import datetime
+
+from fuzzy_search import FuzzyDictionary, edit_distance
+from catalog_snapshot import Catalog
+
+
+def _row(product_id, name, description='', brand=None):
+    return (product_id, name, description, 2.0, None, None, 10, 'each', brand, 1, False, True,
+            datetime(2024, 1, 1), None, 0, None, None)
+
+
+def test_lookup_corrects_misspelt_terms():
+    dictionary = FuzzyDictionary.from_texts(['Organic bananas', 'Banana bread', 'Strawberry jam', 'Strawberry yogurt'])
+    assert dictionary.lookup('bananna') == 'banana'
+    assert dictionary.lookup('strawbery') == 'strawberry'
+    assert dictionary.lookup('xylophone') is None
+    # Known words and prefixes are left to the substring search
+    assert dictionary.correct(['Straw', 'orgnic', 'jam']) == ['straw', 'organic', 'jam']
+    assert edit_distance('bread', 'beard', 2) == 2
+
+
+def test_copy_leaves_the_original_unchanged():
+    dictionary = FuzzyDictionary.from_texts(['tomato soup'])
+    postings = {key: list(words) for key, words in dictionary.index.items()}
+
+    copy = dictionary.copy()
+    copy.add_text('tomatillo salsa soup')
+    assert copy.lookup('tomatilo') == 'tomatillo'
+    assert copy.lookup('salsaa') == 'salsa'
+    assert copy.counts['soup'] == 2
+
+    assert dictionary.lookup('tomatilo') == 'tomato'
+    assert dictionary.lookup('salsaa') is None
+    assert dictionary.counts == {'tomato': 1, 'soup': 1}
+    assert {key: list(words) for key, words in dictionary.index.items()} == postings
+
+
+def test_catalog_versions_keep_their_own_vocabulary():
+    old = Catalog([_row(1, 'Cheddar cheese')], {1: 'Dairy'}, {})
+    new = old.with_changes([_row(2, 'Mozzarella')], {1: 'Dairy'}, {})
+    assert new.vocabulary.correct(['mozarella']) == ['mozzarella']
+    assert old.vocabulary.correct(['mozarella']) == ['mozarella']
+    assert old.vocabulary.correct(['chedar']) == new.vocabulary.correct(['chedar']) == ['cheddar']
+
+
+def test_catalog_word_counts_follow_text_changes_only():
+    catalog = Catalog([_row(1, 'Banana'), _row(2, 'Banana bread')], {1: 'Dairy'}, {})
+    vocabulary = catalog.vocabulary
+    for stock in range(9, 4, -1):
+        restocked = _row(1, 'Banana')[:6] + (stock,) + _row(1, 'Banana')[7:]
+        catalog = catalog.with_changes([restocked], {1: 'Dairy'}, {})
+    assert catalog.vocabulary is vocabulary
+    assert catalog.vocabulary.counts == {'banana': 2, 'bread': 1}
+
+    renamed = catalog.with_changes([_row(2, 'Plantain chips')], {1: 'Dairy'}, {})
+    assert renamed.vocabulary.counts == {'banana': 1, 'plantain': 1, 'chips': 1}
+    assert renamed.vocabulary.lookup('breadd') is None
+    assert renamed.vocabulary.lookup('plantian') == 'plantain'
+    assert catalog.vocabulary.counts == {'banana': 2, 'bread': 1}
+    assert catalog.vocabulary.lookup('breadd') == 'bread'
+
+
+def test_removed_words_leave_the_copy_only():
+    dictionary = FuzzyDictionary.from_texts(['cheddar cheese', 'goat cheese'])
+    copy = dictionary.copy()
+    copy.remove_text('cheddar cheese')
+    assert copy.counts == {'cheese': 1, 'goat': 1}
+    assert copy.lookup('chedar') is None
+    assert dictionary.lookup('chedar') == 'cheddar'
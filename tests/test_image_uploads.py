@@ -0,0 +1,46 @@
+import io
+
+from PIL import Image
+
+from extensions import db
+from image_uploads import ImageAsset, init_image_pool
+from conftest import login
+
+
+def _png(size=(640, 480)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def test_upload_renders_variants_inline(app, admin, make_product):
+    product = make_product('Apple')
+    client = login(app.test_client(), admin)
+    response = client.post(f'/api/admin/products/{product.id}/image', data=_png(), content_type='image/png')
+    assert response.status_code == 200
+    assert response.get_json()['variants']['thumb']['width'] == 200
+
+    db.session.refresh(product)
+    assert product.thumbnail_url.endswith('-thumb.webp')
+
+    # The same bytes again reuse the stored asset
+    other = make_product('Pear')
+    response = client.post(f'/api/admin/products/{other.id}/image', data=_png(), content_type='image/png')
+    assert response.get_json()['asset_id'] == ImageAsset.query.one().id
+
+
+def test_pool_is_created_at_startup_with_spawn(app, admin, make_product):
+    app.config['IMAGE_WORKERS'] = 1
+    init_image_pool(app)
+    pool = app.extensions['image_pool']
+    assert pool._mp_context.get_start_method() == 'spawn'
+
+    product = make_product('Apple')
+    client = login(app.test_client(), admin)
+    response = client.post(f'/api/admin/products/{product.id}/image', data=_png(), content_type='image/png')
+    assert response.status_code == 202
+    pool.shutdown(wait=True)  # waits for the worker and the completion callback
+
+    db.session.expire_all()
+    assert ImageAsset.query.one().status == 'ready'
+    assert db.session.get(type(product), product.id).thumbnail_url.endswith('-thumb.webp')
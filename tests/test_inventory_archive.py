@@ -0,0 +1,23 @@
+from datetime import datetime
+
+from extensions import db
+from models import InventoryLog
+from inventory_archive import InventoryLogDaily, compact_inventory_log
+
+
+def test_rows_from_interleaved_months_are_all_archived(app, make_product, tmp_path):
+    apple = make_product('Apple')
+    # Ids do not follow created_at, e.g. back-dated adjustments
+    for created_at in (datetime(2024, 1, 5), datetime(2024, 2, 3), datetime(2024, 1, 20), datetime(2024, 3, 1)):
+        db.session.add(InventoryLog(
+            product_id=apple.id, change_type='sale', quantity_change=-1,
+            previous_quantity=10, new_quantity=9, created_at=created_at
+        ))
+    db.session.commit()
+
+    stats = compact_inventory_log(retention_days=30, archive_folder=str(tmp_path / 'archive'), chunk_size=2)
+
+    assert stats['rows'] == 4
+    assert InventoryLog.query.count() == 0
+    assert sorted(p.name for p in (tmp_path / 'archive').iterdir()) == ['2024-01', '2024-02', '2024-03']
+    assert db.session.query(db.func.sum(InventoryLogDaily.entries)).scalar() == 4
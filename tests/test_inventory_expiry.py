@@ -0,0 +1,68 @@
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from extensions import db
+from models import InventoryLog, Product
+from inventory_expiry import MAX_PER_PAGE, sweep_expired
+from conftest import login
+
+TODAY = date(2024, 5, 10)
+
+
+@pytest.fixture
+def stock(app, make_product):
+    return [
+        make_product('Milk', stock=6, expiry_date=TODAY - timedelta(days=1)),
+        make_product('Yogurt', stock=4, expiry_date=TODAY - timedelta(days=3)),
+        make_product('Cheese', stock=9, expiry_date=TODAY),
+        make_product('Bread', stock=0, expiry_date=TODAY - timedelta(days=2)),
+    ]
+
+
+def test_sweep_writes_off_expired_stock(app, stock):
+    assert sweep_expired(TODAY, dry_run=True) == {'products': 2, 'units': 10}
+    assert sweep_expired(TODAY) == {'products': 2, 'units': 10}
+
+    assert [product.stock_quantity for product in Product.query.order_by(Product.id)] == [0, 0, 9, 0]
+    logs = InventoryLog.query.order_by(InventoryLog.product_id).all()
+    assert [(log.product_id, log.quantity_change, log.previous_quantity) for log in logs] == [
+        (stock[0].id, -6, 6), (stock[1].id, -4, 4)
+    ]
+    assert sweep_expired(TODAY) == {'products': 0, 'units': 0}
+
+
+@pytest.mark.parametrize('returning', [True, False])
+def test_changes_between_read_and_write_are_kept(app, stock, monkeypatch, returning):
+    monkeypatch.setattr(db.engine.dialect, 'update_returning', returning)
+    milk, yogurt = stock[0].id, stock[1].id
+    raced = []
+
+    # Milk is restocked with a new batch and a yogurt is sold after the sweep read them
+    def restock(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE product SET stock_quantity') and not raced:
+            raced.append(True)
+            cursor.execute('UPDATE product SET stock_quantity = 30, expiry_date = ? WHERE id = ?',
+                           ((TODAY + timedelta(days=7)).isoformat(), milk))
+            cursor.execute('UPDATE product SET stock_quantity = 3 WHERE id = ?', (yogurt,))
+
+    event.listen(db.engine, 'before_cursor_execute', restock)
+    try:
+        assert sweep_expired(TODAY) == {'products': 0, 'units': 0}
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', restock)
+
+    db.session.expire_all()
+    assert (db.session.get(Product, milk).stock_quantity, db.session.get(Product, yogurt).stock_quantity) == (30, 3)
+    assert InventoryLog.query.count() == 0
+    # The yogurt is still expired and goes on the next sweep, with the stock it has now
+    assert sweep_expired(TODAY) == {'products': 1, 'units': 3}
+
+
+def test_expiring_report_caps_page_size(app, admin, stock):
+    client = login(app.test_client(), admin)
+    body = client.get('/api/admin/inventory/expiring?days=3650&per_page=100000').get_json()
+    assert body['pagination']['per_page'] == MAX_PER_PAGE
+    assert [product['name'] for product in body['products']] == ['Yogurt', 'Milk', 'Cheese']
+    assert client.get('/api/admin/inventory/expiring?per_page=0').status_code == 200
@@ -0,0 +1,37 @@
+from extensions import db
+from models import Product
+from low_stock import LowStockItem, LowStockCount, low_stock_count, sync_low_stock
+
+
+def test_counter_follows_orm_and_bulk_writes(app, make_product):
+    apple = make_product('Apple', stock=2, min_stock_level=5)
+    pear = make_product('Pear', stock=20, min_stock_level=5)
+    assert low_stock_count() == 1
+
+    pear.stock_quantity = 1
+    db.session.commit()
+    assert low_stock_count() == 2
+
+    table = Product.__table__
+    db.session.execute(table.update().where(table.c.id == apple.id).values(stock_quantity=50))
+    sync_low_stock([apple.id])
+    db.session.commit()
+    assert low_stock_count() == 1
+
+    db.session.delete(pear)
+    db.session.commit()
+    assert low_stock_count() == 0
+    assert db.session.get(LowStockCount, 1).count == LowStockItem.query.count()
+
+
+def test_tables_are_filled_when_created(app, make_product):
+    make_product('Apple', stock=0, min_stock_level=3)
+    make_product('Pear', stock=1, min_stock_level=3)
+    make_product('Plum', stock=9, min_stock_level=3)
+    LowStockCount.__table__.drop(db.engine)
+    LowStockItem.__table__.drop(db.engine)
+
+    LowStockItem.__table__.create(db.engine)
+
+    assert LowStockItem.query.count() == 2
+    assert low_stock_count() == 2
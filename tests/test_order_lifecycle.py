@@ -0,0 +1,75 @@
+import pytest
+from sqlalchemy import event
+
+import email_templates
+from extensions import db
+from models import Order
+from order_lifecycle import (
+    MAX_NOTIFICATION_ATTEMPTS, OrderNotification, OrderStatusHistory, TransitionError, send_pending_notifications,
+    transition_orders
+)
+
+
+@pytest.fixture
+def orders(app, user):
+    orders = [Order(user_id=user.id, total_amount=1, status=status) for status in ('pending', 'pending', 'shipped')]
+    db.session.add_all(orders)
+    db.session.commit()
+    return [order.id for order in orders]
+
+
+def test_only_allowed_transitions_are_applied(app, orders):
+    updated, rejected = transition_orders(orders, 'confirmed')
+    assert sorted(updated) == orders[:2]
+    assert rejected == {orders[2]: 'shipped'}
+    assert [entry.order_id for entry in OrderStatusHistory.query.order_by(OrderStatusHistory.order_id)] == orders[:2]
+    assert OrderNotification.query.count() == 2
+
+    with pytest.raises(TransitionError):
+        transition_orders(orders, 'lost')
+
+
+@pytest.mark.parametrize('returning', [True, False])
+def test_orders_changed_concurrently_are_not_recorded(app, orders, monkeypatch, returning):
+    monkeypatch.setattr(db.engine.dialect, 'update_returning', returning)
+    first = orders[0]
+    raced = []
+
+    # Another worker cancels an order between the status read and the guarded UPDATE
+    def cancel_first(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE "order" SET status') and not raced:
+            raced.append(first)
+            cursor.execute('UPDATE "order" SET status = ? WHERE id = ?', ('cancelled', first))
+
+    event.listen(db.engine, 'before_cursor_execute', cancel_first)
+    try:
+        updated, rejected = transition_orders(orders[:2], 'confirmed')
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', cancel_first)
+    assert updated == [orders[1]]
+    assert rejected == {first: 'cancelled'}
+    assert [entry.order_id for entry in OrderStatusHistory.query] == [orders[1]]
+    assert [notification.order_id for notification in OrderNotification.query] == [orders[1]]
+
+
+def test_failed_emails_stay_queued_and_are_retried(app, orders, monkeypatch):
+    transition_orders(orders[:2], 'confirmed')
+    failing = {orders[0]}
+    monkeypatch.setattr(email_templates, 'send_email', lambda to, subject, template, **kwargs: (
+        kwargs['order']['id'] not in failing
+    ))
+
+    assert send_pending_notifications() == 1
+    unsent = OrderNotification.query.filter(OrderNotification.sent_at.is_(None)).one()
+    assert (unsent.order_id, unsent.attempts) == (orders[0], 1)
+
+    for _ in range(MAX_NOTIFICATION_ATTEMPTS):
+        send_pending_notifications()
+    db.session.refresh(unsent)
+    assert (unsent.sent_at, unsent.attempts) == (None, MAX_NOTIFICATION_ATTEMPTS)
+
+    failing.clear()
+    unsent.attempts = 0
+    db.session.commit()
+    assert send_pending_notifications() == 1
+    assert OrderNotification.query.filter(OrderNotification.sent_at.is_(None)).count() == 0
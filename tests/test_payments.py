@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+import pytest
+import stripe
+
+import payments
+from extensions import db
+from payments import PaymentIntentRecord, PaymentUnavailable, close_payment_intent, payment_intent_for_cart
+
+ITEMS = [{'product_id': 1, 'quantity': 2, 'price': 2.5}]
+
+
+class FakeIntents:
+    """The payment_intents service of a Stripe client, keeping intents in memory"""
+
+    def __init__(self):
+        self.intents = {}
+        self.calls = []
+        self.fail = False
+
+    def _call(self, name):
+        self.calls.append(name)
+        if self.fail:
+            raise stripe.APIConnectionError('connection refused')
+
+    def create(self, params, options):
+        self._call('create')
+        intent_id = f'pi_{len(self.intents) + 1}'
+        self.intents[intent_id] = SimpleNamespace(
+            id=intent_id, client_secret=f'{intent_id}_secret', status='requires_payment_method', amount=params['amount']
+        )
+        return self.intents[intent_id]
+
+    def update(self, intent_id, params, options):
+        self._call('update')
+        self.intents[intent_id].amount = params['amount']
+        return self.intents[intent_id]
+
+    def retrieve(self, intent_id):
+        self._call('retrieve')
+        return self.intents[intent_id]
+
+
+@pytest.fixture
+def intents(app, monkeypatch):
+    intents = FakeIntents()
+    client = SimpleNamespace(v1=SimpleNamespace(payment_intents=intents))
+    monkeypatch.setattr(payments, 'get_stripe_client', lambda: client)
+    return intents
+
+
+def test_same_cart_reuses_the_open_intent(app, user, intents):
+    first = payment_intent_for_cart(user.id, ITEMS, 500)
+    again = payment_intent_for_cart(user.id, ITEMS, 500)
+    assert again.stripe_intent_id == first.stripe_intent_id
+    assert intents.calls == ['create', 'retrieve']
+
+    changed = payment_intent_for_cart(user.id, ITEMS + [{'product_id': 2, 'quantity': 1, 'price': 1.0}], 600)
+    assert changed.stripe_intent_id == first.stripe_intent_id
+    assert intents.intents[first.stripe_intent_id].amount == 600
+
+
+def test_intent_paid_on_stripe_is_not_reused(app, user, intents):
+    first = payment_intent_for_cart(user.id, ITEMS, 500)
+    # Paid from another tab; no order was placed, so the local record still looks open
+    intents.intents[first.stripe_intent_id].status = 'succeeded'
+
+    second = payment_intent_for_cart(user.id, ITEMS, 500)
+    assert second.stripe_intent_id != first.stripe_intent_id
+    assert db.session.get(PaymentIntentRecord, first.id).status == 'succeeded'
+
+
+def test_closed_intents_start_a_new_one(app, user, intents):
+    first = payment_intent_for_cart(user.id, ITEMS, 500)
+    close_payment_intent(user.id, first.stripe_intent_id)
+    db.session.commit()
+    assert payment_intent_for_cart(user.id, ITEMS, 500).stripe_intent_id != first.stripe_intent_id
+
+
+def test_stripe_outage_is_reported_not_reused(app, user, intents):
+    payment_intent_for_cart(user.id, ITEMS, 500)
+    intents.fail = True
+    with pytest.raises(PaymentUnavailable):
+        payment_intent_for_cart(user.id, ITEMS, 500)
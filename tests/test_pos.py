@@ -0,0 +1,80 @@
+from extensions import db
+from models import Product, Order, InventoryLog
+from pos import barcode_index
+
+from conftest import login
+
+
+def _reprice_elsewhere(product_id, **values):
+    # A Core update, as made by another worker or an import: no ORM events fire here
+    table = Product.__table__
+    db.session.execute(table.update().where(table.c.id == product_id).values(**values))
+    db.session.commit()
+
+
+def test_sale_charges_current_database_price(app, admin, make_product):
+    apple = make_product('Apple', price=2.0, barcode='111')
+    barcode_index.warm()
+    _reprice_elsewhere(apple.id, price=3.0)
+    assert barcode_index._entries['111']['price'] == 2.0
+
+    response = login(app.test_client(), admin).post('/api/pos/sale', json={
+        'items': [{'barcode': '111', 'quantity': 2}, {'barcode': '111'}]
+    })
+
+    assert response.status_code == 200
+    assert response.json['subtotal'] == 9.0
+    assert response.json['item_count'] == 3
+    assert db.session.get(Product, apple.id).stock_quantity == 7
+    log = InventoryLog.query.filter_by(product_id=apple.id).one()
+    assert (log.previous_quantity, log.new_quantity) == (10, 7)
+    assert barcode_index._entries['111']['price'] == 3.0
+    assert barcode_index._entries['111']['stock_quantity'] == 7
+
+
+def test_sale_rejects_product_made_unavailable_elsewhere(app, admin, make_product):
+    pear = make_product('Pear', barcode='222')
+    barcode_index.warm()
+    _reprice_elsewhere(pear.id, is_available=False)
+
+    response = login(app.test_client(), admin).post('/api/pos/sale', json={'items': [{'barcode': '222'}]})
+
+    assert response.status_code == 400
+    assert response.json['barcodes'] == ['222']
+    assert Order.query.count() == 0
+
+
+def test_sale_rejects_bad_quantity(app, admin, make_product):
+    make_product('Plum', barcode='333')
+    client = login(app.test_client(), admin)
+
+    for quantity in ('two', None, 0):
+        response = client.post('/api/pos/sale', json={'items': [{'barcode': '333', 'quantity': quantity}]})
+        assert response.status_code == 400
+    assert Order.query.count() == 0
+
+
+def test_scan_picks_up_changes_from_other_workers(app, admin, make_product):
+    app.config['POS_INDEX_REFRESH_SECONDS'] = 0
+    kiwi = make_product('Kiwi', price=1.0, barcode='444')
+    barcode_index.warm()
+    _reprice_elsewhere(kiwi.id, price=1.5, original_price=2.0)
+
+    response = login(app.test_client(), admin).get('/api/pos/scan/444')
+
+    assert response.json['price'] == 1.5
+    assert response.json['promo'] == {'original_price': 2.0, 'savings': 0.5}
+
+
+def test_batch_scan_validates_barcodes(app, admin, make_product):
+    make_product('Fig', barcode='555')
+    client = login(app.test_client(), admin)
+
+    assert client.post('/api/pos/scan').status_code == 400
+    for body in ({}, [], {'barcodes': '555'}, {'barcodes': 555}, {'barcodes': [555]}, {'barcodes': [['555']]}):
+        assert client.post('/api/pos/scan', json=body).status_code == 400, body
+
+    response = client.post('/api/pos/scan', json={'barcodes': ['555', '999']})
+    assert response.status_code == 200
+    assert list(response.json['items']) == ['555']
+    assert response.json['unknown'] == ['999']
@@ -0,0 +1,47 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from extensions import db
+from promotions import CompiledPromotions, Promotion, price_cart, promotion_cache
+
+LINES = [{'product_id': 1, 'category_id': 1, 'price': 10.0, 'quantity': 6}]
+
+
+def test_malformed_tiers_are_rejected_on_save():
+    with pytest.raises(ValueError):
+        Promotion(name='Spend more', promo_type='tiered_spend', tiers=json.dumps([{'discount': 5}]))
+    with pytest.raises(ValueError):
+        Promotion(name='Bundle', promo_type='bundle', bundle_product_ids='{"a": 1}')
+
+
+def test_bad_rule_is_skipped_not_fatal(app):
+    db.session.add(Promotion(name='10% off', promo_type='percent_off', product_id=1, percent=10))
+    db.session.commit()
+    # Written around the model, e.g. by hand in SQL
+    db.session.execute(Promotion.__table__.insert().values(
+        name='Broken', promo_type='tiered_spend', tiers='[{"discount": 5}]', is_active=True
+    ))
+    db.session.commit()
+    promotion_cache.invalidate()
+
+    assert price_cart(LINES)['discount'] == 6.0
+    assert [rule_id for rule_id, _ in promotion_cache.get().skipped] == [2]
+
+
+def test_time_window_is_checked_when_pricing():
+    now = datetime(2026, 5, 1, 12, 0)
+    starts_soon = Promotion(id=1, name='Flash sale', promo_type='percent_off', product_id=1, percent=50,
+                            is_active=True, valid_from=now + timedelta(seconds=30))
+    always = Promotion(id=2, name='Everyday', promo_type='percent_off', product_id=1, percent=10, is_active=True)
+    ends_soon = Promotion(id=3, name='Spend 50', promo_type='tiered_spend', is_active=True,
+                          tiers=json.dumps([{'min_spend': 20, 'discount': 5}]), valid_until=now + timedelta(seconds=30))
+    compiled = CompiledPromotions([starts_soon, always, ends_soon], now=now)
+
+    before = compiled.price(LINES, now=now)
+    after = compiled.price(LINES, now=now + timedelta(minutes=1))
+
+    assert [a['promotion_id'] for a in before['applied']] == [2, 3]
+    assert [a['promotion_id'] for a in after['applied']] == [1]
+    assert after['discount'] == 30.0
@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+
+import recommendations
+from extensions import db
+from models import Order, OrderItem
+from recommendations import KEEP_VERSIONS, build_recommendations, update_recommendations, load_index, write_index
+
+
+def _order(user, products, payment_status):
+    order = Order(user_id=user.id, total_amount=1, payment_status=payment_status)
+    db.session.add(order)
+    db.session.flush()
+    for product in products:
+        db.session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=1, price=1, total=1))
+    db.session.commit()
+    return order
+
+
+def _neighbors(folder, product):
+    _, product_ids, neighbors, _ = load_index(str(folder))
+    row = list(product_ids).index(product.id)
+    return [int(n) for n in neighbors[row] if n >= 0]
+
+
+def test_order_paid_after_later_orders_is_folded_in(app, user, make_product, tmp_path):
+    folder = tmp_path / 'recommendations'
+    bread, butter, jam = make_product('Bread'), make_product('Butter'), make_product('Jam')
+    late = _order(user, [bread, jam], 'pending')
+    _order(user, [bread, butter], 'paid')
+
+    manifest = build_recommendations(folder=str(folder))
+    assert manifest['unpaid_order_ids'] == [late.id]
+    assert _neighbors(folder, bread) == [butter.id]
+
+    late.payment_status = 'paid'
+    db.session.commit()
+    manifest = update_recommendations(folder=str(folder))
+
+    assert manifest['unpaid_order_ids'] == []
+    assert sorted(_neighbors(folder, bread)) == sorted([butter.id, jam.id])
+    assert update_recommendations(folder=str(folder))['version'] == manifest['version']
+
+
+def test_builds_in_the_same_millisecond_get_their_own_versions(tmp_path, monkeypatch):
+    folder = str(tmp_path / 'recommendations')
+    monkeypatch.setattr(recommendations.time, 'time', lambda: 1700000000.0)
+    product_ids = np.array([1, 2])
+
+    versions = []
+    for neighbor in range(KEEP_VERSIONS + 1):
+        neighbors = np.array([[2], [neighbor]])
+        versions.append(write_index(product_ids, neighbors, np.ones((2, 1)), neighbor, folder=folder)['version'])
+
+    assert len(set(versions)) == len(versions)
+    manifest, _, neighbors, _ = load_index(folder)
+    assert manifest['version'] == versions[-1]
+    assert int(neighbors[1][0]) == KEEP_VERSIONS
+    # Only finished versions and the manifest are left behind
+    assert len([name for name in os.listdir(folder) if name.startswith('v')]) == KEEP_VERSIONS
+    assert sorted(name for name in os.listdir(folder) if not name.startswith('v')) == ['current.json']
@@ -0,0 +1,39 @@
+from datetime import date, datetime, timedelta
+
+from extensions import db
+from models import CartItem, InventoryLog, Order, OrderItem
+from reorder import load_daily_sales
+
+from conftest import login
+
+
+def test_web_orders_count_as_demand(app, user, make_product):
+    apple = make_product('Apple', stock=20)
+    client = login(app.test_client(), user)
+    db.session.add(CartItem(user_id=user.id, product_id=apple.id, quantity=3))
+    db.session.commit()
+
+    assert client.post('/api/orders', json={'delivery_address': '1 Main St'}).status_code == 200
+
+    products, days, quantities = load_daily_sales(date.today() - timedelta(days=10))
+    assert products.tolist() == [apple.id]
+    assert days.tolist() == [10]
+    assert quantities.tolist() == [3.0]
+    log = InventoryLog.query.filter_by(product_id=apple.id).one()
+    assert (log.change_type, log.previous_quantity, log.new_quantity) == ('sale', 20, 17)
+
+
+def test_cancelled_and_refunded_orders_are_not_demand(app, user, make_product):
+    apple = make_product('Apple')
+    yesterday = datetime.utcnow() - timedelta(days=1)
+    for status, payment_status, quantity in (
+        ('delivered', 'paid', 2), ('pending', 'pending', 1), ('cancelled', 'paid', 5), ('delivered', 'refunded', 7)
+    ):
+        order = Order(user_id=user.id, total_amount=1, status=status, payment_status=payment_status, created_at=yesterday)
+        db.session.add(order)
+        db.session.flush()
+        db.session.add(OrderItem(order_id=order.id, product_id=apple.id, quantity=quantity, price=1, total=quantity))
+    db.session.commit()
+
+    _, _, quantities = load_daily_sales(date.today() - timedelta(days=10))
+    assert quantities.tolist() == [3.0]
@@ -0,0 +1,68 @@
+import pytest
+from flask import jsonify
+
+from app import create_app
+from extensions import db
+from models import Category
+from replicas import read_only
+from conftest import TestConfig
+
+
+@pytest.fixture
+def replicated(tmp_path, monkeypatch):
+    # Two local SQLite files: the primary and one replica holding different rows
+    monkeypatch.chdir(tmp_path)
+
+    class AppConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'primary.db'}"
+        SQLALCHEMY_REPLICA_URIS = [f"sqlite:///{tmp_path / 'replica.db'}"]
+
+    app = create_app(AppConfig)
+
+    @app.route('/test/write-then-read', methods=['POST'])
+    @read_only
+    def write_then_read():
+        db.session.add(Category(name='Bakery'))
+        db.session.flush()
+        return jsonify(sorted(category.name for category in Category.query))
+
+    replica = app.extensions['replicas'].replicas[0]
+    with app.app_context():
+        db.create_all()
+        db.metadata.create_all(replica.engine)
+        db.session.add(Category(name='Fruit'))
+        db.session.commit()
+        with replica.engine.begin() as connection:
+            connection.execute(Category.__table__.insert().values(name='Fruit (replica)', is_active=True, sort_order=0))
+    # No app context is left pushed, so each request gets its own g and session as in production
+    yield app, replica
+    with app.app_context():
+        db.engine.dispose()
+    replica.engine.dispose()
+
+
+def _names(response):
+    return [category['name'] for category in response.get_json()]
+
+
+def test_reads_go_to_the_replica(replicated):
+    app, replica = replicated
+    assert _names(app.test_client().get('/api/categories')) == ['Fruit (replica)']
+
+
+def test_a_write_keeps_the_request_on_the_primary(replicated):
+    app, replica = replicated
+    assert app.test_client().post('/test/write-then-read').get_json() == ['Bakery', 'Fruit']
+    # Reads in later requests go back to the replica
+    assert _names(app.test_client().get('/api/categories')) == ['Fruit (replica)']
+
+
+def test_failing_replica_reruns_the_view_on_the_primary(replicated):
+    app, replica = replicated
+    with app.app_context():
+        db.metadata.drop_all(replica.engine)
+
+    assert _names(app.test_client().get('/api/categories')) == ['Fruit']
+    assert not replica.healthy
+    # Skipped until its retry time has passed
+    assert _names(app.test_client().get('/api/categories')) == ['Fruit']
@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+
+from extensions import db
+from models import SearchLog
+from search_synonyms import (
+    SearchJobCheckpoint, SearchQueryStats, SearchReformulation, SearchSynonym, JOB_NAME, process_search_logs,
+    propose_synonyms
+)
+from conftest import login
+
+START = datetime(2024, 5, 1, 12, 0)
+
+
+def _log(user_id, query, results_count, seconds):
+    db.session.add(SearchLog(user_id=user_id, query=query, results_count=results_count,
+                             created_at=START + timedelta(seconds=seconds)))
+    db.session.commit()
+
+
+def _stats():
+    return {row.term: (row.searches, row.zero_results, row.low_results) for row in SearchQueryStats.query}
+
+
+def test_search_logs_total_matches_once(app, user, make_product):
+    for i in range(5):
+        make_product(f'Apple {i}')
+    client = login(app.test_client(), user)
+
+    assert client.get('/api/search?q=apple&per_page=2').get_json()['pagination']['total'] == 5
+    client.get('/api/search?q=apple&per_page=2&page=3')  # a short last page
+    client.get('/api/search?q=pear')
+    assert db.session.query(SearchLog.query, SearchLog.results_count).order_by(SearchLog.id).all() == [
+        ('apple', 5), ('pear', 0)
+    ]
+
+
+def test_logs_are_folded_in_chunks_and_resumed(app, user, admin):
+    _log(user.id, 'courgette', 0, 0)
+    _log(user.id, 'zucchini', 12, 30)
+    _log(admin.id, 'Courgette ', 0, 40)
+    _log(None, 'zucchini', 2, 50)
+
+    assert process_search_logs(chunk_size=3) == {'rows': 4, 'queries': 3, 'reformulations': 1}
+    assert _stats() == {'courgette': (2, 2, 2), 'zucchini': (2, 0, 1)}
+    assert db.session.get(SearchJobCheckpoint, JOB_NAME).last_log_id == db.session.query(SearchLog.id).count()
+
+    # Only rows after the checkpoint are read on the next run
+    _log(admin.id, 'zucchini', 9, 60)
+    assert process_search_logs() == {'rows': 1, 'queries': 1, 'reformulations': 1}
+    assert _stats() == {'courgette': (2, 2, 2), 'zucchini': (3, 0, 1)}
+    assert [(row.term, row.next_term, row.count) for row in SearchReformulation.query] == [
+        ('courgette', 'zucchini', 2)
+    ]
+    assert process_search_logs() == {'rows': 0, 'queries': 0, 'reformulations': 0}
+
+
+def test_reformulations_outside_the_window_are_ignored(app, user):
+    _log(user.id, 'courgette', 0, 0)
+    _log(user.id, 'zucchini', 12, 600)
+    process_search_logs()
+    assert SearchReformulation.query.count() == 0
+
+
+def test_propose_synonyms(app, user, admin):
+    seconds = 0
+    for user_id in (user.id, admin.id, user.id):
+        _log(user_id, 'courgette', 0, seconds)
+        _log(user_id, 'zucchini', 12, seconds + 10)
+        seconds += 300
+    for _ in range(3):
+        _log(None, 'tomatoes cherry', 1, seconds)
+        _log(None, 'cherry tomato', 8, seconds)
+        _log(None, 'strawbery', 0, seconds)
+        _log(None, 'strawberry', 6, seconds)
+    process_search_logs()
+
+    assert propose_synonyms() == 3
+    proposals = {row.term: (row.replacement, row.reason, row.status) for row in SearchSynonym.query}
+    assert proposals == {
+        'courgette': ('zucchini', 'reformulation', 'proposed'),
+        'tomatoes cherry': ('cherry tomato', 'near_duplicate', 'proposed'),
+        'strawbery': ('strawberry', 'near_duplicate', 'proposed'),
+    }
+    # Decided queries are not proposed again
+    assert propose_synonyms() == 0
@@ -1,3 +1,63 @@
-def send_email(to, subject, template, **kwargs):
-    # This is a placeholder. Replace with real email sending logic.
-    print(f"Sending email to {to} with subject '{subject}' and template '{template}'")
\ No newline at end of file
+# Utility Functions for the Grocery Website
+
+from flask import current_app, render_template
+
+from extensions import db, get_mail
+from models import Product, InventoryLog
+
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
+
+def send_email(to_email, subject, template, **kwargs):
+    """Send email using Flask-Mail or SMTP"""
+    try:
+        if current_app.config['MAIL_USERNAME']:
+            from flask_mail import Message
+            msg = Message(
+                subject=subject,
+                recipients=[to_email],
+                html=render_template(f'emails/{template}', **kwargs),
+                sender=current_app.config['MAIL_DEFAULT_SENDER']
+            )
+            get_mail().send(msg)
+        else:
+            # Fallback SMTP
+            print(f"Email would be sent to {to_email}: {subject}")
+        return True
+    except Exception as e:
+        current_app.logger.error(f"Failed to send email: {str(e)}")
+        return False
+
+def update_inventory(product_id, quantity_change, change_type, reason=None, user_id=None):
+    """Update product inventory and log the change"""
+    product = Product.query.get(product_id)
+    if product:
+        previous_quantity = product.stock_quantity
+        product.stock_quantity += quantity_change
+        
+        # Log the inventory change
+        log = InventoryLog(
+            product_id=product_id,
+            change_type=change_type,
+            quantity_change=quantity_change,
+            previous_quantity=previous_quantity,
+            new_quantity=product.stock_quantity,
+            reason=reason,
+            created_by=user_id
+        )
+        db.session.add(log)
+        
+        # Check for low stock alert
+        if product.stock_quantity <= product.min_stock_level:
+            # Send low stock alert to admin
+            send_email(
+                'admin@grocery.com',
+                'Low Stock Alert',
+                'low_stock_alert.html',
+                product=product
+            )
+        
+        db.session.commit()
+        return True
+    return False